@@ -0,0 +1,168 @@
+"""
+A content addressed local cache of exported apps, so deploying one app to many tenants only exports it once.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def add_export_cache_arguments(parser):
+    parser.add_argument("--export-cache-dir", required=False, default=None,
+                        help="A local directory to cache exported apps in, so an app is only exported again after it has changed.")
+    parser.add_argument("--export-cache-max-size", required=False, type=int, default=10240,
+                        help="The maximum size in MiB of the exported apps kept in the export cache.")
+
+
+def create_export_cache(args):
+    if not args.export_cache_dir:
+        return None
+
+    return AppExportCache(args.export_cache_dir, args.export_cache_max_size * 1024 * 1024)
+
+
+def get_cache_key(sdk_client, app):
+    """
+    The cache key of an app export changes whenever the app is reloaded or modified in the source tenant. Returns None
+    when the app has neither a reload time nor a modified date, its export can't be cached then.
+    """
+    app_version = getattr(app.attributes, "lastReloadTime", None) or getattr(app.attributes, "modifiedDate", None)
+    if not app_version:
+        return None
+
+    return f"{sdk_client.config.host}/{app.attributes.id}/{app_version}"
+
+
+class AppExportCache:
+    """
+    Stores exported apps in `directory`, each distinct export is stored once and named after the SHA-256 hash of its
+    content. An index maps the cache keys to those files. Files are written to a temporary file first and then
+    renamed, so a partially downloaded export is never used. When the exports take up more than `max_size` bytes the
+    least recently used are removed.
+    """
+
+    def __init__(self, directory, max_size=10 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._index_file_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key_lock(self, key):
+        """
+        Returns a lock for the key, holding it while checking and filling the cache makes concurrent deployments of
+        the same app wait for a single export.
+        """
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def open(self, key):
+        """
+        Returns the cached export for the key opened for reading, or None if there is none. The file is opened while
+        holding the cache lock, so it can't be evicted by another export being cached in the meantime.
+        """
+        with self._lock:
+            index = self._read_index()
+            entry = index.get(key)
+            if not entry:
+                return None
+
+            try:
+                file = open(self._get_file_path(entry["sha256"]), "rb")
+            except FileNotFoundError:
+                del index[key]
+                self._write_index(index)
+                return None
+
+            entry["last_used"] = time.time()
+            self._write_index(index)
+
+            return file
+
+    def put(self, key, stream, chunk_size=1024 * 1024):
+        """
+        Reads the export from the file like `stream` into the cache and returns the cached export opened for reading.
+        """
+        content_hash = hashlib.sha256()
+        size = 0
+        file_descriptor, temp_file_path = tempfile.mkstemp(dir=self.directory, prefix=".export-")
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    content_hash.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+
+            sha256 = content_hash.hexdigest()
+            file_path = self._get_file_path(sha256)
+            os.replace(temp_file_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+        with self._lock:
+            index = self._read_index()
+            index[key] = {"sha256": sha256, "size": size, "last_used": time.time()}
+            self._evict(index, keep_sha256=sha256)
+            self._write_index(index)
+            file = open(file_path, "rb")
+
+        logger.info(f"Cached the export with key '{key}' ({size} bytes) as '{file_path}'.")
+        return file
+
+    def _get_file_path(self, sha256):
+        return os.path.join(self.directory, f"{sha256}.qvf")
+
+    def _evict(self, index, keep_sha256):
+        # Entries with the same content share a file, the size and recency are tracked per file
+        files = {}
+        for key, entry in index.items():
+            size, last_used = files.get(entry["sha256"], (entry["size"], 0))
+            files[entry["sha256"]] = (size, max(last_used, entry["last_used"]))
+
+        total_size = sum(size for size, _ in files.values())
+        for sha256, (size, _) in sorted(files.items(), key=lambda file: file[1][1]):
+            if total_size <= self.max_size:
+                break
+            if sha256 == keep_sha256:
+                continue
+
+            try:
+                os.remove(self._get_file_path(sha256))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # On Windows an export that is still being imported can't be removed, it's kept until a later eviction
+                logger.debug(f"Failed to remove the cached export '{sha256}': {e}")
+                continue
+
+            for key in [key for key, entry in index.items() if entry["sha256"] == sha256]:
+                del index[key]
+            total_size -= size
+            logger.info(f"Evicted the cached export '{sha256}' ({size} bytes).")
+
+    def _read_index(self):
+        try:
+            with open(self._index_file_path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"Ignoring the unreadable export cache index '{self._index_file_path}'.")
+            return {}
+
+    def _write_index(self, index):
+        file_descriptor, temp_file_path = tempfile.mkstemp(dir=self.directory, prefix=".index-")
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(index, file)
+        os.replace(temp_file_path, self._index_file_path)
@@ -0,0 +1,129 @@
+"""
+Helpers for running the same unit of work against many tenants concurrently.
+
+Every task runs in isolation: a failure in one task is recorded in its result and never stops the other tasks.
+"""
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import concurrency_controller
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchResult:
+    name: str
+    succeeded: bool = False
+    result: object = None
+    error: str = None
+    duration: float = 0.0
+    attempts: int = 0
+    timings: dict = field(default_factory=dict)
+
+    @contextmanager
+    def time_stage(self, stage_name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage_name] = time.perf_counter() - start_time
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "succeeded": self.succeeded,
+            "error": self.error,
+            "duration": round(self.duration, 3),
+            "attempts": self.attempts,
+            "timings": {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+        }
+
+
+def _run_task(name, task, retries, retry_delay):
+    batch_result = BatchResult(name)
+    start_time = time.perf_counter()
+    try:
+        while True:
+            batch_result.attempts += 1
+            try:
+                batch_result.result = task(batch_result)
+            except (Exception, SystemExit) as e:
+                # The example functions call exit() on some failures, those are isolated to the task as well. They're
+                # validation failures that fail again on every attempt, so they're not retried.
+                logger.exception(f"The task '{batch_result.name}' failed (attempt {batch_result.attempts}).")
+                batch_result.error = f"{type(e).__name__}: {e}"
+                if isinstance(e, SystemExit) or batch_result.attempts > retries:
+                    break
+
+                time.sleep(retry_delay * batch_result.attempts)
+            else:
+                batch_result.succeeded = True
+                batch_result.error = None
+                break
+    finally:
+        batch_result.duration = time.perf_counter() - start_time
+
+    return batch_result
+
+
+def run_batch(tasks, concurrency=1, retries=0, retry_delay=5):
+    """
+    Runs the (name, task) pairs with at most `concurrency` tasks in flight. Each task is called with its
+    BatchResult so it can record stage timings. A failed task is retried up to `retries` times, waiting
+    `retry_delay` seconds longer before every retry, unless it failed by calling exit(). The results are returned in
+    the same order as the tasks.
+    """
+    tasks = list(tasks)
+    if concurrency <= 1:
+        return [_run_task(name, task, retries, retry_delay) for name, task in tasks]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_run_task, name, task, retries, retry_delay) for name, task in tasks]
+        return [future.result() for future in futures]
+
+
+def log_summary(batch_results, total_duration):
+    succeeded_count = sum(1 for batch_result in batch_results if batch_result.succeeded)
+    logger.info(
+        f"Completed {succeeded_count} of {len(batch_results)} tasks successfully in {total_duration:.1f} seconds.")
+
+    for batch_result in batch_results:
+        stage_timings = ", ".join(f"{stage}={seconds:.1f}s" for stage, seconds in batch_result.timings.items())
+        if batch_result.attempts > 1:
+            stage_timings += f", {batch_result.attempts} attempts"
+        if batch_result.succeeded:
+            logger.info(f"  [OK]     {batch_result.name}: {batch_result.duration:.1f}s ({stage_timings})")
+        else:
+            logger.error(
+                f"  [FAILED] {batch_result.name}: {batch_result.duration:.1f}s ({stage_timings}): {batch_result.error}")
+
+    if concurrency_controller.controller:
+        tenant_runs_limit, host_limits = concurrency_controller.controller.get_limits()
+        logger.info(f"Adapted concurrency limits: {tenant_runs_limit} tenant runs"
+                    + "".join(f", {limit} requests to '{host}'" for host, limit in host_limits.items()) + ".")
+
+
+def write_summary(batch_results, total_duration, file_path):
+    """
+    Writes a JSON summary of the results to the file, or to stdout when the file path is '-'.
+    """
+    summary = {
+        "duration": round(total_duration, 3),
+        "succeeded": sum(1 for batch_result in batch_results if batch_result.succeeded),
+        "failed": sum(1 for batch_result in batch_results if not batch_result.succeeded),
+        "results": [batch_result.to_dict() for batch_result in batch_results],
+    }
+
+    if file_path == "-":
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(file_path, "w") as file:
+            json.dump(summary, file, indent=2)
+        logger.info(f"Wrote the summary to '{file_path}'.")
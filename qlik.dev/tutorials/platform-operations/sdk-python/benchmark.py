@@ -0,0 +1,321 @@
+"""
+Measures the throughput of creating, configuring and deploying content to many tenants, against the in-process fake
+Qlik Cloud in fake_qlik_cloud.py, so the effect of a change can be compared between versions without live tenants.
+
+Every scenario is run for each tenant count, the results are appended as JSON lines to the results file and compared
+with the latest result of the same scenario and settings recorded with a different label. For a detailed overview of
+the supported arguments execute:
+
+    python benchmark.py --help
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+
+from argparse_logging import add_log_level_argument
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import app_export_cache
+import batch_runner
+import concurrency_controller
+import http_transport
+import qlik_sdk_helper
+import rate_limiter
+import retry_policy
+import tenant_create
+import tenant_deploy_content
+import tenant_end_to_end
+import tenant_state
+from fake_qlik_cloud import FakeQlikCloud, FakeQlikCloudAdapter
+from jwt_auth import JwtIdpConfig
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ("create", "configure", "deploy", "end_to_end")
+
+OAUTH_CLIENT_ID = "benchmark-client"
+OAUTH_SECRET = "benchmark-secret"
+SOURCE_TENANT_ADMIN_EMAIL = "admin@fake.qlikcloud.com"
+
+
+@dataclass
+class BenchmarkResult:
+    label: str
+    scenario: str
+    tenant_count: int
+    concurrency: int
+    latency: float
+    error_rate: float
+    page_size: int
+    fake_rate_limit: int = None
+    adaptive_concurrency: bool = False
+    http_retries: int = 3
+    hedge_after: float = None
+    duration: float = 0.0
+    throughput: float = 0.0
+    request_count: int = 0
+    throttled_count: int = 0
+    failed_count: int = 0
+    tenant_duration_p50: float = 0.0
+    tenant_duration_p95: float = 0.0
+    timestamp: str = ""
+
+    def get_settings(self):
+        return (self.scenario, self.tenant_count, self.concurrency, self.latency, self.error_rate, self.page_size,
+                self.fake_rate_limit, self.adaptive_concurrency, self.http_retries, self.hedge_after)
+
+
+def generate_jwt_keys(directory):
+    """
+    Writes a new RSA key pair for the JWT identity provider to the directory and returns the JwtIdpConfig for it.
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key_file_path = os.path.join(directory, "private.pem")
+    public_key_file_path = os.path.join(directory, "public.pem")
+    with open(private_key_file_path, "wb") as file:
+        file.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                             serialization.NoEncryption()))
+    with open(public_key_file_path, "wb") as file:
+        file.write(private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                         serialization.PublicFormat.SubjectPublicKeyInfo))
+
+    return JwtIdpConfig("benchmark.fake.qlikcloud.com", "benchmark-key", private_key_file_path, public_key_file_path)
+
+
+def get_quantile(values, quantile):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+
+class BenchmarkEnvironment:
+    """
+    A fake Qlik Cloud with a source tenant and an app to deploy, mounted in the shared HTTP transport. The app is
+    deployed through an export cache in `directory`, so it's exported once like in a fan-out deployment.
+    """
+
+    def __init__(self, args, jwt_idp_config, directory):
+        self.fake_cloud = FakeQlikCloud(latency=args.latency, latency_jitter=args.latency_jitter,
+                                        error_rate=args.error_rate, page_size=args.page_size,
+                                        rate_limit=args.fake_rate_limit, seed=args.seed)
+        controller = None
+        if args.adaptive_concurrency:
+            controller = concurrency_controller.configure_controller(max_tenants=args.concurrency,
+                                                                     latency_target=args.latency_target)
+        http_transport.configure_transport(
+            adapter=FakeQlikCloudAdapter(self.fake_cloud),
+            retry_policy=retry_policy.RetryPolicy(args.http_retries, initial_delay=0.1, hedge_after=args.hedge_after),
+            rate_limiter=rate_limiter.RateLimiter(args.rate_limit_reads, args.rate_limit_writes, args.rate_limit_burst),
+            concurrency_controller=controller)
+        self.jwt_idp_config = jwt_idp_config
+        self.export_cache = app_export_cache.AppExportCache(tempfile.mkdtemp(prefix="export-cache-", dir=directory))
+
+        source_tenant, self.source_app_id = self.fake_cloud.add_source_tenant(SOURCE_TENANT_ADMIN_EMAIL)
+        self.source_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(OAUTH_CLIENT_ID, OAUTH_SECRET,
+                                                                          source_tenant.hostname)
+        self.tenant_registration_sdk_client = qlik_sdk_helper.create_sdk_client(
+            OAUTH_CLIENT_ID, OAUTH_SECRET, self.fake_cloud.registration_hostname)
+
+    def create_tenant(self, _=None):
+        return tenant_create.run(self.source_tenant_sdk_client, self.tenant_registration_sdk_client, OAUTH_CLIENT_ID,
+                                 OAUTH_SECRET, SOURCE_TENANT_ADMIN_EMAIL)
+
+    def configure_tenant(self, target_tenant_sdk_client):
+        return tenant_state.run(target_tenant_sdk_client, self.jwt_idp_config)
+
+    def deploy_content(self, target_tenant):
+        target_tenant_sdk_client, (shared_space_id, managed_space_id) = target_tenant
+        return tenant_deploy_content.run(self.source_tenant_sdk_client, self.source_app_id, target_tenant_sdk_client,
+                                         shared_space_id, managed_space_id, self.jwt_idp_config,
+                                         export_cache=self.export_cache)
+
+    def run_end_to_end(self, batch_result):
+        return tenant_end_to_end.run(batch_result, self.source_tenant_sdk_client,
+                                     self.tenant_registration_sdk_client, OAUTH_CLIENT_ID, OAUTH_SECRET,
+                                     SOURCE_TENANT_ADMIN_EMAIL, self.source_app_id, self.jwt_idp_config,
+                                     export_cache=self.export_cache, embed=False)
+
+    def prepare(self, scenario, tenant_count, concurrency):
+        """
+        Returns the inputs of the timed tasks of the scenario. The tenants a scenario works on are created (and
+        configured) here, outside the timed part.
+        """
+        if scenario in ("create", "end_to_end"):
+            return [None] * tenant_count
+
+        tenants = self._run_all(self.create_tenant, [None] * tenant_count, concurrency, "create")
+        if scenario == "configure":
+            return tenants
+
+        space_ids = self._run_all(self.configure_tenant, tenants, concurrency, "configure")
+        return list(zip(tenants, space_ids))
+
+    def get_task_function(self, scenario):
+        return {"create": self.create_tenant, "configure": self.configure_tenant, "deploy": self.deploy_content}[scenario]
+
+    @staticmethod
+    def _run_all(function, inputs, concurrency, description):
+        batch_results = batch_runner.run_batch(
+            [(f"{description} #{index + 1}", lambda _, value=value: function(value))
+             for index, value in enumerate(inputs)], concurrency, retries=2, retry_delay=0)
+        failed_count = sum(1 for batch_result in batch_results if not batch_result.succeeded)
+        if failed_count:
+            raise RuntimeError(f"Failed to {description} {failed_count} tenants for the benchmark.")
+
+        return [batch_result.result for batch_result in batch_results]
+
+
+def run_scenario(environment, scenario, tenant_count, args):
+    inputs = environment.prepare(scenario, tenant_count, args.concurrency)
+
+    if scenario == "end_to_end":
+        tasks = [(f"end to end #{index + 1}", environment.run_end_to_end) for index in range(tenant_count)]
+    else:
+        function = environment.get_task_function(scenario)
+        tasks = [(f"{scenario} #{index + 1}", lambda _, value=value: function(value))
+                 for index, value in enumerate(inputs)]
+
+    request_count = environment.fake_cloud.request_count
+    throttled_count = environment.fake_cloud.throttled_count
+    start_time = time.perf_counter()
+    batch_results = batch_runner.run_batch(tasks, args.concurrency)
+    duration = time.perf_counter() - start_time
+
+    tenant_durations = [batch_result.duration for batch_result in batch_results]
+    return BenchmarkResult(
+        label=args.label,
+        scenario=scenario,
+        tenant_count=tenant_count,
+        concurrency=args.concurrency,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        page_size=args.page_size,
+        fake_rate_limit=args.fake_rate_limit,
+        adaptive_concurrency=args.adaptive_concurrency,
+        http_retries=args.http_retries,
+        hedge_after=args.hedge_after,
+        duration=round(duration, 3),
+        throughput=round(tenant_count / duration, 3),
+        request_count=environment.fake_cloud.request_count - request_count,
+        throttled_count=environment.fake_cloud.throttled_count - throttled_count,
+        failed_count=sum(1 for batch_result in batch_results if not batch_result.succeeded),
+        tenant_duration_p50=round(get_quantile(tenant_durations, 0.5), 3),
+        tenant_duration_p95=round(get_quantile(tenant_durations, 0.95), 3),
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+
+def read_results(file_path):
+    if not os.path.isfile(file_path):
+        return []
+
+    with open(file_path, "r") as file:
+        return [BenchmarkResult(**json.loads(line)) for line in file if line.strip()]
+
+
+def append_result(file_path, result):
+    with open(file_path, "a") as file:
+        file.write(json.dumps(asdict(result)) + "\n")
+
+
+def get_baseline(previous_results, result):
+    """
+    Returns the latest earlier result of the same scenario and settings recorded with a different label, if any.
+    """
+    return next((previous_result for previous_result in reversed(previous_results)
+                 if previous_result.label != result.label and previous_result.get_settings() == result.get_settings()),
+                None)
+
+
+def log_result(result, baseline):
+    logger.info(
+        f"{result.scenario} x {result.tenant_count} tenants: {result.duration:.2f}s, {result.throughput:.2f} tenants/s, "
+        f"{result.request_count} requests, p50 {result.tenant_duration_p50:.2f}s, p95 {result.tenant_duration_p95:.2f}s"
+        + (f", {result.throttled_count} throttled" if result.throttled_count else "")
+        + (f", {result.failed_count} failed" if result.failed_count else ""))
+    if baseline:
+        change = (result.throughput - baseline.throughput) / baseline.throughput * 100 if baseline.throughput else 0
+        logger.info(
+            f"  compared to '{baseline.label}': {baseline.throughput:.2f} -> {result.throughput:.2f} tenants/s "
+            f"({change:+.1f}%), {baseline.request_count} -> {result.request_count} requests, "
+            f"p95 {baseline.tenant_duration_p95:.2f}s -> {result.tenant_duration_p95:.2f}s")
+
+
+def get_default_label():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "local"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_log_level_argument(parser)
+    parser.add_argument("--scenarios", required=False, default=",".join(SCENARIOS),
+                        help=f"A comma separated list of the scenarios to run, from: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--tenant-counts", required=False, default="1,5,20",
+                        help="A comma separated list of the numbers of tenants to run every scenario for.")
+    parser.add_argument("--concurrency", required=False, type=int, default=8,
+                        help="The maximum number of tenants to work on at the same time.")
+    parser.add_argument("--latency", required=False, type=float, default=0.05,
+                        help="The number of seconds the fake Qlik Cloud takes to answer every request.")
+    parser.add_argument("--latency-jitter", required=False, type=float, default=0.0,
+                        help="The maximum number of random seconds added to the latency of every request.")
+    parser.add_argument("--error-rate", required=False, type=float, default=0.0,
+                        help="The fraction of the requests the fake Qlik Cloud answers with a 503 error.")
+    parser.add_argument("--page-size", required=False, type=int, default=100,
+                        help="The maximum number of items on a page of the fake Qlik Cloud list endpoints.")
+    parser.add_argument("--fake-rate-limit", required=False, type=int, default=None,
+                        help="The maximum number of requests per second per host the fake Qlik Cloud answers, further requests get a 429 response.")
+    parser.add_argument("--rate-limit-reads", required=False, type=int, default=1000,
+                        help="The maximum number of read requests per minute to send to a tenant, see rate_limiter.py.")
+    parser.add_argument("--rate-limit-writes", required=False, type=int, default=100,
+                        help="The maximum number of write requests per minute to send to a tenant, see rate_limiter.py.")
+    parser.add_argument("--rate-limit-burst", required=False, type=int, default=10,
+                        help="The number of requests that may be sent to a tenant at once before the rate limits apply.")
+    parser.add_argument("--adaptive-concurrency", required=False, action="store_true", default=False,
+                        help="Adapt the number of tenants and requests in flight to the latency and errors, see concurrency_controller.py. --concurrency is the maximum number of tenants.")
+    parser.add_argument("--latency-target", required=False, type=float, default=2.0,
+                        help="With --adaptive-concurrency, the p95 latency in seconds above which the concurrency is lowered.")
+    parser.add_argument("--http-retries", required=False, type=int, default=3,
+                        help="The number of times an idempotent request is sent again after a 5xx response, see retry_policy.py.")
+    parser.add_argument("--hedge-after", required=False, type=float, default=None,
+                        help="The number of seconds after which a duplicate of a slow GET request is sent, see retry_policy.py.")
+    parser.add_argument("--seed", required=False, type=int, default=None,
+                        help="The seed for the latency jitter and the errors, to repeat a benchmark exactly.")
+    parser.add_argument("--results-file", required=False, default="benchmark-results.jsonl",
+                        help="The file to append the results to as JSON lines, earlier results in it are compared with.")
+    parser.add_argument("--label", required=False, default=None,
+                        help="The label to record the results with, by default the current git commit.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    # The results are always logged, --log-level WARNING hides the logs of the examples
+    logger.setLevel(logging.INFO)
+    args.label = args.label or get_default_label()
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown_scenarios = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown_scenarios:
+        parser.error(f"Unknown scenarios: {', '.join(unknown_scenarios)}.")
+    tenant_counts = [int(tenant_count) for tenant_count in args.tenant_counts.split(",") if tenant_count.strip()]
+
+    previous_results = read_results(args.results_file)
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as temp_directory:
+        jwt_idp_config = generate_jwt_keys(temp_directory)
+        for scenario in scenarios:
+            for tenant_count in tenant_counts:
+                # Every run starts with an empty fake Qlik Cloud, so earlier runs don't slow down the list requests
+                environment = BenchmarkEnvironment(args, jwt_idp_config, temp_directory)
+                result = run_scenario(environment, scenario, tenant_count, args)
+                append_result(args.results_file, result)
+                log_result(result, get_baseline(previous_results, result))
+
+    logger.info(f"Appended the results to '{args.results_file}' with the label '{args.label}'.")
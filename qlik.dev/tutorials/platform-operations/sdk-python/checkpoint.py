@@ -0,0 +1,94 @@
+"""
+A local store of the outputs of completed pipeline stages, so a failed run can be resumed without repeating the
+stages that already completed.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def add_checkpoint_arguments(parser):
+    parser.add_argument("--checkpoint-file", required=False, default=None,
+                        help="A local JSON file to record the outputs of every completed stage in, for example the IDs of the created tenant, spaces and app.")
+    parser.add_argument("--resume", required=False, action="store_true",
+                        help="Skip the stages that are recorded as completed in the checkpoint file and continue with the outputs recorded for them.")
+
+
+def create_checkpoint_store(parser, args):
+    if not args.checkpoint_file:
+        if args.resume:
+            parser.error("--resume requires a --checkpoint-file.")
+        return None
+
+    return CheckpointStore(args.checkpoint_file, args.resume)
+
+
+class CheckpointStore:
+    """
+    Stores the outputs of the stages of every run, by run name and stage name, in a JSON file. The file is rewritten
+    to a temporary file and renamed after every stage, so it stays readable when the execution is interrupted. Unless
+    `resume` is set the stages recorded by earlier executions are discarded.
+    """
+
+    def __init__(self, file_path, resume=False):
+        self.file_path = file_path
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._runs = self._read() if resume else {}
+
+    def get(self, run_name, stage):
+        """
+        Returns the recorded outputs of the stage, or None if the stage hasn't completed.
+        """
+        with self._lock:
+            return self._runs.get(run_name, {}).get(stage)
+
+    def save(self, run_name, stage, outputs):
+        with self._lock:
+            self._runs.setdefault(run_name, {})[stage] = outputs
+            self._write()
+
+        logger.info(f"Recorded the completed stage '{stage}' of '{run_name}' in '{self.file_path}'.")
+
+    def _read(self):
+        try:
+            with open(self.file_path, "r") as file:
+                runs = json.load(file)
+        except FileNotFoundError:
+            logger.warning(f"The checkpoint file '{self.file_path}' doesn't exist, nothing will be resumed.")
+            return {}
+
+        logger.info(f"Read the checkpoints of {len(runs)} runs from '{self.file_path}'.")
+        return runs
+
+    def _write(self):
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        file_descriptor, temp_file_path = tempfile.mkstemp(dir=directory, prefix=".checkpoint-")
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(self._runs, file, indent=2)
+        os.replace(temp_file_path, self.file_path)
+
+
+def run_stage(checkpoint_store, run_name, stage, function, to_outputs=lambda result: result,
+              from_outputs=lambda outputs: outputs):
+    """
+    Returns the result of the stage restored from the checkpoint store with `from_outputs` if the stage has completed
+    before. Otherwise calls `function` and records the outputs of its result, converted with `to_outputs` to values
+    that can be stored as JSON. The checkpoint store may be None, then the function is always called.
+    """
+    if checkpoint_store:
+        outputs = checkpoint_store.get(run_name, stage)
+        if outputs is not None:
+            logger.info(f"Skipping the stage '{stage}' of '{run_name}', it completed in an earlier execution.")
+            return from_outputs(outputs)
+
+    result = function()
+
+    if checkpoint_store:
+        checkpoint_store.save(run_name, stage, to_outputs(result))
+
+    return result
@@ -0,0 +1,201 @@
+"""
+Adapts the number of tenants worked on at the same time, and the number of requests in flight per tenant, to how well
+Qlik Cloud keeps up, instead of relying on a fixed concurrency.
+
+The limits follow an additive increase, multiplicative decrease (AIMD) scheme: while the limit is fully used and the
+p95 latency of the requests stays below the target, the limit is raised by one after every window of requests. A
+429 or 5xx response, a failed request or a p95 latency above the target halves the limit.
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class AimdLimit:
+    """
+    A concurrency limit that adapts to the observed requests, used as a context manager around the limited work.
+
+    * `initial`, `minimum` and `maximum` bound the limit.
+    * `latency_target` is the p95 latency in seconds above which the limit is decreased.
+    * `window` is the number of requests the p95 latency is computed over before the limit is raised.
+    * `backoff_factor` is the factor the limit is multiplied with when decreasing it.
+    * `cooldown` is the minimum number of seconds between two decreases, so a burst of errors caused by the same
+      overload only decreases the limit once.
+    """
+
+    def __init__(self, name, initial=2, minimum=1, maximum=32, latency_target=2.0, window=20, backoff_factor=0.5,
+                 cooldown=2.0):
+        self.name = name
+        self.limit = max(minimum, min(maximum, initial))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.window = window
+        self.backoff_factor = backoff_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._latencies = []
+        self._saturated = False
+        self._last_decrease_time = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def record(self, latency=None, overloaded=False):
+        """
+        Records the outcome of a request: whether it signals an overload (a 429 or 5xx response or a failure) and its
+        latency, if it's representative (None for requests transferring an app).
+        """
+        with self._condition:
+            if overloaded:
+                self._decrease("a throttled or failed request")
+                return
+
+            if latency is None:
+                return
+            self._latencies.append(latency)
+            if len(self._latencies) < self.window:
+                return
+
+            latencies = sorted(self._latencies)
+            p95_latency = latencies[int(0.95 * (len(latencies) - 1))]
+            saturated = self._saturated
+            self._latencies = []
+            self._saturated = False
+
+            if p95_latency > self.latency_target:
+                self._decrease(f"a p95 latency of {p95_latency:.2f}s")
+            elif saturated and self.limit < self.maximum:
+                # Only a limit that was fully used is raised, an unused limit says nothing about the capacity
+                self.limit += 1
+                self._condition.notify_all()
+                logger.info(f"Raised the concurrency limit of {self.name} to {self.limit} "
+                             f"(p95 latency {p95_latency:.2f}s).")
+
+    def _decrease(self, reason):
+        current_time = time.monotonic()
+        if current_time - self._last_decrease_time < self.cooldown:
+            return
+
+        self._last_decrease_time = current_time
+        self._latencies = []
+        self._saturated = False
+        limit = max(self.minimum, int(self.limit * self.backoff_factor))
+        if limit < self.limit:
+            logger.info(f"Lowered the concurrency limit of {self.name} from {self.limit} to {limit} after {reason}.")
+            self.limit = limit
+
+
+def _is_overloaded(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def _is_transfer(request, kwargs):
+    # Exports and imports take as long as the app is large, their latency doesn't say anything about the load
+    return kwargs.get("stream") or not (request.body is None or isinstance(request.body, (bytes, str)))
+
+
+class ConcurrencyController:
+    """
+    Holds an AimdLimit for the tenant runs across the whole execution, and one per tenant host for the requests in
+    flight to that tenant. It's an HttpTransport interceptor, every request waits for a slot of its tenant and its
+    outcome is recorded in the limit of its tenant and in the limit of the tenant runs.
+    """
+
+    def __init__(self, max_tenants=32, max_requests_per_tenant=8, latency_target=2.0, initial_tenants=2,
+                 initial_requests_per_tenant=2):
+        self.max_requests_per_tenant = max_requests_per_tenant
+        self.latency_target = latency_target
+        self.initial_requests_per_tenant = initial_requests_per_tenant
+        self.tenant_runs = AimdLimit("the tenant runs", initial_tenants, maximum=max_tenants,
+                                     latency_target=latency_target)
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def get_host_limit(self, host):
+        with self._lock:
+            host_limit = self._host_limits.get(host)
+            if host_limit is None:
+                host_limit = self._host_limits[host] = AimdLimit(
+                    f"the requests to '{host}'", self.initial_requests_per_tenant,
+                    maximum=self.max_requests_per_tenant, latency_target=self.latency_target)
+            return host_limit
+
+    def get_limits(self):
+        """
+        Returns the current limit of the tenant runs and the limits of the requests by tenant host.
+        """
+        with self._lock:
+            return self.tenant_runs.limit, {host: host_limit.limit for host, host_limit in self._host_limits.items()}
+
+    def __call__(self, send, request, **kwargs):
+        host_limit = self.get_host_limit(urlparse(request.url).hostname)
+        latency = None
+        overloaded = True
+        with host_limit:
+            start_time = time.perf_counter()
+            try:
+                response = send(request, **kwargs)
+                overloaded = _is_overloaded(response.status_code)
+                if not _is_transfer(request, kwargs):
+                    latency = time.perf_counter() - start_time
+            finally:
+                host_limit.record(latency, overloaded)
+                self.tenant_runs.record(latency, overloaded)
+
+        return response
+
+
+controller = None
+# Whether the current tenant run already holds a slot, the steps it runs on other threads inherit it (see step_scheduler)
+_holds_tenant_slot = contextvars.ContextVar("holds_tenant_slot", default=False)
+
+
+def configure_controller(**kwargs):
+    """
+    Sets up the controller used by the functions decorated with `limited`, with the ConcurrencyController arguments.
+    The controller must also be added to the HTTP transport to adapt to the requests.
+    """
+    global controller
+    controller = ConcurrencyController(**kwargs)
+    return controller
+
+
+def limited(function):
+    """
+    Decorates a function working on a tenant, for example a run() function, so that at most the current limit of
+    tenant runs execute at the same time. A decorated function called from within a tenant run, for example the stages
+    of an end to end run, uses the slot of that run instead of waiting for another one. Without a configured
+    controller the function is called directly.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if controller is None or _holds_tenant_slot.get():
+            return function(*args, **kwargs)
+
+        with controller.tenant_runs:
+            token = _holds_tenant_slot.set(True)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _holds_tenant_slot.reset(token)
+
+    return wrapper
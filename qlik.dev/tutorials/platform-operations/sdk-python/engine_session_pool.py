@@ -0,0 +1,181 @@
+"""
+A pool of open Qlik engine (websocket) sessions, so that repeated engine operations on the same app reuse an open app
+instead of paying for the websocket handshake and opening the app every time.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def get_app_version(app):
+    """
+    Returns the version of an app (an NxApp from the REST API), which changes whenever the app is reloaded or
+    (re)published.
+    """
+    return getattr(app.attributes, "lastReloadTime", None), getattr(app.attributes, "publishTime", None)
+
+
+class _PooledSession:
+
+    def __init__(self, key, app, rpc_session, version):
+        self.key = key
+        self.app = app
+        self.rpc_session = rpc_session
+        self.version = version
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+    def is_usable(self, version):
+        return not self.retired and self.version == version and self.rpc_session.is_connected()
+
+
+class EngineSessionPool:
+    """
+    Keeps the engine sessions of opened apps by (tenant hostname, app ID). A session is shared by all concurrent users
+    of the same app, the SDK sends the engine requests of a session thread safely.
+
+    A session is reopened when the app has been reloaded or republished since it was opened (see get_app_version) or
+    when its websocket was disconnected. Sessions that haven't been used for `idle_timeout` seconds are closed by a
+    background thread, and when more than `max_sessions` sessions are open the least recently used idle sessions are
+    closed. The pool has to be closed explicitly once it isn't needed anymore: the SDK reads each websocket on a
+    non-daemon thread, so an open session keeps the process from exiting.
+    """
+
+    def __init__(self, idle_timeout=300, max_sessions=16):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._eviction_thread = None
+
+    @contextmanager
+    def session(self, sdk_client, app):
+        """
+        Yields the app (an NxApp from the REST API) opened in a pooled engine session, for example:
+
+            with session_pool.session(sdk_client, sdk_client.apps.get(app_id)) as opened_app:
+                opened_app.get_app_layout()
+        """
+        key = (sdk_client.config.host, app.attributes.id)
+        version = get_app_version(app)
+
+        # Only one thread opens the session of an app, the others wait for it and share it
+        with self._get_key_lock(key):
+            pooled_session = self._check_out(key, version)
+            if pooled_session is None:
+                pooled_session = self._open(key, app, version)
+
+        try:
+            yield pooled_session.app
+        finally:
+            self._check_in(pooled_session)
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _check_out(self, key, version):
+        sessions_to_close = []
+        try:
+            with self._lock:
+                pooled_session = self._sessions.get(key)
+                if pooled_session and pooled_session.is_usable(version):
+                    pooled_session.users += 1
+                    return pooled_session
+
+                if pooled_session:
+                    # The session is closed once the threads still using it are done with it
+                    del self._sessions[key]
+                    pooled_session.retired = True
+                    if pooled_session.users == 0:
+                        sessions_to_close.append(pooled_session)
+                return None
+        finally:
+            for pooled_session in sessions_to_close:
+                self._close(pooled_session, "the app has changed or its session was disconnected")
+
+    def _open(self, key, app, version):
+        start_time = time.perf_counter()
+        rpc_session = app.open()
+        logger.info(f"Opened an engine session to the app with ID '{key[1]}' on tenant '{key[0]}' in "
+                    f"{time.perf_counter() - start_time:.2f} seconds.")
+
+        pooled_session = _PooledSession(key, app, rpc_session, version)
+        pooled_session.users = 1
+        with self._lock:
+            self._sessions[key] = pooled_session
+            if not self._eviction_thread:
+                self._eviction_thread = threading.Thread(target=self._evict_idle_sessions,
+                                                         name="engine-session-eviction", daemon=True)
+                self._eviction_thread.start()
+
+        return pooled_session
+
+    def _check_in(self, pooled_session):
+        with self._lock:
+            pooled_session.users -= 1
+            pooled_session.last_used = time.monotonic()
+            close_session = pooled_session.retired and pooled_session.users == 0
+            sessions_to_close = self._remove_least_recently_used()
+
+        if close_session:
+            self._close(pooled_session, "it was replaced by a new session")
+        for idle_session in sessions_to_close:
+            self._close(idle_session, f"more than {self.max_sessions} sessions are open")
+
+    def _remove_least_recently_used(self):
+        idle_sessions = sorted((pooled_session for pooled_session in self._sessions.values() if pooled_session.users == 0),
+                               key=lambda pooled_session: pooled_session.last_used)
+        removed_sessions = idle_sessions[:max(0, len(self._sessions) - self.max_sessions)]
+        for pooled_session in removed_sessions:
+            del self._sessions[pooled_session.key]
+        return removed_sessions
+
+    def _evict_idle_sessions(self):
+        while True:
+            time.sleep(min(30, self.idle_timeout / 2))
+            self.evict_idle()
+
+    def evict_idle(self):
+        """
+        Closes the sessions that haven't been used for `idle_timeout` seconds.
+        """
+        current_time = time.monotonic()
+        with self._lock:
+            idle_sessions = [pooled_session for pooled_session in self._sessions.values()
+                             if pooled_session.users == 0 and current_time - pooled_session.last_used > self.idle_timeout]
+            for pooled_session in idle_sessions:
+                del self._sessions[pooled_session.key]
+
+        for pooled_session in idle_sessions:
+            self._close(pooled_session, f"it was idle for more than {self.idle_timeout} seconds")
+
+    def close(self):
+        """
+        Closes all the sessions, the pool can still be used afterwards.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for pooled_session in sessions:
+            self._close(pooled_session, "the pool was closed")
+
+    @staticmethod
+    def _close(pooled_session, reason):
+        try:
+            pooled_session.app.close()
+        except Exception as e:
+            # The websocket may already be gone, there's nothing left to clean up then
+            logger.debug(f"Closing the engine session to the app with ID '{pooled_session.key[1]}' failed: {e}")
+
+        logger.info(f"Closed the engine session to the app with ID '{pooled_session.key[1]}' on tenant "
+                    f"'{pooled_session.key[0]}' because {reason}.")
+
+
+session_pool = EngineSessionPool()
@@ -0,0 +1,619 @@
+"""
+An in-process stand-in for the Qlik Cloud REST APIs used by the examples, to exercise and benchmark them without live
+tenants. It's mounted in the shared HTTP transport as a requests adapter, so every request of the Qlik SDK clients,
+JWT sessions and OAuth token requests is answered by it:
+
+    fake_cloud = FakeQlikCloud(latency=0.05, page_size=10)
+    http_transport.configure_transport(adapter=FakeQlikCloudAdapter(fake_cloud))
+
+It only implements the endpoints and the fields the examples use, with the behavior they rely on: tenant creation,
+OAuth tokens, JWT sessions that create users and groups, users, roles, groups, identity providers, spaces and
+assignments, items, app export, import and publish, web integrations and CSP origins. The engine (websocket) APIs are
+not implemented.
+"""
+import base64
+import collections
+import datetime
+import http
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import jwt
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import constants
+
+
+class FakeApiError(Exception):
+
+    def __init__(self, status, title):
+        super().__init__(title)
+        self.status = status
+        self.title = title
+
+
+def _new_id():
+    return uuid.uuid4().hex[:24]
+
+
+def _now():
+    # Microseconds keep the ordering of items updated in quick succession
+    return datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _parse_eq_filter(filter_expression, field_name):
+    match = re.match(rf'^\s*{field_name}\s+eq\s+"((?:[^"\\]|\\.)*)"\s*$', filter_expression or "")
+    if not match:
+        return None
+    return match.group(1).replace('\\"', '"').replace("\\\\", "\\")
+
+
+class FakeTenant:
+
+    def __init__(self, hostname):
+        self.id = _new_id()
+        self.hostname = hostname
+        self.users = {}
+        self.roles = [{"id": _new_id(), "name": name, "type": "default"} for name in (
+            "AnalyticsAdmin", "AuditAdmin", "DataAdmin", "Developer", "SharedSpaceCreator", "ManagedSpaceCreator",
+            "DataSpaceCreator", "PrivateAnalyticsContentCreator", "TenantAdmin", "Steward", "Observer", "Analyzer")]
+        self.groups = {}
+        self.group_settings = {"autoCreateGroups": False, "syncIdpGroups": False}
+        self.license_settings = {"autoAssignProfessional": False, "autoAssignAnalyzer": False}
+        self.identity_providers = []
+        self.spaces = {}
+        self.assignments = {}
+        self.apps = {}
+        self.app_contents = {}
+        self.temp_contents = {}
+        self.web_integrations = []
+        self.csp_origins = []
+        # The user the OAuth client acts as, a tenant admin
+        self.bot_user = self.add_user("oauth-client", "OAuth client", "oauth-client@fake.qlikcloud.com",
+                                      roles=[constants.ROLE_TENANT_ADMIN])
+
+    def add_user(self, subject, name, email, roles=(), groups=()):
+        user = {"id": _new_id(), "tenantId": self.id, "subject": subject, "name": name, "email": email,
+                "status": "active", "roles": list(roles), "assignedGroups": list(groups), "createdAt": _now()}
+        self.users[user["id"]] = user
+        return user
+
+    def add_space(self, name, space_type, owner_id):
+        space = {"id": _new_id(), "name": name, "type": space_type, "ownerId": owner_id, "tenantId": self.id,
+                 "createdAt": _now(), "meta": {"roles": []}}
+        self.spaces[space["id"]] = space
+        self.assignments[space["id"]] = []
+        return space
+
+    def add_app(self, name, space_id, owner_id, content=None, origin_app_id=None):
+        app_id = str(uuid.uuid4())
+        attributes = {"id": app_id, "name": name, "ownerId": owner_id, "createdDate": _now(), "modifiedDate": _now(),
+                      "lastReloadTime": _now(), "published": bool(origin_app_id), "publishTime": "",
+                      "usage": "ANALYTICS_USAGE"}
+        if space_id:
+            attributes["spaceId"] = space_id
+        if origin_app_id:
+            attributes["originAppId"] = origin_app_id
+            attributes["publishTime"] = _now()
+        self.apps[app_id] = {"attributes": attributes, "item_updated_at": _now()}
+        # The first line of an exported app identifies the app it was exported from
+        self.app_contents[app_id] = content or (f"QVF:{app_id}\n".encode() + b"\0" * (256 * 1024))
+        return self.apps[app_id]
+
+    def get_user_group_ids(self, user):
+        return {group["id"] for group in self.groups.values() if group["name"] in user["assignedGroups"]}
+
+
+class FakeQlikCloud:
+    """
+    The state of all the fake tenants and the request handling.
+
+    * `latency` is the number of seconds every request takes, `latency_jitter` the maximum random extra seconds.
+    * `error_rate` is the fraction of requests (except for tenant creation) that fail with a 503 response.
+    * `page_size` is the maximum number of items on a page of a list endpoint, smaller pages exercise the pagination.
+    * `rate_limit` is the maximum number of requests per second per host, further requests get a 429 response with a
+      `Retry-After` of one second.
+    """
+
+    _instance_ids = itertools.count(1)
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, page_size=100, rate_limit=None, seed=None,
+                 registration_hostname="register.fake.qlikcloud.com"):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.rate_limit = rate_limit
+        self.registration_hostname = registration_hostname
+        self.tenants = {}
+        self.request_count = 0
+        self.error_count = 0
+        self.throttled_count = 0
+        self._request_times = {}
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        # Hostnames are unique per instance, so caches keyed by hostname don't carry over between instances
+        self._hostname_prefix = f"fake{next(self._instance_ids)}-{uuid.uuid4().hex[:6]}"
+        self._tenant_numbers = itertools.count(1)
+        self._oauth_tokens = {}
+        self._routes = [
+            ("POST", r"/oauth/token", self._create_oauth_token),
+            ("POST", r"/login/jwt-session", self._create_jwt_session),
+            ("POST", r"/api/v1/tenants", self._create_tenant),
+            ("GET", r"/api/v1/licenses/overview", self._get_license_overview),
+            ("GET", r"/api/v1/licenses/settings", lambda tenant, user, request: tenant.license_settings),
+            ("PUT", r"/api/v1/licenses/settings", self._update_license_settings),
+            ("GET", r"/api/v1/groups/settings", lambda tenant, user, request: tenant.group_settings),
+            ("PATCH", r"/api/v1/groups/settings", self._patch_group_settings),
+            ("GET", r"/api/v1/groups", self._list_groups),
+            ("GET", r"/api/v1/roles", lambda tenant, user, request: self._paginate(request, tenant.roles)),
+            ("GET", r"/api/v1/users/me", lambda tenant, user, request: user),
+            ("GET", r"/api/v1/users", self._list_users),
+            ("POST", r"/api/v1/users", self._create_user),
+            ("DELETE", r"/api/v1/users/(?P<user_id>[^/]+)", self._delete_user),
+            ("GET", r"/api/v1/identity-providers",
+             lambda tenant, user, request: self._paginate(request, tenant.identity_providers)),
+            ("POST", r"/api/v1/identity-providers", self._create_identity_provider),
+            ("GET", r"/api/v1/spaces", self._list_spaces),
+            ("POST", r"/api/v1/spaces", self._create_space),
+            ("GET", r"/api/v1/spaces/(?P<space_id>[^/]+)", self._get_space),
+            ("GET", r"/api/v1/spaces/(?P<space_id>[^/]+)/assignments", self._list_assignments),
+            ("POST", r"/api/v1/spaces/(?P<space_id>[^/]+)/assignments", self._create_assignment),
+            ("PUT", r"/api/v1/spaces/(?P<space_id>[^/]+)/assignments/(?P<assignment_id>[^/]+)",
+             self._update_assignment),
+            ("GET", r"/api/v1/items", self._list_items),
+            ("POST", r"/api/v1/apps/import", self._import_app),
+            ("GET", r"/api/v1/apps/(?P<app_id>[^/]+)", self._get_app),
+            ("POST", r"/api/v1/apps/(?P<app_id>[^/]+)/export", self._export_app),
+            ("POST", r"/api/v1/apps/(?P<app_id>[^/]+)/publish", self._publish_app),
+            ("PUT", r"/api/v1/apps/(?P<app_id>[^/]+)/publish", self._republish_app),
+            ("GET", r"/api/v1/temp-contents/(?P<content_id>[^/]+)", self._get_temp_content),
+            ("GET", r"/api/v1/web-integrations",
+             lambda tenant, user, request: self._paginate(request, tenant.web_integrations)),
+            ("POST", r"/api/v1/web-integrations", self._create_web_integration),
+            ("GET", r"/api/v1/csp-origins", lambda tenant, user, request: self._paginate(request, tenant.csp_origins)),
+            ("POST", r"/api/v1/csp-origins", self._create_csp_origin),
+        ]
+
+    def add_tenant(self):
+        with self._lock:
+            tenant = FakeTenant(f"{self._hostname_prefix}-t{next(self._tenant_numbers)}.fake.qlikcloud.com")
+            self.tenants[tenant.hostname] = tenant
+            return tenant
+
+    def add_source_tenant(self, admin_email="admin@fake.qlikcloud.com", app_size=256 * 1024):
+        """
+        Adds a tenant with a tenant admin user with the email and an app in a shared space, to deploy from.
+        Returns the tenant and the app ID.
+        """
+        with self._lock:
+            tenant = self.add_tenant()
+            tenant.add_user("source-admin", "Source Admin", admin_email, roles=[constants.ROLE_TENANT_ADMIN])
+            space = tenant.add_space("source-shared", "shared", tenant.bot_user["id"])
+            app = tenant.add_app("Source App", space["id"], tenant.bot_user["id"])
+            app_id = app["attributes"]["id"]
+            tenant.app_contents[app_id] = f"QVF:{app_id}\n".encode() + b"\0" * app_size
+            return tenant, app_id
+
+    def handle(self, method, url, headers, body):
+        """
+        Returns the (status, headers, body) of the response to the request.
+        """
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + self._random.random() * self.latency_jitter)
+
+        parsed_url = urlparse(url)
+        with self._lock:
+            self.request_count += 1
+            if self.rate_limit and self._is_throttled(parsed_url.hostname):
+                self.throttled_count += 1
+                status, headers, body = self._error_response(FakeApiError(429, "Too Many Requests"))
+                return status, dict(headers, **{"Retry-After": "1"}), body
+            if (self.error_rate and parsed_url.hostname != self.registration_hostname
+                    and self._random.random() < self.error_rate):
+                self.error_count += 1
+                return self._error_response(FakeApiError(503, "Service Unavailable"))
+
+            try:
+                handler, path_params = self._route(method, parsed_url.path)
+                request = {"path": parsed_url.path, "query": parse_qs(parsed_url.query), "headers": headers,
+                           "body": body, "path_params": path_params, "host": parsed_url.hostname}
+                tenant, user = self._authenticate(parsed_url, headers)
+                result = handler(tenant, user, request)
+            except FakeApiError as e:
+                return self._error_response(e)
+
+        if isinstance(result, tuple):
+            return result
+        if result is None:
+            return 204, {}, b""
+        return 200, {"Content-Type": "application/json"}, json.dumps(result).encode()
+
+    def _is_throttled(self, hostname):
+        # A sliding window of the times of the requests to the host in the last second
+        request_times = self._request_times.setdefault(hostname, collections.deque())
+        current_time = time.monotonic()
+        while request_times and request_times[0] <= current_time - 1:
+            request_times.popleft()
+        if len(request_times) >= self.rate_limit:
+            return True
+
+        request_times.append(current_time)
+        return False
+
+    def _route(self, method, path):
+        path_exists = False
+        for route_method, route_pattern, handler in self._routes:
+            match = re.fullmatch(route_pattern, path)
+            if match:
+                if route_method == method:
+                    return handler, match.groupdict()
+                path_exists = True
+
+        raise FakeApiError(405 if path_exists else 404, "Not Found")
+
+    @staticmethod
+    def _error_response(error):
+        body = {"errors": [{"code": f"HTTP-{error.status}", "title": error.title, "status": str(error.status)}]}
+        return error.status, {"Content-Type": "application/json"}, json.dumps(body).encode()
+
+    def _authenticate(self, parsed_url, headers):
+        if parsed_url.hostname == self.registration_hostname:
+            # The registration endpoint only creates tenants, any OAuth client may use it
+            return None, None
+
+        tenant = self.tenants.get(parsed_url.hostname)
+        if not tenant:
+            raise FakeApiError(404, f"The tenant '{parsed_url.hostname}' doesn't exist")
+        if parsed_url.path == "/oauth/token":
+            return tenant, None
+
+        authorization = headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            raise FakeApiError(401, "Not authenticated")
+        token = authorization[len("Bearer "):]
+
+        if self._oauth_tokens.get(token) == tenant.hostname:
+            return tenant, tenant.bot_user
+
+        # JWT sessions send the JWT with every request
+        claims = self._decode_jwt(tenant, token)
+        if parsed_url.path == "/login/jwt-session":
+            return tenant, claims
+
+        user = next((user for user in tenant.users.values() if user["subject"] == claims["sub"]), None)
+        if not user:
+            raise FakeApiError(401, "The JWT session has expired")
+        return tenant, user
+
+    @staticmethod
+    def _decode_jwt(tenant, token):
+        try:
+            header = jwt.get_unverified_header(token)
+            claims = jwt.decode(token, options={"verify_signature": False})
+        except jwt.PyJWTError:
+            raise FakeApiError(401, "Invalid token")
+
+        for identity_provider in tenant.identity_providers:
+            options = identity_provider["options"]
+            if (options["issuer"] == claims.get("iss")
+                    and any(key["kid"] == header.get("kid") for key in options["staticKeys"])):
+                return claims
+
+        raise FakeApiError(401, "No identity provider for the JWT")
+
+    def _paginate(self, request, entries):
+        limit = min(int(request["query"].get("limit", [self.page_size])[0]), self.page_size)
+        offset = int(request["query"].get("next", ["0"])[0])
+        page = {"data": entries[offset:offset + limit], "links": {}}
+        if offset + limit < len(entries):
+            query = {name: values[0] for name, values in request["query"].items()}
+            query["next"] = str(offset + limit)
+            page["links"]["next"] = {"href": f"https://{request['host']}{request['path']}?{urlencode(query)}"}
+        return page
+
+    @staticmethod
+    def _get_json_body(request):
+        try:
+            return json.loads(request["body"] or b"{}")
+        except ValueError:
+            raise FakeApiError(400, "Invalid JSON body")
+
+    @staticmethod
+    def _require_admin(user):
+        if constants.ROLE_TENANT_ADMIN not in user.get("roles", []):
+            raise FakeApiError(403, "Forbidden")
+
+    def _create_oauth_token(self, tenant, user, request):
+        body = self._get_json_body(request)
+        if not body.get("client_id") or not body.get("client_secret"):
+            raise FakeApiError(401, "Invalid client credentials")
+
+        access_token = f"fake-oauth-{uuid.uuid4().hex}"
+        self._oauth_tokens[access_token] = request["host"]
+        return {"access_token": access_token, "token_type": "bearer", "expires_in": 3600}
+
+    def _create_jwt_session(self, tenant, claims, request):
+        user = next((user for user in tenant.users.values() if user["subject"] == claims["sub"]), None)
+        if not user:
+            user = tenant.add_user(claims["sub"], claims.get("name"), claims.get("email"))
+
+        user["assignedGroups"] = list(claims.get("groups", []))
+        if tenant.group_settings.get("autoCreateGroups"):
+            existing_group_names = {group["name"] for group in tenant.groups.values()}
+            for group_name in user["assignedGroups"]:
+                if group_name not in existing_group_names:
+                    group = {"id": _new_id(), "name": group_name, "status": "active", "tenantId": tenant.id}
+                    tenant.groups[group["id"]] = group
+
+        return None
+
+    def _create_tenant(self, tenant, user, request):
+        if request["host"] != self.registration_hostname:
+            raise FakeApiError(404, "Not Found")
+        if not self._get_json_body(request).get("licenseKey"):
+            raise FakeApiError(400, "A license key is required")
+
+        new_tenant = self.add_tenant()
+        return 201, {"Content-Type": "application/json"}, json.dumps(
+            {"id": new_tenant.id, "hostnames": [new_tenant.hostname], "status": "active"}).encode()
+
+    def _get_license_overview(self, tenant, user, request):
+        self._require_admin(user)
+        return {"licenseKey": base64.b64encode(f"license-{tenant.id}".encode()).decode(), "licenseNumber": tenant.id}
+
+    def _update_license_settings(self, tenant, user, request):
+        self._require_admin(user)
+        tenant.license_settings.update(self._get_json_body(request))
+        return tenant.license_settings
+
+    def _patch_group_settings(self, tenant, user, request):
+        self._require_admin(user)
+        for operation in self._get_json_body(request):
+            tenant.group_settings[operation["path"].lstrip("/")] = operation["value"]
+        return None
+
+    def _list_groups(self, tenant, user, request):
+        groups = list(tenant.groups.values())
+        group_name = _parse_eq_filter(request["query"].get("filter", [""])[0], "name")
+        if group_name is not None:
+            groups = [group for group in groups if group["name"] == group_name]
+        return self._paginate(request, groups)
+
+    def _list_users(self, tenant, user, request):
+        users = list(tenant.users.values())
+        email = _parse_eq_filter(request["query"].get("filter", [""])[0], "email")
+        if email is not None:
+            users = [user for user in users if user["email"] == email]
+        return self._paginate(request, users)
+
+    def _create_user(self, tenant, user, request):
+        self._require_admin(user)
+        body = self._get_json_body(request)
+        if any(user["subject"] == body.get("subject") for user in tenant.users.values()):
+            raise FakeApiError(409, "A user with the subject already exists")
+        role_names = {role["id"]: role["name"] for role in tenant.roles}
+        new_user = tenant.add_user(body.get("subject"), body.get("name"), body.get("email"),
+                                   roles=[role_names[role["id"]] for role in body.get("assignedRoles", [])
+                                          if role["id"] in role_names])
+        return 201, {"Content-Type": "application/json"}, json.dumps(new_user).encode()
+
+    def _delete_user(self, tenant, user, request):
+        self._require_admin(user)
+        if not tenant.users.pop(request["path_params"]["user_id"], None):
+            raise FakeApiError(404, "Not Found")
+        return None
+
+    def _create_identity_provider(self, tenant, user, request):
+        self._require_admin(user)
+        identity_provider = dict(self._get_json_body(request), id=_new_id())
+        tenant.identity_providers.append(identity_provider)
+        return 201, {"Content-Type": "application/json"}, json.dumps(identity_provider).encode()
+
+    def _list_spaces(self, tenant, user, request):
+        spaces = list(tenant.spaces.values())
+        name = request["query"].get("name", [None])[0]
+        if name:
+            spaces = [space for space in spaces if name.lower() in space["name"].lower()]
+        return self._paginate(request, spaces)
+
+    def _create_space(self, tenant, user, request):
+        body = self._get_json_body(request)
+        if any(space["name"] == body["name"] for space in tenant.spaces.values()):
+            raise FakeApiError(409, "A space with the name already exists")
+        space = tenant.add_space(body["name"], body["type"], user["id"])
+        return 201, {"Content-Type": "application/json"}, json.dumps(space).encode()
+
+    def _get_space_or_404(self, tenant, space_id):
+        space = tenant.spaces.get(space_id)
+        if not space:
+            raise FakeApiError(404, "Not Found")
+        return space
+
+    def _get_space(self, tenant, user, request):
+        return self._get_space_or_404(tenant, request["path_params"]["space_id"])
+
+    def _list_assignments(self, tenant, user, request):
+        space = self._get_space_or_404(tenant, request["path_params"]["space_id"])
+        return self._paginate(request, tenant.assignments[space["id"]])
+
+    def _create_assignment(self, tenant, user, request):
+        space = self._get_space_or_404(tenant, request["path_params"]["space_id"])
+        body = self._get_json_body(request)
+        if any(assignment["assigneeId"] == body["assigneeId"] for assignment in tenant.assignments[space["id"]]):
+            raise FakeApiError(409, "The assignee is already assigned to the space")
+
+        assignment = {"id": _new_id(), "type": body["type"], "assigneeId": body["assigneeId"],
+                      "roles": body["roles"], "spaceId": space["id"], "tenantId": tenant.id, "createdAt": _now()}
+        tenant.assignments[space["id"]].append(assignment)
+        return 201, {"Content-Type": "application/json"}, json.dumps(assignment).encode()
+
+    def _update_assignment(self, tenant, user, request):
+        space = self._get_space_or_404(tenant, request["path_params"]["space_id"])
+        for assignment in tenant.assignments[space["id"]]:
+            if assignment["id"] == request["path_params"]["assignment_id"]:
+                assignment["roles"] = self._get_json_body(request)["roles"]
+                return assignment
+        raise FakeApiError(404, "Not Found")
+
+    def _list_items(self, tenant, user, request):
+        space_id = request["query"].get("spaceId", [None])[0]
+        items = [{
+            "id": _new_id(),
+            "resourceType": "app",
+            "resourceId": app["attributes"]["id"],
+            "name": app["attributes"]["name"],
+            "spaceId": app["attributes"].get("spaceId"),
+            "updatedAt": app["item_updated_at"],
+            "resourceAttributes": dict(app["attributes"]),
+        } for app in tenant.apps.values() if not space_id or app["attributes"].get("spaceId") == space_id]
+        if request["query"].get("sort", [""])[0] == "-updatedAt":
+            items.sort(key=lambda item: item["updatedAt"], reverse=True)
+        return self._paginate(request, items)
+
+    def _can_access_app(self, tenant, user, app):
+        if constants.ROLE_TENANT_ADMIN in user.get("roles", []):
+            return True
+
+        space_id = app["attributes"].get("spaceId")
+        assignee_ids = tenant.get_user_group_ids(user) | {user["id"]}
+        return any(assignment["assigneeId"] in assignee_ids for assignment in tenant.assignments.get(space_id, []))
+
+    def _get_app_or_404(self, tenant, user, app_id):
+        app = tenant.apps.get(app_id)
+        if not app:
+            raise FakeApiError(404, "Not Found")
+        if not self._can_access_app(tenant, user, app):
+            raise FakeApiError(403, "Forbidden")
+        return app
+
+    def _get_app(self, tenant, user, request):
+        app = self._get_app_or_404(tenant, user, request["path_params"]["app_id"])
+        return {"attributes": app["attributes"], "privileges": ["read"]}
+
+    def _export_app(self, tenant, user, request):
+        app = self._get_app_or_404(tenant, user, request["path_params"]["app_id"])
+        content_id = _new_id()
+        tenant.temp_contents[content_id] = tenant.app_contents[app["attributes"]["id"]]
+        return 201, {"Location": f"/api/v1/temp-contents/{content_id}"}, b""
+
+    def _get_temp_content(self, tenant, user, request):
+        content = tenant.temp_contents.get(request["path_params"]["content_id"])
+        if content is None:
+            raise FakeApiError(404, "Not Found")
+        return 200, {"Content-Type": "application/octet-stream", "Content-Length": str(len(content))}, content
+
+    def _import_app(self, tenant, user, request):
+        space_id = request["query"].get("spaceId", [None])[0]
+        if space_id:
+            self._get_space_or_404(tenant, space_id)
+
+        content = request["body"]
+        header = content.split(b"\n", 1)[0].decode(errors="replace")
+        if not header.startswith("QVF:"):
+            raise FakeApiError(400, "The file is not an app")
+        source_app_id = header[len("QVF:"):]
+
+        # The autoreplace mode replaces the app imported from the same app before
+        app = None
+        if request["query"].get("mode", [""])[0] == "autoreplace":
+            app = next((app for app in tenant.apps.values()
+                        if app.get("imported_from") == source_app_id and app["attributes"].get("spaceId") == space_id),
+                       None)
+        if app:
+            app["attributes"]["modifiedDate"] = _now()
+            app["item_updated_at"] = _now()
+        else:
+            app = tenant.add_app(f"Imported {source_app_id[:8]}", space_id, user["id"])
+            app["imported_from"] = source_app_id
+        tenant.app_contents[app["attributes"]["id"]] = content
+
+        return {"attributes": app["attributes"], "privileges": ["read"]}
+
+    def _publish_app(self, tenant, user, request):
+        app = self._get_app_or_404(tenant, user, request["path_params"]["app_id"])
+        space = self._get_space_or_404(tenant, self._get_json_body(request).get("spaceId"))
+        if space["type"] != "managed":
+            raise FakeApiError(400, "Apps can only be published to managed spaces")
+
+        published_app = tenant.add_app(app["attributes"]["name"], space["id"], user["id"],
+                                       tenant.app_contents[app["attributes"]["id"]], app["attributes"]["id"])
+        return {"attributes": published_app["attributes"], "privileges": ["read"]}
+
+    def _republish_app(self, tenant, user, request):
+        app = self._get_app_or_404(tenant, user, request["path_params"]["app_id"])
+        body = self._get_json_body(request)
+        published_app = tenant.apps.get(body.get("targetId"))
+        if not published_app or published_app["attributes"].get("originAppId") != app["attributes"]["id"]:
+            raise FakeApiError(404, "Not Found")
+
+        published_app["attributes"]["publishTime"] = _now()
+        published_app["item_updated_at"] = _now()
+        tenant.app_contents[published_app["attributes"]["id"]] = tenant.app_contents[app["attributes"]["id"]]
+        return {"attributes": published_app["attributes"], "privileges": ["read"]}
+
+    def _create_web_integration(self, tenant, user, request):
+        body = self._get_json_body(request)
+        web_integration = {"id": _new_id(), "name": body["name"], "validOrigins": body["validOrigins"],
+                           "tenantId": tenant.id}
+        tenant.web_integrations.append(web_integration)
+        return 201, {"Content-Type": "application/json"}, json.dumps(web_integration).encode()
+
+    def _create_csp_origin(self, tenant, user, request):
+        body = self._get_json_body(request)
+        csp_origin = dict(body, id=_new_id(), origin=re.sub(r"^https?://", "", body["origin"]), tenantId=tenant.id)
+        tenant.csp_origins.append(csp_origin)
+        return 201, {"Content-Type": "application/json"}, json.dumps(csp_origin).encode()
+
+
+def _read_body(body):
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode()
+    if isinstance(body, bytes):
+        return body
+    if hasattr(body, "read"):
+        return body.read()
+    # A generator or an iterable stream, sent with a chunked transfer encoding
+    return b"".join(chunk.encode() if isinstance(chunk, str) else bytes(chunk) for chunk in body)
+
+
+class FakeQlikCloudAdapter(BaseAdapter):
+    """
+    A requests adapter that answers the requests with a FakeQlikCloud instead of sending them over the network.
+    """
+
+    def __init__(self, fake_cloud):
+        super().__init__()
+        self.fake_cloud = fake_cloud
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        status, headers, body = self.fake_cloud.handle(request.method.upper(), request.url, request.headers,
+                                                       _read_body(request.body))
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = http.HTTPStatus(status).phrase
+        response.headers = CaseInsensitiveDict(headers)
+        response.raw = io.BytesIO(body)
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+    def close_pools(self):
+        pass
@@ -0,0 +1,169 @@
+"""
+A shared, pooled HTTP transport for all the HTTP requests sent by the examples.
+
+Connections are kept alive in a pool per host, so consecutive requests to the same tenant (from the Qlik SDK client,
+JWT sessions or the OAuth token endpoint) reuse an established TLS connection instead of opening a new one.
+"""
+import functools
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def get_body_position(body):
+    """
+    Returns the position of a request body before it's sent, to rewind it with rewind_body. Returns None for a body
+    that can't be rewound, for example a generator.
+    """
+    if body is None or isinstance(body, (bytes, str)):
+        return 0
+    try:
+        return body.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def rewind_body(body, position):
+    """
+    Prepares the request body to be sent again, returns False if that's not possible.
+    """
+    if body is None or isinstance(body, (bytes, str)):
+        return True
+    if position is None:
+        return False
+    try:
+        body.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
+class _PooledHTTPAdapter(HTTPAdapter):
+
+    def close(self):
+        # Every session using the transport mounts this adapter and closes it when the session is closed. The pools
+        # are owned by the transport, so they're only closed by HttpTransport.close().
+        pass
+
+    def close_pools(self):
+        super().close()
+
+
+class _TransportSession(requests.Session):
+
+    def __init__(self, transport):
+        super().__init__()
+        self.transport = transport
+        self.mount("https://", transport.adapter)
+        self.mount("http://", transport.adapter)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.transport.timeout
+
+        send = super().send
+        for interceptor in reversed(self.transport.interceptors):
+            send = functools.partial(interceptor, send)
+
+        return send(request, **kwargs)
+
+
+class HttpTransport:
+    """
+    Holds the connection pools shared by all sessions created from it.
+
+    * `pool_connections` is the number of hosts to keep a connection pool for.
+    * `pool_maxsize` is the number of connections kept alive per host.
+    * `pool_block` limits the number of concurrent connections per host to `pool_maxsize` when set, otherwise extra
+      connections are opened (and discarded after use) when all pooled connections are busy.
+    * `timeout` is the connect and read timeout in seconds of the requests sent without a timeout.
+    * `adapter` replaces the pooled adapter, for example with fake_qlik_cloud.FakeQlikCloudAdapter to answer the
+      requests in-process. It must implement `close_pools()`.
+    * `retry_policy` retries failed requests and fails requests to unhealthy hosts fast, see retry_policy.RetryPolicy.
+    * `rate_limiter` queues the requests to stay within the rate limits of the tenants, see rate_limiter.RateLimiter.
+    * `concurrency_controller` limits the requests in flight per tenant and adapts the limits to the observed latency
+      and errors, see concurrency_controller.ConcurrencyController.
+
+    Every request is recorded in the metrics registry, see metrics.record_http_metrics. A request that is sent again
+    by the retry policy or the rate limiter is recorded for every attempt.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, timeout=10, adapter=None,
+                 retry_policy=None, rate_limiter=None, concurrency_controller=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self.adapter = adapter or _PooledHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                                     pool_block=pool_block)
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.concurrency_controller = concurrency_controller
+        # Every retry is queued by the rate limiter again. The concurrency controller is behind the rate limiter, so it
+        # observes the throttled responses but not the time requests are queued.
+        self.interceptors = [interceptor for interceptor in (retry_policy, rate_limiter, concurrency_controller)
+                             if interceptor]
+        self.interceptors.append(metrics.record_http_metrics)
+
+    def use(self, interceptor):
+        """
+        Adds an interceptor to every request sent with the transport. An interceptor is called with the function to
+        send the request, the prepared request and the keyword arguments for sending it, and returns the response,
+        for example:
+
+            def log_request(send, request, **kwargs):
+                logger.debug(f"Sending {request.method} {request.url}")
+                return send(request, **kwargs)
+
+        Interceptors are called in the order they were added, the last one added is the closest to the network.
+        """
+        self.interceptors.append(interceptor)
+
+    def create_session(self):
+        """
+        Creates a session that sends its requests over the pooled connections. Each session keeps its own headers and
+        cookies, so sessions for different identities can safely share the transport.
+        """
+        return _TransportSession(self)
+
+    def request(self, method, url, **kwargs):
+        with self.create_session() as session:
+            return session.request(method, url, **kwargs)
+
+    def close(self):
+        self.adapter.close_pools()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport()
+
+        return _transport
+
+
+def configure_transport(**kwargs):
+    """
+    Replaces the shared transport with one created with the given HttpTransport arguments. This is expected to be
+    called once at startup, before any requests are sent.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+
+        _transport = HttpTransport(**kwargs)
+        logger.debug(f"Configured the HTTP transport with {kwargs}.")
+
+        return _transport
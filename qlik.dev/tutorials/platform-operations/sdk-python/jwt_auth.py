@@ -6,15 +6,46 @@ import argparse
 import logging
 import os
 import datetime
+import string
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
 
 import jwt
-import requests
 from argparse_logging import add_log_level_argument
+from cryptography.hazmat.primitives import serialization
+
+import http_transport
 
 logger = logging.getLogger(__name__)
 
+_private_keys = {}
+_private_keys_lock = threading.Lock()
+
+
+def load_private_key(private_key_file_path):
+    """
+    Returns the parsed private key from the PEM file. The key is cached and only read and parsed again when the file
+    has been modified.
+    """
+    modified_time = os.stat(private_key_file_path).st_mtime_ns
+    with _private_keys_lock:
+        cached_modified_time, private_key = _private_keys.get(private_key_file_path, (None, None))
+    if cached_modified_time == modified_time:
+        return private_key
+
+    with open(private_key_file_path, "rb") as file:
+        private_key = serialization.load_pem_private_key(file.read(), password=None)
+
+    with _private_keys_lock:
+        _private_keys[private_key_file_path] = (modified_time, private_key)
+
+    logger.debug(f"Loaded the JWT private key from '{private_key_file_path}'.")
+    return private_key
+
 
 @dataclass
 class JwtIdpConfig:
@@ -56,7 +87,7 @@ class JwtAuth:
 
     def __init__(self, host, jwt_idp_config, subject="jwt_test_user_1", name="JWT Test User 1",
                  email="jwt_test_user_1@jwt.io", email_verified=True, groups=("jwt_test_group_1", "jwt_test_group_2"),
-                 expires_in=60):
+                 expires_in=60, transport=None):
         self.host = host.strip("/")
         self.config = jwt_idp_config
         self.subject = subject
@@ -65,13 +96,13 @@ class JwtAuth:
         self.email_verified = email_verified
         self.groups = list(groups)
         self.expires_in = expires_in
+        self.transport = transport
 
     def rest(self, path, method, data=None, params=None, headers=None):
         response = self._get_session().request(method, self.host + path,
                                                params=params,
                                                data=data,
-                                               headers=headers,
-                                               timeout=10)
+                                               headers=headers)
         response.raise_for_status()
 
         return response
@@ -94,9 +125,8 @@ class JwtAuth:
         if self.groups:
             claims["groups"] = self.groups
 
-        private_key = open(self.config.private_key_file_path, "rb").read()
         return jwt.encode(claims,
-                          private_key,
+                          load_private_key(self.config.private_key_file_path),
                           algorithm="RS256",
                           headers={"alg": "RS256",
                                    "kid": self.config.key_id,
@@ -105,7 +135,8 @@ class JwtAuth:
     def _get_session(self):
         if not self.session:
             token = self.generate_token()
-            session = requests.Session()
+            transport = self.transport or http_transport.get_transport()
+            session = transport.create_session()
             session.headers.update({"Authorization": "Bearer " + token})
             response = session.post(f"{self.host}/login/jwt-session")
             try:
@@ -119,6 +150,186 @@ class JwtAuth:
         return self.session
 
 
+class JwtClaimTemplate:
+    """
+    Builds the JWT claims for an end user identity. The identity is a dict with at least a 'subject', optionally a
+    'name', 'email' and 'groups'. Missing values are taken from the template, which can refer to any identity value,
+    for example: email="{subject}@example.com".
+    """
+
+    def __init__(self, name="{subject}", email="{subject}@jwt.io", email_verified=True, groups=(), expires_in=60):
+        self.name = name
+        self.email = email
+        self.email_verified = email_verified
+        self.groups = list(groups)
+        self.expires_in = expires_in
+
+    def get_fields(self):
+        """
+        Returns the names of the identity values the templates refer to.
+        """
+        return {field_name.split(".")[0].split("[")[0]
+                for template in [self.name, self.email] + self.groups
+                for _, field_name, _, _ in string.Formatter().parse(template) if field_name}
+
+    def create_jwt_auth(self, host, jwt_idp_config, identity, transport=None):
+        """
+        Raises a ValueError when a template refers to a value the identity doesn't have.
+        """
+        try:
+            return JwtAuth(host, jwt_idp_config,
+                           subject=identity["subject"],
+                           name=identity.get("name") or self.name.format(**identity),
+                           email=identity.get("email") or self.email.format(**identity),
+                           email_verified=self.email_verified,
+                           groups=identity.get("groups") or [group.format(**identity) for group in self.groups],
+                           expires_in=self.expires_in,
+                           transport=transport)
+        except (KeyError, IndexError) as e:
+            raise ValueError(f"The identity has no value for {e} used in the JWT claim templates.") from e
+
+
+class _KeyLock:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # The threads holding or waiting for the lock, it's dropped when there are none left
+        self.users = 0
+
+
+class JwtTokenPool:
+    """
+    Reuses signed tokens for the same claim set (subject, name, email and groups) as long as they still have at least
+    `min_remaining` seconds of life left, so that not every request pays for an RSA signature.
+
+    When started, a background thread re-signs the pooled tokens before they fall below `min_remaining`. Tokens that
+    haven't been requested for `idle_timeout` seconds are dropped instead of being refreshed.
+
+    At most `max_size` tokens are pooled, the least recently used tokens are dropped first. Only one token per claim
+    set is signed at any time, concurrent requests for the same claims wait for it and reuse it.
+
+    `min_remaining` must be lower than the `expires_in` of the tokens, otherwise every request signs a new token.
+
+    Note that a pooled token, including its 'jti' claim, is handed out more than once while it's valid.
+    """
+
+    def __init__(self, min_remaining=30, refill_interval=5, idle_timeout=300, max_size=10000):
+        self.min_remaining = min_remaining
+        self.refill_interval = refill_interval
+        self.idle_timeout = idle_timeout
+        self.max_size = max_size
+        self._tokens = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refill_thread = None
+
+    @staticmethod
+    def _get_claims_key(jwt_auth):
+        return (jwt_auth.host, jwt_auth.config.issuer, jwt_auth.config.key_id, jwt_auth.subject, jwt_auth.name,
+                jwt_auth.email, jwt_auth.email_verified, tuple(jwt_auth.groups), jwt_auth.expires_in)
+
+    def get_token(self, jwt_auth):
+        key = self._get_claims_key(jwt_auth)
+        token = self._get_valid_token(key)
+        if token:
+            return token
+
+        with self._hold_key_lock(key):
+            # Another thread may have signed the token while this one was waiting
+            token = self._get_valid_token(key)
+            if token:
+                return token
+
+            return self._sign_token(key, jwt_auth)["token"]
+
+    def _get_valid_token(self, key):
+        current_time = time.time()
+        with self._lock:
+            pooled_token = self._tokens.get(key)
+            if pooled_token and pooled_token["expires_at"] - current_time >= self.min_remaining:
+                pooled_token["last_used"] = current_time
+                self._tokens.move_to_end(key)
+                return pooled_token["token"]
+
+        return None
+
+    @contextmanager
+    def _hold_key_lock(self, key):
+        # The lock of a key is kept while any thread holds or waits for it, independent of whether the key's token is
+        # still pooled, so evicting a token never lets a second thread sign the same claims
+        with self._lock:
+            key_lock = self._key_locks.get(key)
+            if not key_lock:
+                key_lock = self._key_locks[key] = _KeyLock()
+            key_lock.users += 1
+
+        try:
+            with key_lock.lock:
+                yield
+        finally:
+            with self._lock:
+                key_lock.users -= 1
+                if not key_lock.users:
+                    del self._key_locks[key]
+
+    def _sign_token(self, key, jwt_auth, only_if_pooled=False):
+        """
+        Signs a token for the claims and pools it. With `only_if_pooled` the token is only pooled, and returned, if the
+        key's previous token is still pooled.
+        """
+        expires_at = time.time() + jwt_auth.expires_in
+        pooled_token = {
+            "token": jwt_auth.generate_token(),
+            "expires_at": expires_at,
+            "last_used": time.time(),
+            "jwt_auth": jwt_auth
+        }
+        with self._lock:
+            previous_token = self._tokens.get(key)
+            if previous_token:
+                pooled_token["last_used"] = previous_token["last_used"]
+            elif only_if_pooled:
+                return None
+            self._tokens[key] = pooled_token
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_size:
+                del self._tokens[next(iter(self._tokens))]
+
+        return pooled_token
+
+    def start(self):
+        if not self._refill_thread:
+            self._refill_thread = threading.Thread(target=self._refill, name="jwt-token-pool-refill", daemon=True)
+            self._refill_thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _refill(self):
+        while not self._stopped.wait(self.refill_interval):
+            current_time = time.time()
+            with self._lock:
+                for key in [key for key, pooled_token in self._tokens.items()
+                            if current_time - pooled_token["last_used"] > self.idle_timeout]:
+                    del self._tokens[key]
+
+                # Re-sign the tokens that would otherwise be too short lived by the next refill
+                expiring_tokens = [(key, pooled_token["jwt_auth"]) for key, pooled_token in self._tokens.items()
+                                   if pooled_token["expires_at"] - current_time < self.min_remaining + self.refill_interval]
+
+            for key, jwt_auth in expiring_tokens:
+                try:
+                    with self._hold_key_lock(key):
+                        # The token may have been dropped since it was collected, it's not added back then
+                        with self._lock:
+                            is_pooled = key in self._tokens
+                        if is_pooled:
+                            self._sign_token(key, jwt_auth, only_if_pooled=True)
+                except Exception:
+                    logger.exception(f"Failed to refill the pooled JWT for subject '{jwt_auth.subject}'.")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Invokes the provided endpoint using JWT authentication.")
     add_log_level_argument(parser)
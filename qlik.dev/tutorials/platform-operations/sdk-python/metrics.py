@@ -0,0 +1,233 @@
+"""
+An in-process registry of counters and histograms, used to record every HTTP request sent by the examples.
+
+The HTTP transport records the method, path template, status, bytes and duration of every request in the shared
+`registry`, which can be written as JSON or in the Prometheus text format when the execution ends.
+"""
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# IDs in paths are UUIDs, or long strings of letters mixed with digits (space, user, tenant and temporary content IDs)
+_ID_SEGMENT_PATTERN = re.compile(
+    r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|(?=[^/]*\d)[A-Za-z0-9_-]{16,})$")
+
+
+def get_path_template(url):
+    """
+    Returns the path of the URL with the IDs replaced by '{id}', so requests for different resources of the same kind
+    are recorded together, for example '/api/v1/spaces/{id}/assignments'.
+    """
+    path = urlparse(url).path
+    return "/".join("{id}" if _ID_SEGMENT_PATTERN.match(segment) else segment for segment in path.split("/"))
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_quantile(self, quantile):
+        """
+        Estimates the quantile as the upper bound of the bucket it falls in.
+        """
+        rank = quantile * self.count
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), self.bucket_counts):
+            cumulative_count += bucket_count
+            if bucket_count and cumulative_count >= rank:
+                return upper_bound
+        return None
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.get_quantile(0.5),
+            "p95": self.get_quantile(0.95),
+            "p99": self.get_quantile(0.99),
+            "buckets": {str(upper_bound): bucket_count for upper_bound, bucket_count
+                        in zip(self.buckets + ("+Inf",), self.bucket_counts)},
+        }
+
+
+class MetricsRegistry:
+    """
+    Holds counters and histograms by name and label values. All methods are thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def increment(self, name, labels, value=1, help_text=None):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def observe(self, name, labels, value, help_text=None, buckets=DEFAULT_BUCKETS):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                             for name, series in self._counters.items()},
+                "histograms": {name: [{"labels": dict(key), **histogram.to_dict()} for key, histogram in series.items()]
+                               for name, series in self._histograms.items()},
+            }
+
+    def to_prometheus(self):
+        def format_labels(key, extra_labels=()):
+            labels = list(key) + list(extra_labels)
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{format_labels(key)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative_count = 0
+                    for upper_bound, bucket_count in zip(histogram.buckets + ("+Inf",), histogram.bucket_counts):
+                        cumulative_count += bucket_count
+                        lines.append(f"{name}_bucket{format_labels(key, [('le', upper_bound)])} {cumulative_count}")
+                    lines.append(f"{name}_sum{format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self, name="http_request_duration_seconds", limit=10):
+        """
+        Logs the series of the histogram with the largest total duration, for example the requests the most time was
+        spent on.
+        """
+        with self._lock:
+            series = sorted(self._histograms.get(name, {}).items(), key=lambda item: item[1].sum, reverse=True)
+            total_duration = sum(histogram.sum for _, histogram in series)
+            lines = [f"  {' '.join(str(value) for _, value in key)}: {histogram.sum:.1f}s in {histogram.count} "
+                     f"requests, p95 <= {histogram.get_quantile(0.95)}s"
+                     for key, histogram in series[:limit]]
+
+        logger.info(f"Spent {total_duration:.1f} seconds in HTTP requests, the {len(lines)} slowest request kinds:")
+        for line in lines:
+            logger.info(line)
+
+    def write(self, file_path):
+        """
+        Writes the metrics to the file, in the Prometheus text format unless the file name ends with '.json'.
+        """
+        if file_path.endswith(".json"):
+            content = json.dumps(self.to_dict(), indent=2)
+        else:
+            content = self.to_prometheus()
+
+        with open(file_path, "w") as file:
+            file.write(content)
+
+        logger.info(f"Wrote the metrics to '{file_path}'.")
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = MetricsRegistry()
+
+
+def _get_request_size(request):
+    body = request.body
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    if hasattr(body, "tell"):
+        # A streamed body has been read completely once the request has been sent
+        try:
+            return body.tell()
+        except (OSError, ValueError):
+            pass
+    return int(request.headers.get("Content-Length", 0))
+
+
+def _record_request(method, path, status, request_size, response_size, duration):
+    labels = {"method": method, "path": path, "status": str(status)}
+    registry.observe("http_request_duration_seconds", labels, duration,
+                     "The duration of HTTP requests, including the transfer of streamed response bodies.")
+    registry.increment("http_request_bytes_total", labels, request_size, "The bytes sent in HTTP request bodies.")
+    registry.increment("http_response_bytes_total", labels, response_size,
+                       "The bytes received in HTTP response bodies.")
+
+
+def record_http_metrics(send, request, **kwargs):
+    """
+    An HttpTransport interceptor that records the method, path template, status, bytes and duration of the request.
+    A streamed response is recorded when it's closed, so its duration and size include the transfer of the body.
+    """
+    method = request.method.upper()
+    path = get_path_template(request.url)
+    start_time = time.perf_counter()
+    try:
+        response = send(request, **kwargs)
+    except Exception as e:
+        _record_request(method, path, type(e).__name__, _get_request_size(request), 0,
+                        time.perf_counter() - start_time)
+        raise
+
+    request_size = _get_request_size(request)
+    if not kwargs.get("stream"):
+        _record_request(method, path, response.status_code, request_size, len(response.content),
+                        time.perf_counter() - start_time)
+        return response
+
+    close_response = response.close
+    recorded = []
+
+    def close():
+        if not recorded:
+            recorded.append(True)
+            _record_request(method, path, response.status_code, request_size, response.raw.tell(),
+                            time.perf_counter() - start_time)
+        close_response()
+
+    response.close = close
+    return response
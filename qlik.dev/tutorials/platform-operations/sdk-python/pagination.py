@@ -0,0 +1,61 @@
+"""
+A paginator for the Qlik Cloud list endpoints, for example /api/v1/groups or /api/v1/web-integrations.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pagination-prefetch")
+
+
+def _get_page(sdk_client, path, params):
+    return json.loads(sdk_client.rest(path=path, method="GET", params=params).text)
+
+
+def _get_next_page_path(page):
+    # The link to the next page includes the query parameters of the first request
+    return ((page.get("links") or {}).get("next") or {}).get("href")
+
+
+def paginate(sdk_client, path, params=None, prefetch=True):
+    """
+    Yields the items of every page of the list endpoint by following the 'links.next' of each page. While the items of
+    a page are consumed the next page is already fetched in the background, unless `prefetch` is disabled. At most two
+    pages are held in memory, and no more pages are fetched once the caller stops iterating.
+    """
+    page = _get_page(sdk_client, path, params)
+    next_page = None
+    try:
+        while True:
+            next_page_path = _get_next_page_path(page)
+            if next_page_path:
+                if prefetch:
+                    next_page = _prefetch_executor.submit(_get_page, sdk_client, next_page_path, None)
+                else:
+                    next_page = None
+
+            yield from page["data"]
+
+            if not next_page_path:
+                return
+
+            page = next_page.result() if next_page else _get_page(sdk_client, next_page_path, None)
+            next_page = None
+    finally:
+        if next_page:
+            # The caller stopped before the prefetched page was used
+            next_page.cancel()
+
+
+def find_first(sdk_client, path, predicate, params=None):
+    """
+    Returns the first item of the list endpoint that matches the predicate, or None. No further pages are fetched
+    once a match has been found.
+    """
+    for item in paginate(sdk_client, path, params):
+        if predicate(item):
+            return item
+
+    return None
@@ -0,0 +1,60 @@
+"""
+Helpers for waiting on changes that take a while to propagate in a tenant, for example group membership or access to
+a newly published app.
+"""
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def exponential_backoff(initial_delay=0.5, max_delay=10, multiplier=2, jitter=0.5):
+    """
+    Yields an endless sequence of delays in seconds that grow exponentially up to `max_delay`. Each delay is randomly
+    reduced by up to `jitter` (a fraction of the delay), so that many waiting callers don't retry in lockstep.
+    """
+    delay = initial_delay
+    while True:
+        yield delay * (1 - jitter * random.random())
+        delay = min(max_delay, delay * multiplier)
+
+
+def wait_for(condition, description, timeout=120, **backoff_kwargs):
+    """
+    Calls `condition` until it returns a truthy value and returns that value. Between the calls it waits with an
+    exponential backoff (see exponential_backoff for the supported arguments). Raises a TimeoutError if the condition
+    isn't met within `timeout` seconds. Exceptions raised by the condition are not caught.
+    """
+    deadline = time.monotonic() + timeout
+    attempts = 0
+    for delay in exponential_backoff(**backoff_kwargs):
+        attempts += 1
+        result = condition()
+        if result:
+            if attempts > 1:
+                logger.info(f"It took {attempts} attempts to wait for {description}.")
+            return result
+
+        remaining_time = deadline - time.monotonic()
+        if remaining_time <= 0:
+            raise TimeoutError(f"Timed out after {attempts} attempts waiting for {description}.")
+
+        time.sleep(min(delay, remaining_time))
+
+
+def wait_for_all(conditions, concurrency=8, timeout=120, **backoff_kwargs):
+    """
+    Waits for all the (description, condition) pairs concurrently, see wait_for. Returns the results in the same order
+    as the conditions. If any of the waits fails, the first failure is raised once all the waits have finished.
+    """
+    conditions = list(conditions)
+    if not conditions:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(conditions))) as executor:
+        futures = [executor.submit(wait_for, condition, description, timeout, **backoff_kwargs)
+                   for description, condition in conditions]
+
+    return [future.result() for future in futures]
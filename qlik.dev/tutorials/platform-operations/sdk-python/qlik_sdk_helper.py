@@ -1,33 +1,305 @@
 """
 Helpers for interacting with Qlik SDK.
 """
+import atexit
+import functools
 import json
 import logging
+import os
+import platform
+import tempfile
+import threading
+import time
 
 import requests
 from qlik_sdk import AuthType, Config, Qlik
+from qlik_sdk import rest as qlik_sdk_rest
+from qlik_sdk._version import __version__ as qlik_sdk_version
+from qlik_sdk.rest import RestClient, RestClientInstance
+
+import concurrency_controller
+import http_transport
+import metrics
+import rate_limiter
+import retry_policy
 
 logger = logging.getLogger(__name__)
 
 
+class TransportRestClient(RestClient):
+    """
+    A Qlik SDK REST client that sends its requests with a session from `session_factory`, by default a session of the
+    shared HTTP transport. The SDK's own client creates a new session with a new connection for every request, this
+    one sends them over the connections kept alive by the transport.
+
+    It builds the requests like the SDK client (see qlik_sdk.rest.RestClient.rest). A request without an explicit
+    `timeout` uses the timeout of the session's transport.
+    """
+
+    def __init__(self, config, session_factory=None):
+        super().__init__(config)
+        self.session_factory = session_factory or (lambda: http_transport.get_transport().create_session())
+
+    def rest(self, path, method="GET", data=None, files=None, params=None, headers=None, stream=False, timeout=None):
+        if not self.base_url:
+            raise qlik_sdk_rest.NoUrlException("Caller has no 'base_url'")
+        if path.lower().startswith(("http://", "https://")):
+            path = path.split(self.base_url)[1]
+        elif not path.lower().startswith(("/api/v1", "/login/jwt-session", "/oauth/token", "/oauth/authorize",
+                                          "/oauth/revoke")):
+            path = f"/api/v1{path}"
+
+        headers = dict(headers or {})
+        if self.config.auth_type == AuthType.APIKey:
+            headers["authorization"] = "Bearer " + self.config.api_key
+        headers["User-Agent"] = f"qlik-sdk-python/{qlik_sdk_version[1:]} ({platform.system()})"
+
+        # Like the SDK, data that can be converted to a dict is sent as JSON, anything else (a file) as is
+        json_data = None
+        if data and not isinstance(data, bytes):
+            json_data = qlik_sdk_rest._get_dict(data)
+            if json_data:
+                data = None
+        if params:
+            params = qlik_sdk_rest._get_dict(params)
+
+        request = requests.Request(method, self.base_url.strip("/") + path, data=data, json=json_data, files=files,
+                                   headers=headers, params=params)
+        request = functools.reduce(lambda value, handler: handler(value), self._interceptors["request"].handlers,
+                                   request)
+        with self.session_factory() as session:
+            try:
+                response = session.send(request.prepare(), timeout=timeout, stream=stream)
+            except requests.exceptions.Timeout:
+                raise qlik_sdk_rest.ConnectionException("Connection Timeout: " + self.base_url)
+            except requests.exceptions.RequestException as e:
+                raise qlik_sdk_rest.ConnectionException("Connection Error: " + self.base_url) from e
+
+        response = functools.reduce(lambda value, handler: handler(value), self._interceptors["response"].handlers,
+                                    response)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            if response.status_code == 401:
+                error = "Failed to authenticate"
+                try:
+                    error = response.json()["errors"][0]["title"]
+                except Exception:
+                    pass
+                raise qlik_sdk_rest.AuthenticationException(error)
+            raise
+
+        return response
+
+
+class OAuthTokenProvider:
+    """
+    Fetches OAuth client credentials tokens and caches them per (client ID, tenant hostname). A cached token is reused
+    until it's within `refresh_margin` seconds of expiring, at which point the next caller refreshes it. Only one
+    refresh per key is in flight at any time, concurrent callers wait for it and reuse the result.
+
+    If `cache_file_path` is set the tokens are also persisted to that file so that subsequent executions can skip
+    fetching a token.
+    """
+
+    def __init__(self, refresh_margin=60, cache_file_path=None):
+        self.refresh_margin = refresh_margin
+        self.cache_file_path = cache_file_path
+        self._tokens = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._is_cache_file_loaded = False
+
+    def get_token(self, oauth_client_id, oauth_secret, tenant_hostname):
+        key = (oauth_client_id, tenant_hostname)
+        token = self._get_valid_token(key)
+        if token:
+            return token
+
+        with self._get_key_lock(key):
+            # Another thread may have refreshed the token while this one was waiting
+            token = self._get_valid_token(key)
+            if token:
+                return token
+
+            access_token, expires_at = self._fetch_token(oauth_client_id, oauth_secret, tenant_hostname)
+            with self._lock:
+                self._tokens[key] = (access_token, expires_at)
+                self._save_cache_file()
+
+            return access_token
+
+    def _get_valid_token(self, key):
+        with self._lock:
+            self._load_cache_file()
+            access_token, expires_at = self._tokens.get(key, (None, 0))
+
+        if time.time() < expires_at - self.refresh_margin:
+            return access_token
+
+        return None
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _fetch_token(self, oauth_client_id, oauth_secret, tenant_hostname):
+        token_endpoint = f"https://{tenant_hostname}/oauth/token"
+        response = http_transport.get_transport().request("POST", token_endpoint,
+                                                          json={
+                                                              "client_id": oauth_client_id,
+                                                              "client_secret": oauth_secret,
+                                                              "grant_type": "client_credentials"
+                                                          },
+                                                          headers={"Content-type": "application/json",
+                                                                   "Accept": "application/json"})
+        response.raise_for_status()
+
+        token = json.loads(response.text)
+        logger.info(f"Fetched OAuth token from tenant '{token_endpoint}'.")
+
+        return token["access_token"], time.time() + token.get("expires_in", 0)
+
+    def _load_cache_file(self):
+        if self._is_cache_file_loaded or not self.cache_file_path:
+            return
+
+        self._is_cache_file_loaded = True
+        if not os.path.isfile(self.cache_file_path):
+            return
+
+        try:
+            with open(self.cache_file_path, "r") as file:
+                cached_tokens = json.load(file)
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring the unreadable OAuth token cache file '{self.cache_file_path}'.")
+            return
+
+        for cached_token in cached_tokens:
+            key = (cached_token["client_id"], cached_token["tenant_hostname"])
+            self._tokens.setdefault(key, (cached_token["access_token"], cached_token["expires_at"]))
+
+        logger.info(f"Loaded {len(cached_tokens)} OAuth tokens from the cache file '{self.cache_file_path}'.")
+
+    def _save_cache_file(self):
+        if not self.cache_file_path:
+            return
+
+        cached_tokens = [{
+            "client_id": client_id,
+            "tenant_hostname": tenant_hostname,
+            "access_token": access_token,
+            "expires_at": expires_at
+        } for (client_id, tenant_hostname), (access_token, expires_at) in self._tokens.items()
+            if expires_at > time.time()]
+
+        # Write to a private temporary file and swap it in, so readers never see a partially written file
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file_path))
+        file_descriptor, temp_file_path = tempfile.mkstemp(dir=cache_dir, prefix=".oauth-token-cache-")
+        try:
+            with os.fdopen(file_descriptor, "w") as file:
+                json.dump(cached_tokens, file)
+            os.replace(temp_file_path, self.cache_file_path)
+        except OSError:
+            os.remove(temp_file_path)
+            raise
+
+
+token_provider = OAuthTokenProvider()
+
+
+def add_sdk_client_arguments(parser):
+    sdk_client_group = parser.add_argument_group("Qlik SDK Client Configuration")
+    sdk_client_group.add_argument("--oauth-token-cache", required=False, default=None,
+                                  help="The path of a local file used to cache OAuth tokens between executions. The file contains credentials, keep it private.")
+    sdk_client_group.add_argument("--http-pool-connections", required=False, type=int, default=10,
+                                  help="The number of tenant hosts to keep a pool of open connections for.")
+    sdk_client_group.add_argument("--http-pool-maxsize", required=False, type=int, default=10,
+                                  help="The number of open connections to keep alive per tenant host.")
+    sdk_client_group.add_argument("--http-pool-block", required=False, action="store_true", default=False,
+                                  help="Limit the number of concurrent connections per tenant host to the pool size.")
+    sdk_client_group.add_argument("--http-timeout", required=False, type=float, default=10,
+                                  help="The connect and read timeout in seconds for HTTP requests.")
+    sdk_client_group.add_argument("--http-retries", required=False, type=int, default=3,
+                                  help="The number of times an idempotent request is sent again after a 5xx response or a connection error, with an exponential backoff.")
+    sdk_client_group.add_argument("--circuit-breaker-threshold", required=False, type=int, default=5,
+                                  help="The number of consecutive failed requests to a tenant after which requests to it fail right away.")
+    sdk_client_group.add_argument("--circuit-breaker-reset", required=False, type=float, default=30,
+                                  help="The number of seconds requests to a tenant fail right away once its circuit breaker opened, before a trial request is sent.")
+    sdk_client_group.add_argument("--hedge-after", required=False, type=float, default=None,
+                                  help="The number of seconds after which a duplicate of a slow GET request is sent, the first response is used. Not hedged by default.")
+    sdk_client_group.add_argument("--rate-limit-reads", required=False, type=int, default=1000,
+                                  help="The maximum number of read (GET) requests per minute to send to a tenant, further requests are queued.")
+    sdk_client_group.add_argument("--rate-limit-writes", required=False, type=int, default=100,
+                                  help="The maximum number of write (POST, PUT, PATCH and DELETE) requests per minute to send to a tenant, further requests are queued.")
+    sdk_client_group.add_argument("--rate-limit-burst", required=False, type=int, default=10,
+                                  help="The number of requests that may be sent to a tenant at once before the rate limits apply.")
+    sdk_client_group.add_argument("--adaptive-concurrency", required=False, action="store_true", default=False,
+                                  help="Start with a low number of tenants and of requests per tenant in flight and raise them while the p95 latency stays below the target, lowering them on 429 and 5xx responses. --concurrency is the maximum number of tenants.")
+    sdk_client_group.add_argument("--max-requests-per-tenant", required=False, type=int, default=8,
+                                  help="With --adaptive-concurrency, the maximum number of requests in flight per tenant.")
+    sdk_client_group.add_argument("--latency-target", required=False, type=float, default=2.0,
+                                  help="With --adaptive-concurrency, the p95 latency in seconds above which the concurrency is lowered.")
+    sdk_client_group.add_argument("--metrics-file", required=False, default=None,
+                                  help="A file to write the duration, status and size of the HTTP requests to when the execution ends, as JSON if the file name ends with '.json', otherwise in the Prometheus text format.")
+
+
+def configure_sdk_clients(args):
+    token_provider.cache_file_path = args.oauth_token_cache
+
+    controller = None
+    if args.adaptive_concurrency:
+        controller = concurrency_controller.configure_controller(
+            max_tenants=getattr(args, "concurrency", 1), max_requests_per_tenant=args.max_requests_per_tenant,
+            latency_target=args.latency_target)
+
+    http_transport.configure_transport(pool_connections=args.http_pool_connections,
+                                       pool_maxsize=args.http_pool_maxsize,
+                                       pool_block=args.http_pool_block,
+                                       timeout=args.http_timeout,
+                                       retry_policy=retry_policy.RetryPolicy(
+                                           args.http_retries, failure_threshold=args.circuit_breaker_threshold,
+                                           reset_timeout=args.circuit_breaker_reset, hedge_after=args.hedge_after),
+                                       rate_limiter=rate_limiter.RateLimiter(args.rate_limit_reads,
+                                                                             args.rate_limit_writes,
+                                                                             args.rate_limit_burst),
+                                       concurrency_controller=controller)
+
+    if args.metrics_file:
+        atexit.register(write_metrics, args.metrics_file)
+
+
+def write_metrics(file_path):
+    metrics.registry.log_summary()
+    metrics.registry.write(file_path)
+
+
 def create_sdk_client(oauth_client_id, oauth_secret, tenant_hostname):
-    token_endpoint = f"https://{tenant_hostname}/oauth/token"
-    response = requests.post(token_endpoint,
-                             json={
-                                 "client_id": oauth_client_id,
-                                 "client_secret": oauth_secret,
-                                 "grant_type": "client_credentials"
-                             },
-                             headers={"Content-type": "application/json", "Accept": "application/json"})
-    response.raise_for_status()
-
-    access_token = json.loads(response.text)["access_token"]
-    logger.info(f"Fetched OAuth token from tenant '{token_endpoint}'.")
+    access_token = token_provider.get_token(oauth_client_id, oauth_secret, tenant_hostname)
 
     # The AuthType.APIKey is used here, even though we're using an OAuth token. The end result is the same: an
     # Authorization header is set with the bearer set to the provided token. In the future the Config object
     # will support different authentication types explicitly.
-    return Qlik(config=Config(
+    sdk_client = Qlik(config=Config(
         host=f"https://{tenant_hostname}",
         auth_type=AuthType.APIKey,
         api_key=access_token))
+
+    def refresh_token(request):
+        # Swap in the current token before every request, so that long running executions keep working after the
+        # token initially fetched for the client has expired
+        sdk_client.config.api_key = token_provider.get_token(oauth_client_id, oauth_secret, tenant_hostname)
+        request.headers["authorization"] = "Bearer " + sdk_client.config.api_key
+        return request
+
+    # Each API of the SDK client has its own REST client, they all share the same config though. They're replaced by
+    # clients sending their requests over the shared HTTP transport.
+    for api in vars(sdk_client).values():
+        auth = getattr(api, "auth", api)
+        if isinstance(getattr(auth, "rest", None), RestClientInstance):
+            auth.rest = RestClientInstance(TransportRestClient(sdk_client.config))
+            auth.rest.interceptors["request"].use(refresh_token)
+    sdk_client.rest = sdk_client.auth.rest
+
+    return sdk_client
@@ -0,0 +1,193 @@
+"""
+Client side rate limiting of the HTTP requests sent to Qlik Cloud, so that many tenants provisioned in parallel stay
+within the API rate limits instead of failing with '429 Too Many Requests' responses.
+
+Qlik Cloud limits the requests per tenant by tier, most reads are in a higher tier than writes, see
+https://qlik.dev/rest/#rate-limiting. The RateLimiter is an HttpTransport interceptor that keeps a token bucket per
+tenant host and endpoint class and queues requests until their bucket has a token. When a request is throttled anyway
+the `Retry-After` of the response pauses the whole bucket and the request is queued again.
+"""
+import datetime
+import email.utils
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import http_transport
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def get_endpoint_class(request):
+    """
+    Returns the rate limit class of the request: 'read' for GET and HEAD requests, 'write' for all other requests.
+    """
+    return "read" if request.method.upper() in ("GET", "HEAD", "OPTIONS") else "write"
+
+
+def parse_retry_after(value):
+    """
+    Returns the number of seconds to wait from a `Retry-After` header, given as seconds or as an HTTP date, or None if
+    the header is missing or invalid.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+
+    return max(0.0, (retry_at - datetime.datetime.now(tz=datetime.timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens and refills `rate` tokens per second. A request takes a token when it's queued, so
+    the tokens may go negative, the queued requests are then spaced out by the rate in the order they were queued.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_time = time.monotonic()
+        self.paused_until = 0.0
+        self.queue_depth = 0
+
+    def reserve(self, current_time):
+        """
+        Takes a token and returns the time at which the request may be sent.
+        """
+        if current_time > self.updated_time:
+            self.tokens = min(self.capacity, self.tokens + (current_time - self.updated_time) * self.rate)
+            self.updated_time = current_time
+        self.tokens -= 1
+
+        send_time = max(current_time, self.updated_time)
+        if self.tokens < 0:
+            send_time += -self.tokens / self.rate
+        return max(send_time, self.paused_until)
+
+    def pause(self, until):
+        """
+        Holds back all requests until the given time, after which the bucket refills from empty.
+        """
+        if until > self.paused_until:
+            self.paused_until = until
+            self.tokens = min(self.tokens, 0)
+            self.updated_time = max(self.updated_time, until)
+
+
+class RateLimiter:
+    """
+    Limits the requests per tenant host and endpoint class (see get_endpoint_class) to the given requests per minute,
+    with bursts of up to `burst` requests. Requests are queued, never rejected, the time they spend waiting and the
+    queue depth they found are recorded in the metrics registry.
+
+    A request answered with a 429 response pauses its bucket for the `Retry-After` of the response (or
+    `default_retry_after` seconds) and is sent again, up to `max_retries` times. Requests with a body that can't be
+    rewound, for example a streamed app, are not sent again and the 429 response is returned.
+    """
+
+    def __init__(self, reads_per_minute=1000, writes_per_minute=100, burst=10, max_retries=5,
+                 default_retry_after=5):
+        self.rates = {"read": reads_per_minute / 60, "write": writes_per_minute / 60}
+        self.burst = burst
+        self.max_retries = max_retries
+        self.default_retry_after = default_retry_after
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, host, endpoint_class):
+        key = (host, endpoint_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rates[endpoint_class], self.burst)
+        return bucket
+
+    def get_queue_depth(self):
+        """
+        Returns the number of requests waiting for a token, by endpoint class.
+        """
+        with self._lock:
+            queue_depths = {}
+            for (_, endpoint_class), bucket in self._buckets.items():
+                queue_depths[endpoint_class] = queue_depths.get(endpoint_class, 0) + bucket.queue_depth
+            return queue_depths
+
+    def wait(self, host, endpoint_class):
+        """
+        Blocks until a request to the host may be sent, and returns the number of seconds that took.
+        """
+        start_time = time.monotonic()
+        with self._lock:
+            bucket = self._get_bucket(host, endpoint_class)
+            send_time = bucket.reserve(start_time)
+            if send_time <= start_time:
+                return 0.0
+            bucket.queue_depth += 1
+            queue_depth = bucket.queue_depth
+
+        metrics.registry.observe("http_throttle_queue_depth", {"endpoint_class": endpoint_class}, queue_depth,
+                                 "The number of queued requests to the same host and endpoint class, when a request was queued.",
+                                 buckets=QUEUE_DEPTH_BUCKETS)
+        try:
+            while True:
+                time.sleep(max(0.0, send_time - time.monotonic()))
+                # The bucket may have been paused by a 429 response in the meantime, then queue again behind the pause
+                with self._lock:
+                    current_time = time.monotonic()
+                    if bucket.paused_until <= current_time:
+                        break
+                    send_time = bucket.reserve(current_time)
+        finally:
+            with self._lock:
+                bucket.queue_depth -= 1
+
+        return time.monotonic() - start_time
+
+    def __call__(self, send, request, **kwargs):
+        host = urlparse(request.url).hostname
+        endpoint_class = get_endpoint_class(request)
+        labels = {"endpoint_class": endpoint_class}
+        body_position = http_transport.get_body_position(request.body)
+
+        attempt = 0
+        while True:
+            wait_time = self.wait(host, endpoint_class)
+            metrics.registry.observe("http_throttle_wait_seconds", labels, wait_time,
+                                     "The time requests were queued by the client side rate limiter.")
+
+            response = send(request, **kwargs)
+            if response.status_code != 429:
+                return response
+
+            attempt += 1
+            metrics.registry.increment("http_throttled_responses_total", labels, 1,
+                                       "The requests answered with a '429 Too Many Requests' response.")
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is None:
+                retry_after = self.default_retry_after
+            with self._lock:
+                self._get_bucket(host, endpoint_class).pause(time.monotonic() + retry_after)
+
+            if attempt > self.max_retries or not http_transport.rewind_body(request.body, body_position):
+                logger.warning(
+                    f"The request {request.method} {request.url} was throttled {attempt} times, giving up.")
+                return response
+
+            logger.warning(
+                f"The request {request.method} {request.url} was throttled, retrying after {retry_after:.1f} seconds.")
+            response.close()
+
@@ -0,0 +1,181 @@
+"""
+Retries of failed HTTP requests, a circuit breaker per tenant host and hedged GET requests, so that a single degraded
+tenant or a transient error doesn't stall or fail a whole batch.
+
+The RetryPolicy is an HttpTransport interceptor. It sends idempotent requests again after a 5xx response or a
+connection error, waiting with an exponential backoff (see polling.exponential_backoff). Other requests are only sent
+again when the connection couldn't be established, since Qlik Cloud may have processed them already.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+
+import http_transport
+import metrics
+import polling
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+# POST requests that only create a session or a token, sending them again has the same effect
+IDEMPOTENT_POST_PATHS = ("/oauth/token", "/login/jwt-session")
+
+_hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="hedge")
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+def is_idempotent(request):
+    method = request.method.upper()
+    return method in IDEMPOTENT_METHODS or (method == "POST" and urlparse(request.url).path in IDEMPOTENT_POST_PATHS)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed requests to a host, then fails all requests to the host right
+    away for `reset_timeout` seconds. After that a single trial request is let through, which closes the circuit again
+    if it succeeds and reopens it if it fails.
+    """
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=30):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failure_count = 0
+        self._opened_time = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_time >= self.reset_timeout:
+                self.state = "half-open"
+                logger.info(f"Sending a trial request to '{self.host}' to close its circuit breaker.")
+                return True
+            return False
+
+    def record(self, succeeded):
+        with self._lock:
+            if succeeded:
+                if self.state != "closed":
+                    logger.info(f"Closed the circuit breaker of '{self.host}'.")
+                self.state = "closed"
+                self.failure_count = 0
+                return
+
+            self.failure_count += 1
+            if self.state == "half-open" or (self.state == "closed" and self.failure_count >= self.failure_threshold):
+                self.state = "open"
+                self._opened_time = time.monotonic()
+                logger.warning(f"Opened the circuit breaker of '{self.host}' after {self.failure_count} consecutive "
+                               f"failed requests, requests to it fail for the next {self.reset_timeout} seconds.")
+
+
+class RetryPolicy:
+    """
+    * `max_retries` is the number of times a failed request is sent again.
+    * `retry_statuses` are the response statuses of idempotent requests that are retried.
+    * `initial_delay` and `max_delay` configure the exponential backoff between the attempts.
+    * `failure_threshold` and `reset_timeout` configure the circuit breaker of every host, see CircuitBreaker.
+    * `hedge_after`, when set, is the number of seconds after which a duplicate of a GET request is sent if there's no
+      response yet. The first response is used and the other one is discarded. Streamed responses are never hedged.
+    """
+
+    def __init__(self, max_retries=3, retry_statuses=(500, 502, 503, 504), initial_delay=0.5, max_delay=10,
+                 failure_threshold=5, reset_timeout=30, hedge_after=None):
+        self.max_retries = max_retries
+        self.retry_statuses = retry_statuses
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_after = hedge_after
+        self._circuit_breakers = {}
+        self._lock = threading.Lock()
+
+    def get_circuit_breaker(self, host):
+        with self._lock:
+            circuit_breaker = self._circuit_breakers.get(host)
+            if circuit_breaker is None:
+                circuit_breaker = self._circuit_breakers[host] = CircuitBreaker(host, self.failure_threshold,
+                                                                                self.reset_timeout)
+            return circuit_breaker
+
+    def __call__(self, send, request, **kwargs):
+        circuit_breaker = self.get_circuit_breaker(urlparse(request.url).hostname)
+        idempotent = is_idempotent(request)
+        body_position = http_transport.get_body_position(request.body)
+        delays = polling.exponential_backoff(self.initial_delay, self.max_delay)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            if not circuit_breaker.allow_request():
+                metrics.registry.increment("http_circuit_breaker_rejections_total", {"method": request.method}, 1,
+                                           "The requests failed right away because the circuit breaker was open.")
+                raise CircuitOpenError(f"The circuit breaker of '{circuit_breaker.host}' is open, it failed "
+                                       f"{circuit_breaker.failure_count} consecutive requests.", request=request)
+
+            succeeded = False
+            try:
+                response = self._send(send, request, kwargs)
+                succeeded = response.status_code < 500
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # A request that never reached the server is safe to send again, whatever the method
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if (not retryable or attempt > self.max_retries
+                        or not http_transport.rewind_body(request.body, body_position)):
+                    raise
+                reason = type(e).__name__
+            else:
+                if (succeeded or not idempotent or response.status_code not in self.retry_statuses
+                        or attempt > self.max_retries or not http_transport.rewind_body(request.body, body_position)):
+                    return response
+                response.close()
+                reason = str(response.status_code)
+            finally:
+                circuit_breaker.record(succeeded)
+
+            delay = next(delays)
+            metrics.registry.increment("http_retries_total", {"method": request.method, "reason": reason}, 1,
+                                       "The requests sent again after a failure.")
+            logger.warning(f"The request {request.method} {request.url} failed ({reason}), retrying in "
+                           f"{delay:.1f} seconds (attempt {attempt + 1} of {self.max_retries + 1}).")
+            time.sleep(delay)
+
+    def _send(self, send, request, kwargs):
+        if not self.hedge_after or request.method.upper() != "GET" or kwargs.get("stream"):
+            return send(request, **kwargs)
+
+        primary = _hedge_executor.submit(send, request, **kwargs)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        hedge = _hedge_executor.submit(send, request.copy(), **kwargs)
+        done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        winner = primary if primary in done else hedge
+        if winner.exception() is not None and pending:
+            # Use the other request if the first one to complete failed
+            winner = pending.pop()
+            winner.exception()
+        loser = hedge if winner is primary else primary
+
+        loser.add_done_callback(_close_response)
+        metrics.registry.increment("http_hedged_requests_total", {"winner": "hedge" if winner is hedge else "primary"},
+                                   1, "The GET requests sent twice because the first one was slow.")
+        return winner.result()
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
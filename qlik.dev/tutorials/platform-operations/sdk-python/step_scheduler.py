@@ -0,0 +1,123 @@
+"""
+Runs the steps of a pipeline with as much parallelism as their declared dependencies allow, and logs how long every
+step took and which chain of steps (the critical path) determined the total duration.
+"""
+import contextvars
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Step:
+    """
+    A step of a pipeline. The function is called with a dict of the results of the steps it depends on, by step name.
+    """
+    name: str
+    function: object
+    depends_on: tuple = ()
+
+
+def _validate(steps):
+    for step in steps.values():
+        for dependency in step.depends_on:
+            if dependency not in steps:
+                raise ValueError(f"The step '{step.name}' depends on the unknown step '{dependency}'.")
+
+    # Remove the steps without remaining dependencies until none are left, anything that remains is a cycle
+    remaining = {name: set(step.depends_on) for name, step in steps.items()}
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError(f"The steps {sorted(remaining)} have circular dependencies.")
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+
+
+def _run_step(step, dependency_results, spans, start_time):
+    step_start_time = time.perf_counter() - start_time
+    try:
+        return step.function(dependency_results)
+    finally:
+        spans[step.name] = (step_start_time, time.perf_counter() - start_time)
+
+
+def get_critical_path(steps, spans):
+    """
+    Returns the names of the chain of steps that ended last, following for each step the dependency that ended last.
+    """
+    if not spans:
+        return []
+
+    critical_path = [max(spans, key=lambda name: spans[name][1])]
+    while True:
+        dependencies = [dependency for dependency in steps[critical_path[-1]].depends_on if dependency in spans]
+        if not dependencies:
+            break
+        critical_path.append(max(dependencies, key=lambda name: spans[name][1]))
+
+    return list(reversed(critical_path))
+
+
+def run_steps(steps, description, concurrency=8, timings=None):
+    """
+    Runs every step once all the steps it depends on have completed, with at most `concurrency` steps at the same time.
+    Returns the results of the steps by name. When a step fails no new steps are started, and the first failure is
+    raised once the running steps have completed. The duration of every step that ran is added to `timings` (a dict,
+    for example BatchResult.timings) and the timings and critical path are logged.
+    """
+    steps = {step.name: step for step in steps}
+    _validate(steps)
+
+    results = {}
+    spans = {}
+    pending = dict(steps)
+    running = {}
+    error = None
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(steps))),
+                            thread_name_prefix="step") as executor:
+        while pending or running:
+            if error is None:
+                for name, step in list(pending.items()):
+                    if all(dependency in results for dependency in step.depends_on):
+                        del pending[name]
+                        dependency_results = {dependency: results[dependency] for dependency in step.depends_on}
+                        # The step runs in a copy of the caller's context, so it inherits for example a held
+                        # tenant slot (see concurrency_controller.limited)
+                        future = executor.submit(contextvars.copy_context().run, _run_step, step, dependency_results,
+                                                 spans, start_time)
+                        running[future] = name
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except BaseException as e:
+                    # The functions call exit() on some failures, those stop the pipeline as well
+                    logger.error(f"The step '{name}' of {description} failed.")
+                    error = error or e
+
+    for name, (step_start_time, step_end_time) in spans.items():
+        if timings is not None:
+            timings[name] = step_end_time - step_start_time
+        logger.info(f"  {name}: {step_end_time - step_start_time:.2f}s (from {step_start_time:.2f}s to {step_end_time:.2f}s)")
+
+    critical_path = get_critical_path(steps, spans)
+    logger.info(
+        f"Completed {len(results)} of {len(steps)} steps of {description} in {time.perf_counter() - start_time:.1f} seconds, critical path: "
+        + " -> ".join(f"{name} ({spans[name][1] - spans[name][0]:.1f}s)" for name in critical_path))
+
+    if error is not None:
+        raise error
+
+    return results
@@ -8,11 +8,19 @@ For a detailed overview of the supported arguments execute:
 import argparse
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 from argparse_logging import add_log_level_argument
-from qlik_sdk import AssignmentCreate, SpaceCreate
+from qlik_sdk import SpaceCreate
+from requests import HTTPError
 
+import concurrency_controller
 import constants
+import pagination
+import polling
 import qlik_sdk_helper
 from jwt_auth import JwtAuth, JwtIdpConfig
 
@@ -101,12 +109,44 @@ def create_managed_space(sdk_client):
     return space
 
 
-def create_group(sdk_client, group_name, jwt_idp_config):
+_group_ids = {}
+_group_ids_lock = threading.Lock()
+
+
+def resolve_group_id(sdk_client, group_name):
+    """
+    Returns the ID of the group with the name, or None if there is no such group. The groups are queried with a
+    filter on the name, found group IDs are cached per tenant.
+    """
+    key = (sdk_client.config.host, group_name)
+    with _group_ids_lock:
+        if key in _group_ids:
+            return _group_ids[key]
+
+    escaped_group_name = group_name.replace("\\", "\\\\").replace('"', '\\"')
+    group = pagination.find_first(sdk_client, "/api/v1/groups", lambda group: group["name"] == group_name,
+                                  params={"filter": f'name eq "{escaped_group_name}"', "limit": 100})
+    if not group:
+        return None
+
+    with _group_ids_lock:
+        _group_ids[key] = group["id"]
+
+    logger.info(f"Resolved group '{group_name}' to ID '{group['id']}' in tenant '{sdk_client.config.host}'.")
+    return group["id"]
+
+
+def create_group(sdk_client, group_name, jwt_idp_config, temp_user_subject="temp_user"):
+    group_id = resolve_group_id(sdk_client, group_name)
+    if group_id:
+        logger.info(f"The group '{group_name}' already exists with ID '{group_id}' in '{sdk_client.config.host}'.")
+        return group_id
+
     jwt_auth = JwtAuth(sdk_client.config.host,
                        jwt_idp_config,
-                       subject="temp_user",
-                       name="temp_user",
-                       email="temp_user@jwt.io",
+                       subject=temp_user_subject,
+                       name=temp_user_subject,
+                       email=f"{temp_user_subject}@jwt.io",
                        groups=[group_name])
     user = json.loads(jwt_auth.rest(
         path="/api/v1/users/me",
@@ -116,17 +156,10 @@ def create_group(sdk_client, group_name, jwt_idp_config):
         f"Created a JWT authentication session for a user in group '{group_name}' in tenant '{sdk_client.config.host}'.")
 
     # Lookup the newly created group to get the ID
-    groups = json.loads(sdk_client.rest(
-        path="/api/v1/groups",
-        method="GET").text)["data"]
-
-    group_id = None
-    for group in groups:
-        if group["name"] == group_name:
-            group_id = group["id"]
-            break
-
-    if not group_id:
+    try:
+        group_id = polling.wait_for(lambda: resolve_group_id(sdk_client, group_name),
+                                    f"the group '{group_name}' in tenant '{sdk_client.config.host}'", timeout=30)
+    except TimeoutError:
         logger.error(f"The group {group_name} could not be found in tenant '{sdk_client.config.host}'.")
         exit(1)
 
@@ -142,18 +175,157 @@ def create_group(sdk_client, group_name, jwt_idp_config):
     return group_id
 
 
-def assign_to_space(sdk_client, space, group_id, roles):
-    space.create_assignment(AssignmentCreate(
-        type="group",
-        assigneeId=group_id,
-        roles=roles
-    ))
+def create_groups(sdk_client, group_names, jwt_idp_config, concurrency=8):
+    """
+    Creates the groups concurrently, so their propagation waits overlap. Returns the group IDs by group name.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(group_names)))) as executor:
+        # Each group gets its own temporary user, the groups of a user are replaced on every JWT session
+        futures = {group_name: executor.submit(create_group, sdk_client, group_name, jwt_idp_config,
+                                               f"temp_user_{index}")
+                   for index, group_name in enumerate(group_names)}
+
+    return {group_name: future.result() for group_name, future in futures.items()}
+
+
+def assign_to_space(sdk_client, space, assignee_id, roles, assignee_type="group"):
+    """
+    Assigns the group or user to the space. Returns False if the assignee was already assigned to the space.
+    """
+    try:
+        # A dict instead of an AssignmentCreate, the SDK can't serialize the role enums AssignmentCreate converts to
+        space.create_assignment({
+            "type": assignee_type,
+            "assigneeId": assignee_id,
+            "roles": list(roles)
+        })
+    except HTTPError as http_error:
+        # Ignore the error if the assignee has already been assigned to the space
+        if http_error.response.status_code == 409:
+            logger.info(
+                f"The {assignee_type} with ID '{assignee_id}' is already assigned to the space with ID '{space.id}' in tenant '{sdk_client.config.host}'.")
+            return False
+        raise http_error
+
+    logger.info(
+        f"Assigned the {assignee_type} with ID '{assignee_id}' to the space with ID '{space.id}' with the roles '{roles}' in tenant '{sdk_client.config.host}'.")
+    return True
+
+
+@dataclass
+class SpaceAssignment:
+    """
+    An entry of an assignment plan. The space is referenced by name, a group assignee by name and a user assignee by
+    user ID.
+    """
+    space: str
+    assignee: str
+    roles: list
+    assignee_type: str = "group"
+
+
+@dataclass
+class SpaceAssignmentResult:
+    assignment: SpaceAssignment
+    created: bool
+    duration: float
+
+
+def get_default_assignment_plan():
+    return [SpaceAssignment(constants.SPACE_MANAGED_PROD, constants.GROUP_ANALYTICS_CONSUMER, ["consumer"])]
+
+
+def parse_assignment_plan(entries, file_path):
+    """
+    Parses a list of objects with the 'space', 'assignee', 'roles' and optionally 'assignee_type' ('group' or 'user')
+    fields, read from the JSON file, into SpaceAssignments.
+    """
+    assignment_plan = []
+    for entry in entries:
+        for field_name in ["space", "assignee", "roles"]:
+            if not entry.get(field_name):
+                raise ValueError(f"The assignment {entry} in '{file_path}' has no '{field_name}'.")
+        if entry.get("assignee_type", "group") not in ("group", "user"):
+            raise ValueError(f"The assignment {entry} in '{file_path}' has an unknown 'assignee_type'.")
 
+        assignment_plan.append(SpaceAssignment(entry["space"], entry["assignee"], list(entry["roles"]),
+                                               entry.get("assignee_type", "group")))
+
+    return assignment_plan
+
+
+def read_assignment_plan(file_path):
+    with open(file_path, "r") as file:
+        assignment_plan = parse_assignment_plan(json.load(file), file_path)
+
+    logger.info(f"Read {len(assignment_plan)} assignments from the plan '{file_path}'.")
+    return assignment_plan
+
+
+def _resolve_spaces(sdk_client, space_names, spaces):
+    spaces = dict(spaces)
+    for space_name in space_names:
+        if space_name in spaces:
+            continue
+
+        space = pagination.find_first(sdk_client, "/api/v1/spaces", lambda space: space["name"] == space_name,
+                                      params={"name": space_name, "limit": 100})
+        if not space:
+            raise ValueError(f"The space '{space_name}' of the assignment plan doesn't exist in tenant '{sdk_client.config.host}'.")
+
+        spaces[space_name] = sdk_client.spaces.get(space["id"])
+
+    return spaces
+
+
+def _apply_assignment(sdk_client, space, assignee_id, assignment):
+    start_time = time.perf_counter()
+    created = assign_to_space(sdk_client, space, assignee_id, assignment.roles, assignment.assignee_type)
+    return SpaceAssignmentResult(assignment, created, time.perf_counter() - start_time)
+
+
+def apply_assignment_plan(sdk_client, assignment_plan, jwt_idp_config, spaces=None, concurrency=8):
+    """
+    Applies the SpaceAssignments of the plan concurrently. `spaces` maps space names to already retrieved spaces, the
+    other spaces of the plan are looked up by name. The groups of the plan are created first if they don't exist yet.
+    Assignments that already exist are skipped. Returns a SpaceAssignmentResult per assignment, in the plan order.
+    """
+    if not assignment_plan:
+        return []
+
+    start_time = time.perf_counter()
+    spaces = _resolve_spaces(sdk_client, {assignment.space for assignment in assignment_plan}, spaces or {})
+
+    group_names = list(dict.fromkeys(
+        assignment.assignee for assignment in assignment_plan if assignment.assignee_type == "group"))
+    group_ids = create_groups(sdk_client, group_names, jwt_idp_config, concurrency) if group_names else {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(assignment_plan)))) as executor:
+        futures = [executor.submit(_apply_assignment, sdk_client, spaces[assignment.space],
+                                   group_ids.get(assignment.assignee, assignment.assignee)
+                                   if assignment.assignee_type == "group" else assignment.assignee,
+                                   assignment)
+                   for assignment in assignment_plan]
+
+    assignment_results = [future.result() for future in futures]
+
+    created_count = sum(1 for assignment_result in assignment_results if assignment_result.created)
     logger.info(
-        f"Assigned the group with ID '{group_id}' to the space with ID '{space.id}' with the roles '{roles}' in tenant '{sdk_client.config.host}'.")
+        f"Applied {len(assignment_results)} assignments ({created_count} new) in {time.perf_counter() - start_time:.1f} seconds in tenant '{sdk_client.config.host}'.")
+    for assignment_result in assignment_results:
+        assignment = assignment_result.assignment
+        logger.info(
+            f"  {assignment.assignee_type} '{assignment.assignee}' -> space '{assignment.space}' {assignment.roles}: {assignment_result.duration:.2f}s{'' if assignment_result.created else ' (already assigned)'}")
+
+    return assignment_results
 
 
-def run(target_tenant_sdk_client, jwt_idp_config):
+@concurrency_controller.limited
+def run(target_tenant_sdk_client, jwt_idp_config, assignment_plan=None):
+    """
+    Configures a new tenant as in the tutorial. To configure a tenant that may already be (partially) configured use
+    tenant_state.run, which only applies the missing configuration.
+    """
     enable_auto_group_creation(target_tenant_sdk_client)
     enable_auto_license_assignment(target_tenant_sdk_client)
 
@@ -162,9 +334,8 @@ def run(target_tenant_sdk_client, jwt_idp_config):
     dev_space = create_shared_space(target_tenant_sdk_client)
     prod_space = create_managed_space(target_tenant_sdk_client)
 
-    analytics_consumer_group_id = create_group(target_tenant_sdk_client, constants.GROUP_ANALYTICS_CONSUMER,
-                                               jwt_idp_config)
-    assign_to_space(target_tenant_sdk_client, prod_space, analytics_consumer_group_id, ["consumer"])
+    apply_assignment_plan(target_tenant_sdk_client, assignment_plan or get_default_assignment_plan(), jwt_idp_config,
+                          spaces={dev_space.name: dev_space, prod_space.name: prod_space})
 
     logger.info(f"The tenant '{target_tenant_sdk_client.config.host}' has been configured.")
     return dev_space.id, prod_space.id
@@ -177,6 +348,8 @@ if __name__ == "__main__":
     parser.add_argument("--client-secret", required=True, help="The OAuth client secret.")
     parser.add_argument("--target-tenant-hostname", required=True,
                         help="The hostname of the target tenant to configure, for example: tenant.region.qlikcloud.com")
+    parser.add_argument("--assignment-plan", required=False,
+                        help="A JSON file listing the 'space', 'assignee', 'roles' and optionally 'assignee_type' of the space assignments to apply, by default the analytics consumer group is assigned to the managed space.")
 
     jwt_group = parser.add_argument_group("Target JWT IdP Configuration")
     jwt_group.add_argument("--jwt-issuer", required=False, help="The 'issuer' field to use in the JWT.")
@@ -184,15 +357,22 @@ if __name__ == "__main__":
     jwt_group.add_argument("--jwt-private-key", required=False, help="The path to the local private key file.")
     jwt_group.add_argument("--jwt-public-key", required=False, help="The path to the local public key file.")
 
+    qlik_sdk_helper.add_sdk_client_arguments(parser)
+
     args = parser.parse_args()
     logging.basicConfig(level=args.log_level)
+    qlik_sdk_helper.configure_sdk_clients(args)
 
     jwt_idp_config = JwtIdpConfig(args.jwt_issuer, args.jwt_key_id, args.jwt_private_key, args.jwt_public_key)
     if not jwt_idp_config.validate():
         parser.print_help()
         exit(1)
 
+    assignment_plan = None
+    if args.assignment_plan:
+        assignment_plan = read_assignment_plan(args.assignment_plan)
+
     target_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(args.client_id, args.client_secret,
                                                                  args.target_tenant_hostname)
 
-    run(target_tenant_sdk_client, jwt_idp_config)
+    run(target_tenant_sdk_client, jwt_idp_config, assignment_plan)
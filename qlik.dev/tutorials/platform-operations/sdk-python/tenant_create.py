@@ -12,8 +12,11 @@ import logging
 
 from argparse_logging import add_log_level_argument
 from qlik_sdk import UserPostSchema
+from requests import HTTPError
 
+import concurrency_controller
 import constants
+import pagination
 import qlik_sdk_helper
 
 logger = logging.getLogger(__name__)
@@ -53,6 +56,18 @@ def check_access_to_tenant(sdk_client, tenant_id):
     logger.info(f"Successfully accessed tenant '{sdk_client.config.host}'.")
 
 
+def find_user(sdk_client, subject, email):
+    """
+    Returns the user with the subject or the email, or None if there is no such user.
+    """
+    escaped_subject = subject.replace("\\", "\\\\").replace('"', '\\"')
+    escaped_email = email.replace("\\", "\\\\").replace('"', '\\"')
+    return pagination.find_first(sdk_client, "/api/v1/users",
+                                 lambda user: user.get("subject") == subject or user.get("email") == email,
+                                 params={"filter": f'subject eq "{escaped_subject}" or email eq "{escaped_email}"',
+                                         "limit": 100})
+
+
 def create_tenant_admin(source_tenant_sdk_client, target_tenant_sdk_client, source_tenant_admin_email):
     source_tenant_admin_user = None
     for user in source_tenant_sdk_client.users.get_users(status=None, filter=f"email eq \"{source_tenant_admin_email}\"").pagination:
@@ -69,38 +84,58 @@ def create_tenant_admin(source_tenant_sdk_client, target_tenant_sdk_client, sour
         raise RuntimeError(
             f"The user with email '{source_tenant_admin_email}' is not a tenant admin in the tenant '{source_tenant_sdk_client.config.host}.")
 
-    target_tenant_roles = json.loads(target_tenant_sdk_client.rest(
-        path="/api/v1/roles",
-        method="GET"
-    ).text)["data"]
+    # The user already exists when an interrupted run is resumed
+    target_tenant_admin_user = find_user(target_tenant_sdk_client, source_tenant_admin_user.subject,
+                                         source_tenant_admin_user.email)
+    if target_tenant_admin_user:
+        logger.info(
+            f"The tenant admin user for user with email '{source_tenant_admin_email}' already exists with ID '{target_tenant_admin_user['id']}' in tenant '{target_tenant_sdk_client.config.host}'.")
+        return
+
+    target_tenant_admin_role = pagination.find_first(target_tenant_sdk_client, "/api/v1/roles",
+                                                     lambda role: role["name"] == constants.ROLE_TENANT_ADMIN)
 
     logger.info(f"Retrieved roles from tenant '{target_tenant_sdk_client.config.host}'.")
 
-    target_tenant_admin_role_id = None
-    for role in target_tenant_roles:
-        if role["name"] == constants.ROLE_TENANT_ADMIN:
-            target_tenant_admin_role_id = role["id"]
-            break
+    target_tenant_admin_role_id = target_tenant_admin_role["id"] if target_tenant_admin_role else None
 
     if not target_tenant_admin_role_id:
         raise RuntimeError(
             f"No role with the name '{constants.ROLE_TENANT_ADMIN}' exists in the tenant '{target_tenant_sdk_client.config.host}'.")
 
-    user = target_tenant_sdk_client.users.create(UserPostSchema(
-        name=source_tenant_admin_user.name,
-        email=source_tenant_admin_user.email,
-        subject=source_tenant_admin_user.subject,
-        assignedRoles=[{"id": target_tenant_admin_role_id}]
-    ))
+    try:
+        user = target_tenant_sdk_client.users.create(UserPostSchema(
+            name=source_tenant_admin_user.name,
+            email=source_tenant_admin_user.email,
+            subject=source_tenant_admin_user.subject,
+            assignedRoles=[{"id": target_tenant_admin_role_id}]
+        ))
+    except HTTPError as http_error:
+        # Ignore the error if the user has been created since it was looked up
+        if http_error.response.status_code == 409:
+            logger.info(
+                f"The tenant admin user for user with email '{source_tenant_admin_email}' already exists in tenant '{target_tenant_sdk_client.config.host}'.")
+            return
+        raise http_error
 
     logger.info(
         f"Created tenant admin user for user with email '{source_tenant_admin_email}' with ID '{user.id}' in tenant '{target_tenant_sdk_client.config.host}'.")
 
 
-def run(source_tenant_sdk_client, tenant_registration_sdk_client, oauth_client_id, oauth_secret,
-        source_tenant_admin_email):
+def register_tenant(source_tenant_sdk_client, tenant_registration_sdk_client):
     license_key = get_signed_entitlement_key(source_tenant_sdk_client)
-    tenant_id, tenant_hostname = create_tenant(tenant_registration_sdk_client, license_key)
+    return create_tenant(tenant_registration_sdk_client, license_key)
+
+
+@concurrency_controller.limited
+def run(source_tenant_sdk_client, tenant_registration_sdk_client, oauth_client_id, oauth_secret,
+        source_tenant_admin_email, registered_tenant=None):
+    """
+    Creates a tenant and returns an SDK client for it. If the (tenant ID, tenant hostname) of an already registered
+    tenant is given, that tenant is set up instead of registering a new tenant.
+    """
+    tenant_id, tenant_hostname = registered_tenant or register_tenant(source_tenant_sdk_client,
+                                                                      tenant_registration_sdk_client)
 
     target_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(oauth_client_id, oauth_secret, tenant_hostname)
     check_access_to_tenant(target_tenant_sdk_client, tenant_id)
@@ -127,8 +162,11 @@ if __name__ == "__main__":
                                      help="The hostname of the source tenant, for example: tenant.region.qlikcloud.com")
     source_tenant_group.add_argument("--source-tenant-admin-email", required=False,
                                      help="The email address of a tenant admin in the source tenant. If this is provided the tenant admin from the source tenant will be given access to the new tenant.")
+    qlik_sdk_helper.add_sdk_client_arguments(parser)
+
     args = parser.parse_args()
     logging.basicConfig(level=args.log_level)
+    qlik_sdk_helper.configure_sdk_clients(args)
 
     source_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(args.client_id, args.client_secret,
                                                                  args.source_tenant_hostname)
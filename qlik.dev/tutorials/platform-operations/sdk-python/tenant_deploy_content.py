@@ -6,17 +6,25 @@ For a detailed overview of the supported arguments execute:
     python tenant_deploy_content.py --help
 """
 import argparse
+import datetime
+import io
 import json
 import logging
 import os
+import queue
+import re
 import shutil
+import tempfile
+import threading
 import time
 
 from argparse_logging import add_log_level_argument
-from qlik_sdk import AssignmentCreate
 from requests import HTTPError
 
+import app_export_cache
+import concurrency_controller
 import constants
+import polling
 import qlik_sdk_helper
 from jwt_auth import JwtAuth, JwtIdpConfig
 
@@ -41,7 +49,8 @@ def verify_bot_access_to_source_app(sdk_client, app_id):
 
         roles = ["producer"]
         try:
-            space.create_assignment(AssignmentCreate(type="user", assigneeId=user_id, roles=roles))
+            # A dict instead of an AssignmentCreate, the SDK can't serialize the role enums AssignmentCreate converts to
+            space.create_assignment({"type": "user", "assigneeId": user_id, "roles": roles})
         except HTTPError as http_error:
             # Ignore the error if the bot user has already been assigned to the space
             if http_error.response.status_code == 409:
@@ -62,9 +71,11 @@ def export_app(sdk_client, app_id):
 
     app_location_url = app.export()
 
-    # Download the app to a local file so it can be imported
-    exported_app_file_name = f"{app.attributes.name}.qvf"
+    # Download the app to a local file so it can be imported, a temporary file per export so concurrent deployments
+    # of the same app don't overwrite each other's download
     with sdk_client.rest(path=app_location_url, method="get", stream=True) as http_response:
+        file_descriptor, exported_app_file_name = tempfile.mkstemp(prefix=f"{app.attributes.name}-", suffix=".qvf")
+        os.close(file_descriptor)
         exported_app_file = open(exported_app_file_name, "w+b")
         shutil.copyfileobj(http_response.raw, exported_app_file)
         exported_app_file.seek(0)
@@ -75,6 +86,178 @@ def export_app(sdk_client, app_id):
         return exported_app_file
 
 
+class TemporaryAppFile(io.BufferedReader):
+    """
+    An exported app in a temporary file, which is deleted when it's closed. It has no instance attributes, so the Qlik
+    SDK sends it as is instead of as JSON.
+    """
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            os.remove(self.name)
+
+
+def export_app_to_cache(sdk_client, app_id, export_cache):
+    app = sdk_client.apps.get(app_id)
+    logger.info(f"Retrieved the app with ID '{app_id}' from tenant '{sdk_client.config.host}'.")
+
+    cache_key = app_export_cache.get_cache_key(sdk_client, app)
+    if not cache_key:
+        # Without a version a cached export could never be told apart from a newer one
+        logger.warning(
+            f"The app with ID '{app_id}' from '{sdk_client.config.host}' has no reload time or modified date, exporting it without the cache.")
+        with sdk_client.rest(path=app.export(), method="get", stream=True) as http_response:
+            file_descriptor, exported_app_file_name = tempfile.mkstemp(prefix=f"{app.attributes.name}-",
+                                                                       suffix=".qvf")
+            with os.fdopen(file_descriptor, "wb") as exported_app_file:
+                shutil.copyfileobj(http_response.raw, exported_app_file)
+
+        return TemporaryAppFile(io.FileIO(exported_app_file_name, "r"))
+
+    with export_cache.get_key_lock(cache_key):
+        exported_app_file = export_cache.open(cache_key)
+        if exported_app_file:
+            logger.info(
+                f"Using the cached export '{exported_app_file.name}' of the app '{app.attributes.name}' with ID '{app_id}' from '{sdk_client.config.host}'.")
+        else:
+            app_location_url = app.export()
+            with sdk_client.rest(path=app_location_url, method="get", stream=True) as http_response:
+                exported_app_file = export_cache.put(cache_key, http_response.raw)
+
+            logger.info(
+                f"Exported the app '{app.attributes.name}' with ID '{app_id}' from '{sdk_client.config.host}' to '{exported_app_file.name}'.")
+
+    return exported_app_file
+
+
+class AppTransferStream(io.RawIOBase):
+    """
+    Streams the body of an app export response as the body of an app import request. A background thread reads the
+    export response into a bounded queue of `max_buffered_chunks` chunks, so the download and the upload overlap while
+    at most `chunk_size * (max_buffered_chunks + 2)` bytes are held in memory: the queued chunks, the chunk the reader
+    thread waits to queue and the chunk being sent. `peak_buffered_bytes` counts the first two.
+    """
+
+    # The Qlik SDK sends a request body that has instance attributes as JSON, keeping the attributes in slots makes it
+    # send the stream as is.
+    __slots__ = ("name", "len", "_http_response", "_chunk_size", "_chunks", "_current_chunk", "_is_stopped",
+                 "_reader_thread", "_position", "_buffered_bytes", "_buffered_bytes_lock", "peak_buffered_bytes",
+                 "start_time")
+
+    def __init__(self, http_response, name, chunk_size=1024 * 1024, max_buffered_chunks=8):
+        super().__init__()
+        self.name = name
+        content_length = http_response.headers.get("Content-Length")
+        # Lets the HTTP client send a Content-Length instead of using a chunked transfer encoding when it's known
+        self.len = int(content_length) if content_length else None
+        self._http_response = http_response
+        self._chunk_size = chunk_size
+        self._chunks = queue.Queue(maxsize=max_buffered_chunks)
+        self._current_chunk = memoryview(b"")
+        self._is_stopped = threading.Event()
+        self._position = 0
+        self._buffered_bytes = 0
+        self._buffered_bytes_lock = threading.Lock()
+        self.peak_buffered_bytes = 0
+        self.start_time = time.perf_counter()
+        self._reader_thread = threading.Thread(target=self._read_response, name="app-transfer-reader", daemon=True)
+        self._reader_thread.start()
+
+    def _read_response(self):
+        try:
+            while not self._is_stopped.is_set():
+                chunk = self._http_response.raw.read(self._chunk_size)
+                self._put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # Wait for room in the buffer, unless the stream has been closed by the consumer
+        while not self._is_stopped.is_set():
+            if isinstance(item, bytes):
+                with self._buffered_bytes_lock:
+                    self._buffered_bytes += len(item)
+                    self.peak_buffered_bytes = max(self.peak_buffered_bytes, self._buffered_bytes)
+            try:
+                self._chunks.put(item, timeout=0.5)
+            except queue.Full:
+                if isinstance(item, bytes):
+                    with self._buffered_bytes_lock:
+                        self._buffered_bytes -= len(item)
+                continue
+
+            return
+
+    def _next_chunk(self):
+        if not self._current_chunk and self._chunks is not None:
+            item = self._chunks.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                # The whole response has been read
+                self._chunks = None
+            else:
+                with self._buffered_bytes_lock:
+                    self._buffered_bytes -= len(item)
+                self._current_chunk = memoryview(item)
+
+        return self._current_chunk
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._next_chunk()
+        read_size = min(len(buffer), len(chunk))
+        buffer[:read_size] = chunk[:read_size]
+        self._current_chunk = chunk[read_size:]
+        self._position += read_size
+        return read_size
+
+    def __next__(self):
+        # Iterating (used for chunked uploads) yields whole chunks instead of lines
+        chunk = self._next_chunk()
+        if not chunk:
+            raise StopIteration
+
+        self._current_chunk = memoryview(b"")
+        self._position += len(chunk)
+        return chunk.tobytes()
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._is_stopped.set()
+        super().close()
+
+    def get_throughput(self):
+        elapsed_time = time.perf_counter() - self.start_time
+        return self._position, elapsed_time, self._position / elapsed_time if elapsed_time > 0 else 0
+
+
+def stream_app(source_sdk_client, app_id, target_sdk_client, space_id, chunk_size=1024 * 1024, max_buffered_chunks=8):
+    app = source_sdk_client.apps.get(app_id)
+    logger.info(f"Retrieved the app with ID '{app_id}' from tenant '{source_sdk_client.config.host}'.")
+
+    app_location_url = app.export()
+
+    # Pipe the exported app directly into the import request, without storing it locally
+    with source_sdk_client.rest(path=app_location_url, method="get", stream=True) as http_response:
+        with AppTransferStream(http_response, f"{app.attributes.name}.qvf", chunk_size,
+                               max_buffered_chunks) as app_stream:
+            imported_app = import_app(target_sdk_client, app_stream, space_id)
+
+            transferred_bytes, elapsed_time, throughput = app_stream.get_throughput()
+            logger.info(
+                f"Streamed the app '{app.attributes.name}' with ID '{app_id}' from '{source_sdk_client.config.host}' to '{target_sdk_client.config.host}': {transferred_bytes} bytes in {elapsed_time:.1f} seconds ({throughput / (1024 * 1024):.1f} MiB/s), peak buffered memory {app_stream.peak_buffered_bytes} bytes.")
+
+    return imported_app
+
+
 def import_app(sdk_client, app_file, space_id):
     dev_space = sdk_client.spaces.get(space_id)
     logger.info(f"Retrieved the space with ID '{dev_space.id}' from tenant '{sdk_client.config.host}'.")
@@ -85,11 +268,120 @@ def import_app(sdk_client, app_file, space_id):
         mode="autoreplace"
     )
 
+    app_file_name = app_file.name if isinstance(app_file, AppTransferStream) else os.path.realpath(app_file.name)
     logger.info(
-        f"Imported the app '{os.path.realpath(app_file.name)}' to app '{imported_app.attributes.name}' with ID '{imported_app.attributes.id} in space '{dev_space.name}' with ID '{dev_space.id}' in '{sdk_client.config.host}'")
+        f"Imported the app '{app_file_name}' to app '{imported_app.attributes.name}' with ID '{imported_app.attributes.id} in space '{dev_space.name}' with ID '{dev_space.id}' in '{sdk_client.config.host}'")
     return imported_app
 
 
+def parse_updated_at(value):
+    """
+    Parses an 'updatedAt' timestamp of the items API, an ISO 8601 timestamp in UTC such as '2024-01-31T12:00:00.123Z'.
+    """
+    # datetime.fromisoformat() only accepts 'Z' and 3 or 6 fractional digits from Python 3.11 on
+    value = re.sub(r"\.(\d+)", lambda match: "." + match.group(1)[:6].ljust(6, "0"), value.replace("Z", "+00:00"))
+    updated_at = datetime.datetime.fromisoformat(value)
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=datetime.timezone.utc)
+    return updated_at
+
+
+class PublishedAppIndex:
+    """
+    Maps the IDs of the origin apps to the IDs of the apps published from them in a managed space. The app items in
+    the space are read newest first, and only as far as needed: the first lookup stops at the item of the requested
+    app, a later lookup of an app that hasn't been seen yet continues that scan. Items updated since the newest item
+    seen are read first on every lookup, so a lookup in an up to date index is a single request.
+    """
+
+    def __init__(self, sdk_client, space_id):
+        self.sdk_client = sdk_client
+        self.space_id = space_id
+        self._published_app_ids = {}
+        self._last_updated_at = None
+        self._scan = None
+        self._is_scan_complete = False
+        self._lock = threading.Lock()
+
+    def _get_app_items(self):
+        return self.sdk_client.items.get_items(resourceType="app", spaceId=self.space_id, sort="-updatedAt",
+                                               limit=100).pagination
+
+    def _add_item(self, app_item):
+        origin_app_id = app_item.resourceAttributes.get('originAppId')
+        if origin_app_id:
+            self._published_app_ids.setdefault(origin_app_id, app_item.resourceAttributes['id'])
+        return origin_app_id
+
+    def _read_updated_items(self):
+        newest_updated_at = None
+        item_count = 0
+        for app_item in self._get_app_items():
+            updated_at = parse_updated_at(app_item.updatedAt)
+            if updated_at < self._last_updated_at:
+                break
+
+            newest_updated_at = newest_updated_at or updated_at
+            item_count += 1
+            # A newer item replaces what the scan found for the same origin app
+            origin_app_id = app_item.resourceAttributes.get('originAppId')
+            if origin_app_id:
+                self._published_app_ids[origin_app_id] = app_item.resourceAttributes['id']
+
+        if newest_updated_at:
+            self._last_updated_at = newest_updated_at
+
+        logger.debug(
+            f"Read {item_count} updated items of the published app index of space '{self.space_id}' in tenant '{self.sdk_client.config.host}'.")
+
+    def _scan_until(self, origin_app_id):
+        if self._scan is None:
+            self._scan = self._get_app_items()
+
+        item_count = 0
+        for app_item in self._scan:
+            item_count += 1
+            if self._last_updated_at is None:
+                self._last_updated_at = parse_updated_at(app_item.updatedAt)
+            if self._add_item(app_item) == origin_app_id:
+                break
+        else:
+            self._is_scan_complete = True
+
+        logger.debug(
+            f"Scanned {item_count} items for the published app index of space '{self.space_id}' in tenant '{self.sdk_client.config.host}'.")
+
+    def get(self, origin_app_id):
+        with self._lock:
+            if self._last_updated_at is not None:
+                self._read_updated_items()
+            if origin_app_id not in self._published_app_ids and not self._is_scan_complete:
+                self._scan_until(origin_app_id)
+
+            return self._published_app_ids.get(origin_app_id)
+
+    def add(self, origin_app_id, published_app_id):
+        with self._lock:
+            self._published_app_ids[origin_app_id] = published_app_id
+
+    def remove(self, origin_app_id):
+        with self._lock:
+            self._published_app_ids.pop(origin_app_id, None)
+
+
+_published_app_indexes = {}
+_published_app_indexes_lock = threading.Lock()
+
+
+def get_published_app_index(sdk_client, space_id):
+    with _published_app_indexes_lock:
+        key = (sdk_client.config.host, space_id)
+        if key not in _published_app_indexes:
+            _published_app_indexes[key] = PublishedAppIndex(sdk_client, space_id)
+
+        return _published_app_indexes[key]
+
+
 def publish_app(sdk_client, imported_app, space_id):
     space = sdk_client.spaces.get(space_id)
     logger.info(f"Retrieved the space with ID '{space_id}' from tenant '{sdk_client.config.host}'.")
@@ -99,75 +391,106 @@ def publish_app(sdk_client, imported_app, space_id):
         exit(1)
 
     # Determine if the app has already been previously published
-    published_app_id = None
-    app_items = sdk_client.items.get_items(resourceType="app", spaceId=space_id).pagination
-    for app_item in app_items:
-        if app_item.resourceAttributes['originAppId'] == imported_app.attributes.id:
-            published_app_id = app_item.resourceAttributes['id']
-            break
+    published_app_index = get_published_app_index(sdk_client, space_id)
+    published_app_id = published_app_index.get(imported_app.attributes.id)
 
     logger.info(
         f"Queried the items in space '{space.name}' with ID '{imported_app.attributes.id}' to determine if the app with ID '{imported_app.attributes.id} has been previously published in tenant '{sdk_client.config.host}'")
 
+    published_app = None
     if published_app_id:
-        # This will do a republish (replaces the previously published app)
-        published_app = imported_app.set_publish({"spaceId": space_id, "targetId": published_app_id})
+        try:
+            # This will do a republish (replaces the previously published app)
+            published_app = imported_app.set_publish({"spaceId": space_id, "targetId": published_app_id})
+        except HTTPError as http_error:
+            # The previously published app may have been deleted since the index was built
+            if http_error.response.status_code != 404:
+                raise http_error
 
-        logger.info(
-            f"Republished the app with ID '{imported_app.attributes.id}' to the app with ID '{published_app.attributes.id}' in tenant '{sdk_client.config.host}'.")
-    else:
+            published_app_index.remove(imported_app.attributes.id)
+        else:
+            logger.info(
+                f"Republished the app with ID '{imported_app.attributes.id}' to the app with ID '{published_app.attributes.id}' in tenant '{sdk_client.config.host}'.")
+
+    if not published_app:
         published_app = imported_app.publish({"spaceId": space_id})
         logger.info(
             f"Published the app with ID '{imported_app.attributes.id}' to the app with ID '{published_app.attributes.id}' in tenant '{sdk_client.config.host}'.")
 
+    published_app_index.add(imported_app.attributes.id, published_app.attributes.id)
+
     logger.info(
             f"The app '{imported_app.attributes.name}' with ID '{imported_app.attributes.id}' has been published to space '{space.name}' with app ID '{published_app.attributes.id}' in tenant '{sdk_client.config.host}'.")
     return published_app
 
 
 def verify_user_access_to_published_app(sdk_client, managed_space_id, published_app, jwt_idp_config):
-    jwt_auth = JwtAuth(sdk_client.config.host, jwt_idp_config, subject=f"temp_user", name=f"temp_user",
-                       email=f"temp_user@jwt.io", groups=[constants.GROUP_ANALYTICS_CONSUMER])
+    verify_user_access_to_published_apps(sdk_client, [published_app], jwt_idp_config)
 
-    user = json.loads(jwt_auth.rest(path="/api/v1/users/me", method="GET").text)
 
-    logger.info(
-        f"Created a JWT authentication session for a user in group '{constants.GROUP_ANALYTICS_CONSUMER}' in tenant '{sdk_client.config.host}'.")
+def verify_user_access_to_published_apps(sdk_client, published_apps, jwt_idp_config,
+                                         group_names=(constants.GROUP_ANALYTICS_CONSUMER,), concurrency=8):
+    # Create a temporary user per group, then wait for every user to get access to every app at the same time
+    temp_users = []
+    try:
+        for index, group_name in enumerate(group_names):
+            jwt_auth = JwtAuth(sdk_client.config.host, jwt_idp_config, subject=f"temp_user_{index}",
+                               name=f"temp_user_{index}", email=f"temp_user_{index}@jwt.io", groups=[group_name])
+            user = json.loads(jwt_auth.rest(path="/api/v1/users/me", method="GET").text)
+            temp_users.append((group_name, jwt_auth, user))
+
+            logger.info(
+                f"Created a JWT authentication session for a user in group '{group_name}' in tenant '{sdk_client.config.host}'.")
+
+        polling.wait_for_all([(
+            f"access for the group '{group_name}' to the published app with ID '{published_app.attributes.id}' in tenant '{sdk_client.config.host}'",
+            _create_app_access_check(jwt_auth, published_app.attributes.id)
+        ) for group_name, jwt_auth, _ in temp_users for published_app in published_apps], concurrency)
+
+        for group_name, _, _ in temp_users:
+            logger.info(
+                f"Verified user access for the group '{group_name}' to the published apps with IDs {[published_app.attributes.id for published_app in published_apps]} in tenant '{sdk_client.config.host}'.")
+    finally:
+        # Delete the temporary users, they're not needed
+        for _, _, user in temp_users:
+            sdk_client.rest(path=f"/api/v1/users/{user['id']}", method="DELETE")
+
+            logger.info(f"Deleted temporary user with ID '{user['id']}' from '{sdk_client.config.host}'.")
+
 
-    # Retry in case of failure
-    retry_count = 0
-    while retry_count < 120:
+def _create_app_access_check(jwt_auth, app_id):
+    def can_access_app():
         try:
-            jwt_auth.rest(path=f"/api/v1/apps/{published_app.attributes.id}", method="GET")
+            jwt_auth.rest(path=f"/api/v1/apps/{app_id}", method="GET")
         except HTTPError as http_error:
+            # Access to a newly published app takes a moment to propagate
             if http_error.response.status_code == 403:
-                time.sleep(1)
-                retry_count += 1
-            else:
-                raise http_error
-        else:
-            logger.info(
-                f"Verified user access for the group '{constants.GROUP_ANALYTICS_CONSUMER}' to the published app with ID '{published_app.attributes.id}' in tenant '{sdk_client.config.host}'.")
-            if retry_count > 0:
-                logger.warning(f"It took '{retry_count + 1}' attempts to verify access to the published app.")
-            break
+                return False
+            raise http_error
 
-    # Delete the temporary user, it's not needed
-    sdk_client.rest(path=f"/api/v1/users/{user['id']}", method="DELETE")
+        return True
 
-    logger.info(f"Deleted temporary user with ID '{user['id']}' from '{sdk_client.config.host}'.")
+    return can_access_app
 
 
+@concurrency_controller.limited
 def run(source_tenant_sdk_client, source_app_id, target_tenant_sdk_client, target_shared_space_id,
-        target_managed_space_id, jwt_idp_config):
+        target_managed_space_id, jwt_idp_config, stream_transfer=False, export_cache=None):
     verify_bot_access_to_source_app(source_tenant_sdk_client, source_app_id)
 
-    with export_app(source_tenant_sdk_client, source_app_id) as exported_app_file:
-        try:
+    if export_cache:
+        with export_app_to_cache(source_tenant_sdk_client, source_app_id, export_cache) as exported_app_file:
             imported_app = import_app(target_tenant_sdk_client, exported_app_file, target_shared_space_id)
-        finally:
-            exported_app_file.close()
-            os.remove(exported_app_file.name)
+    elif stream_transfer:
+        imported_app = stream_app(source_tenant_sdk_client, source_app_id, target_tenant_sdk_client,
+                                  target_shared_space_id)
+    else:
+        with export_app(source_tenant_sdk_client, source_app_id) as exported_app_file:
+            try:
+                imported_app = import_app(target_tenant_sdk_client, exported_app_file, target_shared_space_id)
+            finally:
+                exported_app_file.close()
+                os.remove(exported_app_file.name)
 
     published_app = publish_app(target_tenant_sdk_client, imported_app, target_managed_space_id)
 
@@ -199,14 +522,23 @@ if __name__ == "__main__":
     target_tenant_group.add_argument("--target-shared-space-id", required=True, help="increase output verbosity")
     target_tenant_group.add_argument("--target-managed-space-id", required=True, help="increase output verbosity")
 
+    parser.add_argument("--stream-transfer", required=False, action="store_true", default=False,
+                        help="Stream the exported app directly into the import instead of downloading it to a local file first.")
+    app_export_cache.add_export_cache_arguments(parser)
+
     jwt_group = parser.add_argument_group("Target Tenant JWT IdP Configuration")
     jwt_group.add_argument("--jwt-issuer", required=False, help="The 'issuer' field to use in the JWT.")
     jwt_group.add_argument("--jwt-key-id", required=False, help="The 'kid' field to use in the JWT.")
     jwt_group.add_argument("--jwt-private-key", required=False, help="The path to the local private key file.")
     jwt_group.add_argument("--jwt-public-key", required=False, help="The path to the local public key file.")
 
+    qlik_sdk_helper.add_sdk_client_arguments(parser)
+
     args = parser.parse_args()
+    if args.stream_transfer and args.export_cache_dir:
+        parser.error("--stream-transfer and --export-cache-dir can't be combined, a streamed app isn't cached.")
     logging.basicConfig(level=args.log_level)
+    qlik_sdk_helper.configure_sdk_clients(args)
 
     jwt_idp_config = None
     if args.jwt_issuer or args.jwt_key_id or args.jwt_private_key or args.jwt_public_key:
@@ -221,4 +553,5 @@ if __name__ == "__main__":
                                                                  args.target_tenant_hostname)
 
     run(source_tenant_sdk_client, args.source_app_id, target_tenant_sdk_client, args.target_shared_space_id,
-        args.target_managed_space_id, jwt_idp_config)
+        args.target_managed_space_id, jwt_idp_config, args.stream_transfer,
+        app_export_cache.create_export_cache(args))
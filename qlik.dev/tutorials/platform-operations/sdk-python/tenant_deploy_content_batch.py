@@ -0,0 +1,159 @@
+"""
+Deploys one app to many target tenants in parallel, based on the 'Deploy a Qlik Sense application to a tenant'
+tutorial from https://qlik.dev/manage/platform-operations/deploy-content-to-a-tenant
+
+The targets are read from a JSON manifest file, for example:
+
+    [
+        {"hostname": "tenant1.region.qlikcloud.com", "shared_space_id": "<SPACE_ID>", "managed_space_id": "<SPACE_ID>"},
+        {"hostname": "tenant2.region.qlikcloud.com", "shared_space_id": "<SPACE_ID>", "managed_space_id": "<SPACE_ID>"}
+    ]
+
+The app is exported from the source tenant once and then imported, published and verified in every target tenant.
+
+For a detailed overview of the supported arguments execute:
+
+    python tenant_deploy_content_batch.py --help
+"""
+import argparse
+import json
+import logging
+import tempfile
+import time
+
+from argparse_logging import add_log_level_argument
+
+import app_export_cache
+import batch_runner
+import concurrency_controller
+import qlik_sdk_helper
+import tenant_deploy_content
+from jwt_auth import JwtIdpConfig
+
+logger = logging.getLogger(__name__)
+
+
+def read_targets(manifest_file_path):
+    with open(manifest_file_path, "r") as file:
+        targets = json.load(file)
+
+    for target in targets:
+        for field_name in ["hostname", "shared_space_id", "managed_space_id"]:
+            if not target.get(field_name):
+                raise ValueError(f"The target {target} in the manifest '{manifest_file_path}' has no '{field_name}'.")
+
+    logger.info(f"Read {len(targets)} targets from the manifest '{manifest_file_path}'.")
+    return targets
+
+
+@concurrency_controller.limited
+def deploy_to_target(batch_result, source_tenant_sdk_client, source_app_id, oauth_client_id, oauth_secret, target,
+                     export_cache, jwt_idp_config, exported_app_path=None):
+    target_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(oauth_client_id, oauth_secret, target["hostname"])
+
+    with batch_result.time_stage("import"):
+        if exported_app_path:
+            exported_app_file = open(exported_app_path, "rb")
+        else:
+            exported_app_file = tenant_deploy_content.export_app_to_cache(source_tenant_sdk_client, source_app_id,
+                                                                          export_cache)
+        with exported_app_file:
+            imported_app = tenant_deploy_content.import_app(target_tenant_sdk_client, exported_app_file,
+                                                            target["shared_space_id"])
+
+    with batch_result.time_stage("publish"):
+        published_app = tenant_deploy_content.publish_app(target_tenant_sdk_client, imported_app,
+                                                          target["managed_space_id"])
+
+    if jwt_idp_config:
+        with batch_result.time_stage("verify"):
+            tenant_deploy_content.verify_user_access_to_published_app(target_tenant_sdk_client,
+                                                                      target["managed_space_id"], published_app,
+                                                                      jwt_idp_config)
+
+    return published_app.attributes.id
+
+
+def run(source_tenant_sdk_client, source_app_id, oauth_client_id, oauth_secret, targets, export_cache,
+        jwt_idp_config, concurrency=4, retries=2):
+    tenant_deploy_content.verify_bot_access_to_source_app(source_tenant_sdk_client, source_app_id)
+
+    # Export the app up front, all the targets import the cached export. An app without a version can't be cached,
+    # its export is kept until all the targets have imported it and is deleted when it's closed.
+    with tenant_deploy_content.export_app_to_cache(source_tenant_sdk_client, source_app_id,
+                                                   export_cache) as exported_app_file:
+        exported_app_path = None
+        if isinstance(exported_app_file, tenant_deploy_content.TemporaryAppFile):
+            exported_app_path = exported_app_file.name
+
+        def create_task(target):
+            def task(batch_result):
+                return deploy_to_target(batch_result, source_tenant_sdk_client, source_app_id, oauth_client_id,
+                                        oauth_secret, target, export_cache, jwt_idp_config, exported_app_path)
+
+            return target["hostname"], task
+
+        return batch_runner.run_batch([create_task(target) for target in targets], concurrency, retries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_log_level_argument(parser)
+    parser.add_argument("--client-id", required=True, help="The OAuth client ID.")
+    parser.add_argument("--client-secret", required=True, help="The OAuth client secret.")
+    parser.add_argument("--concurrency", required=False, type=int, default=4,
+                        help="The maximum number of target tenants to deploy to at the same time.")
+    parser.add_argument("--retries", required=False, type=int, default=2,
+                        help="The number of times to retry deploying to a target tenant after a failure.")
+    parser.add_argument("--summary-file", required=False, default="-",
+                        help="The file to write the JSON summary of the deployment to, '-' writes it to stdout.")
+
+    source_tenant_group = parser.add_argument_group("Source Tenant Information")
+    source_tenant_group.add_argument("--source-tenant-hostname", required=True,
+                                     help="The hostname of the source tenant, for example: tenant.region.qlikcloud.com")
+    source_tenant_group.add_argument("--source-app-id", required=True,
+                                     help="The ID of the app in the source tenant to deploy to the target tenants.")
+    app_export_cache.add_export_cache_arguments(source_tenant_group)
+
+    target_tenant_group = parser.add_argument_group("Target Tenants Information")
+    target_tenant_group.add_argument("--targets-manifest", required=True,
+                                     help="The JSON file listing the 'hostname', 'shared_space_id' and 'managed_space_id' of every target tenant.")
+
+    jwt_group = parser.add_argument_group("Target Tenants JWT IdP Configuration")
+    jwt_group.add_argument("--jwt-issuer", required=False, help="The 'issuer' field to use in the JWT.")
+    jwt_group.add_argument("--jwt-key-id", required=False, help="The 'kid' field to use in the JWT.")
+    jwt_group.add_argument("--jwt-private-key", required=False, help="The path to the local private key file.")
+    jwt_group.add_argument("--jwt-public-key", required=False, help="The path to the local public key file.")
+
+    qlik_sdk_helper.add_sdk_client_arguments(parser)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    qlik_sdk_helper.configure_sdk_clients(args)
+
+    jwt_idp_config = None
+    if args.jwt_issuer or args.jwt_key_id or args.jwt_private_key or args.jwt_public_key:
+        jwt_idp_config = JwtIdpConfig(args.jwt_issuer, args.jwt_key_id, args.jwt_private_key, args.jwt_public_key)
+        if not jwt_idp_config.validate():
+            parser.print_help()
+            exit(1)
+
+    targets = read_targets(args.targets_manifest)
+
+    source_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(args.client_id, args.client_secret,
+                                                                 args.source_tenant_hostname)
+
+    with tempfile.TemporaryDirectory(prefix="app-export-") as temp_export_cache_dir:
+        export_cache = app_export_cache.create_export_cache(args) or app_export_cache.AppExportCache(
+            temp_export_cache_dir)
+
+        start_time = time.perf_counter()
+        batch_results = run(source_tenant_sdk_client, args.source_app_id, args.client_id, args.client_secret,
+                            targets, export_cache, jwt_idp_config, args.concurrency, args.retries)
+        total_duration = time.perf_counter() - start_time
+
+    batch_runner.log_summary(batch_results, total_duration)
+    batch_runner.write_summary(batch_results, total_duration, args.summary_file)
+
+    if not all(batch_result.succeeded for batch_result in batch_results):
+        exit(1)
@@ -1,69 +1,346 @@
 import argparse
+import gzip
+import hashlib
+import hmac
 import http.server
 import json
 import logging
 import random
+import socket
 import ssl
 import threading
+import time
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 from argparse_logging import add_log_level_argument
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 import constants
+import engine_session_pool
+import pagination
 import qlik_sdk_helper
-from jwt_auth import JwtAuth, JwtIdpConfig
+from jwt_auth import JwtAuth, JwtClaimTemplate, JwtIdpConfig, JwtTokenPool
+from step_scheduler import Step, run_steps
 
 logger = logging.getLogger(__name__)
 
 
 class CORSHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
-
-    def __init__(self, jwt_auth, index_html_page):
-        self.jwt_auth = jwt_auth
-        self.index_html_page = index_html_page
-        self.is_jwt_request_handled = False
-
-    def __call__(self, *args, **kwargs):
-        """Handle a request."""
-        super().__init__(*args, **kwargs)
+    # HTTP/1.1 keeps the connection alive between requests, every response must therefore set a Content-Length
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.timeout = self.server.keep_alive_timeout
+        super().setup()
+
+    def handle(self):
+        self.close_connection = False
+        while not self.close_connection and not self.server.is_shutting_down:
+            # The connection is idle until the next request line has been read, including before the first request.
+            # The server closes idle connections when it needs their worker for a new connection.
+            self.server.set_connection_idle(self.connection, True)
+            try:
+                self.handle_one_request()
+            finally:
+                self.server.set_connection_idle(self.connection, False)
+
+    def parse_request(self):
+        self.server.set_connection_idle(self.connection, False)
+        return super().parse_request()
 
     def end_headers(self):
         # Include additional response headers here. CORS for example:
         self.send_header('Access-Control-Allow-Origin', '*')
         http.server.BaseHTTPRequestHandler.end_headers(self)
 
+    def flush_headers(self):
+        # Send the headers and the body in a single write, so a small response goes out in a single TLS record
+        if hasattr(self, "_headers_buffer") and getattr(self, "_pending_body", None):
+            self._headers_buffer.append(self._pending_body)
+        self._pending_body = None
+        super().flush_headers()
+
+    def send_body(self, content_type, body, headers=None):
+        self.send_response(200)
+        self.send_header("Content-type", content_type)
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+        self.send_header("Content-Length", str(len(body)))
+        self._pending_body = body
+        self.end_headers()
+
+    def send_page(self, page):
+        content_encoding = page.select_encoding(self.headers.get("Accept-Encoding"))
+        headers = page.get_cache_headers(content_encoding)
+        if page.is_not_modified(content_encoding, self.headers.get("If-None-Match")):
+            self.send_response(304)
+            for header_name, header_value in headers.items():
+                self.send_header(header_name, header_value)
+            self.end_headers()
+            return
+
+        if content_encoding != "identity":
+            headers["Content-Encoding"] = content_encoding
+        self.send_body(page.content_type, page.bodies[content_encoding], headers)
+
     def do_GET(self):
         logger.info(f"Handled: {self.path}")
 
         if self.path == '/jwt':
-            self.is_jwt_request_handled = True
-            self.send_response(200)
-            self.send_header("Content-type", "Content-Type: application/json")
-            self.end_headers()
-            self.wfile.write(bytes(json.dumps({
-                "body": self.jwt_auth.generate_token()
-            }), "utf-8"))
+            try:
+                token = self.server.sign_jwt(self)
+            except ValueError as e:
+                logger.warning(f"Can't sign a JWT for the request: {e}")
+                self.send_response(400)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if not token:
+                self.send_response(401)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_body("application/json", bytes(json.dumps({
+                "body": token
+            }), "utf-8"), {"Cache-Control": "no-store"})
+            self.server.jwt_request_handled.set()
         elif self.path == "/":
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            self.wfile.write(bytes(self.index_html_page, "utf-8"))
+            self.send_page(self.server.index_page)
         else:
             self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
 
-    def is_jwt_request_handled(self):
-        return self.path
-
-
-def get_random_sheet_id(sdk_client, app_id):
-    # Open the app and pick a random sheet and return its ID
-    app = sdk_client.apps.get(app_id)
-    logger.info(f"Retrieved the app with ID '{app_id}' from tenant '{sdk_client.config.host}'.")
 
-    with app.open():
-        session_obj = app.create_session_object({
+class PrecompressedPage:
+    """
+    A static page that is encoded and compressed once up front. Every encoding of the page has its own ETag, clients
+    that send back the ETag of the encoding they would get in 'If-None-Match' get a 304 response. `cache_max_age`
+    controls how long browsers may use the page without revalidating it. Brotli compression is used when the optional
+    'brotli' package is installed.
+    """
+
+    def __init__(self, content, content_type="text/html; charset=utf-8", cache_max_age=0):
+        identity_body = bytes(content, "utf-8")
+        self.content_type = content_type
+        self.cache_control = f"max-age={cache_max_age}" if cache_max_age > 0 else "no-cache"
+
+        # Ordered by preference, smallest encoding first
+        self.bodies = {}
+        if brotli:
+            self.bodies["br"] = brotli.compress(identity_body)
+        self.bodies["gzip"] = gzip.compress(identity_body, compresslevel=9)
+        self.bodies["identity"] = identity_body
+
+        # A strong ETag identifies the exact bytes that are sent, so it differs per encoding
+        content_hash = hashlib.sha256(identity_body).hexdigest()[:32]
+        self.etags = {encoding: f'"{content_hash}"' if encoding == "identity" else f'"{content_hash}-{encoding}"'
+                      for encoding in self.bodies}
+
+    def get_cache_headers(self, encoding):
+        return {"ETag": self.etags[encoding], "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+
+    def is_not_modified(self, encoding, if_none_match):
+        if not if_none_match:
+            return False
+
+        return (if_none_match.strip() == "*"
+                or self.etags[encoding] in [etag.strip() for etag in if_none_match.split(",")])
+
+    def select_encoding(self, accept_encoding):
+        accepted_encodings = set()
+        for accepted_encoding in (accept_encoding or "").split(","):
+            encoding, _, parameters = accepted_encoding.partition(";")
+            quality = parameters.strip()
+            try:
+                is_accepted = not quality.startswith("q=") or float(quality[2:]) > 0
+            except ValueError:
+                is_accepted = True
+            if is_accepted:
+                accepted_encodings.add(encoding.strip().lower())
+
+        for encoding in self.bodies:
+            if encoding in accepted_encodings or encoding == "identity":
+                return encoding
+
+
+def header_identity_resolver(subject_header, groups_header=None, proxy_secret=None,
+                             proxy_secret_header="X-Embed-Proxy-Secret"):
+    """
+    Returns an identity resolver that reads the end user's subject (and optionally a comma separated list of groups)
+    from request headers, set by an authenticating reverse proxy in front of the webserver.
+
+    Any client that can reach the webserver can set these headers. When `proxy_secret` is given only requests with
+    the secret in the `proxy_secret_header` header, which the proxy adds, are trusted. Without it the webserver must
+    only be reachable through the proxy.
+
+    The resolved identity always has a 'subject', the 'groups' are only present when the groups header is set.
+    """
+
+    def resolve_identity(request_handler):
+        if proxy_secret and not hmac.compare_digest(
+                bytes(request_handler.headers.get(proxy_secret_header, ""), "utf-8"), bytes(proxy_secret, "utf-8")):
+            return None
+
+        subject = request_handler.headers.get(subject_header)
+        if not subject:
+            return None
+
+        identity = {"subject": subject}
+        if groups_header and request_handler.headers.get(groups_header):
+            identity["groups"] = [group.strip() for group in request_handler.headers[groups_header].split(",")]
+
+        return identity
+
+    return resolve_identity
+
+
+class EmbedHTTPServer(http.server.HTTPServer):
+    """
+    Serves the embed page and the JWT endpoint with a bounded pool of worker threads. The TLS handshake happens on the
+    worker thread, so a slow client doesn't block the server from accepting other connections.
+
+    A worker serves a connection until it's closed, so when all workers are busy a new connection closes the longest
+    idle keep-alive connection (or pending TLS handshake) to take over its worker. At most `max_queued` connections
+    wait for a worker, further connections are closed right away. Idle connections are also closed when the server is
+    shut down, requests in flight are completed first.
+    """
+
+    def __init__(self, server_address, ssl_context, jwt_auth, index_html_page, jwt_token_pool=None, workers=16,
+                 keep_alive_timeout=15, identity_resolver=None, jwt_claim_template=None, max_queued=64):
+        super().__init__(server_address, CORSHTTPRequestHandler)
+        self.ssl_context = ssl_context
+        self.jwt_auth = jwt_auth
+        self.index_page = PrecompressedPage(index_html_page)
+        self.jwt_token_pool = jwt_token_pool
+        self.identity_resolver = identity_resolver
+        self.jwt_claim_template = jwt_claim_template or JwtClaimTemplate()
+        self.keep_alive_timeout = keep_alive_timeout
+        self.jwt_request_handled = threading.Event()
+        self.is_shutting_down = False
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed-web-server")
+        self._connection_count = 0
+        # The idle connections by the time they became idle, oldest first
+        self._idle_connections = {}
+        self._idle_connections_lock = threading.Lock()
+
+    def sign_jwt(self, request_handler):
+        """
+        Signs a JWT for the identity of the request. Without an identity resolver every request gets a JWT for the
+        identity of `jwt_auth`, otherwise the claims are built from the JWT claim template for the resolved identity.
+        """
+        jwt_auth = self.jwt_auth
+        if self.identity_resolver:
+            identity = self.identity_resolver(request_handler)
+            if not identity:
+                return None
+
+            jwt_auth = self.jwt_claim_template.create_jwt_auth(self.jwt_auth.host, self.jwt_auth.config, identity)
+
+        if self.jwt_token_pool:
+            return self.jwt_token_pool.get_token(jwt_auth)
+
+        return jwt_auth.generate_token()
+
+    def process_request(self, request, client_address):
+        with self._idle_connections_lock:
+            if self._connection_count >= self.workers + self.max_queued:
+                logger.warning(f"Closing the connection from '{client_address}', {self._connection_count} "
+                               f"connections are already being served or waiting.")
+                self.shutdown_request(request)
+                return
+
+            self._connection_count += 1
+            idle_connection = None
+            if self._connection_count > self.workers and self._idle_connections:
+                idle_connection = next(iter(self._idle_connections))
+                del self._idle_connections[idle_connection]
+
+        if idle_connection:
+            # Unblocks the worker waiting for the next request on the idle connection, it then serves the new one
+            self._close_idle_connection(idle_connection)
+
+        self._executor.submit(self._process_request_on_worker, request, client_address)
+
+    def _process_request_on_worker(self, request, client_address):
+        try:
+            request.settimeout(self.keep_alive_timeout)
+            request = self.ssl_context.wrap_socket(request, server_side=True, do_handshake_on_connect=False)
+            self.set_connection_idle(request, True)
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, OSError) as e:
+                logger.debug(f"TLS handshake with '{client_address}' failed: {e}")
+                return
+            finally:
+                self.set_connection_idle(request, False)
+
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._idle_connections_lock:
+                self._connection_count -= 1
+
+    def set_connection_idle(self, connection, is_idle):
+        with self._idle_connections_lock:
+            if is_idle:
+                self._idle_connections[connection] = time.monotonic()
+            else:
+                self._idle_connections.pop(connection, None)
+
+    @staticmethod
+    def _close_idle_connection(connection):
+        try:
+            # Shut down the underlying socket, the worker reading from the TLS connection then sees the end of it
+            socket.socket.shutdown(connection, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def shutdown_gracefully(self):
+        self.is_shutting_down = True
+        self.shutdown()
+        with self._idle_connections_lock:
+            idle_connections = list(self._idle_connections)
+            self._idle_connections.clear()
+        for connection in idle_connections:
+            self._close_idle_connection(connection)
+
+        self._executor.shutdown(wait=True)
+        self.server_close()
+
+
+_sheet_ids = {}
+_sheet_ids_lock = threading.Lock()
+
+
+def get_sheet_ids(sdk_client, app):
+    """
+    Returns the IDs of the public sheets of the app (an NxApp from the REST API). The sheet list is read through a
+    pooled engine session and cached per app until the app is reloaded or republished.
+    """
+    key = (sdk_client.config.host, app.attributes.id)
+    app_version = engine_session_pool.get_app_version(app)
+    with _sheet_ids_lock:
+        cached_version, sheet_ids = _sheet_ids.get(key, (None, None))
+    if sheet_ids is not None and cached_version == app_version:
+        logger.info(f"Using the cached sheet list of the app with ID '{app.attributes.id}' on tenant '{sdk_client.config.host}'.")
+        return sheet_ids
+
+    with engine_session_pool.session_pool.session(sdk_client, app) as opened_app:
+        session_obj = opened_app.create_session_object({
             "qInfo": {
                 "qType": "SheetList",
                 "qId": ""
@@ -84,24 +361,43 @@ def get_random_sheet_id(sdk_client, app_id):
                 "qType": "sheet"
             }
         })
-        sheet_list_layout = session_obj.get_layout()
-        sheet_id_list = [q.qInfo.qId for q in sheet_list_layout.qAppObjectList.qItems]
-        if len(sheet_id_list) == 0:
-            logger.error(
-                f"There are no public sheets in the app with ID '{app_id}' on tenant '{sdk_client.config.host}'.")
-            exit(1)
+        try:
+            sheet_list_layout = session_obj.get_layout()
+        finally:
+            # The session is kept open, so the session objects are not discarded with it
+            opened_app.destroy_session_object(session_obj.qGenericId)
 
-        random_sheet_id = sheet_id_list[random.randint(0, len(sheet_id_list) - 1)]
+    sheet_ids = [q.qInfo.qId for q in sheet_list_layout.qAppObjectList.qItems]
+    with _sheet_ids_lock:
+        _sheet_ids[key] = (app_version, sheet_ids)
 
-        logger.info(
-            f"Opened a web socket to the app '{app.attributes.name}' with ID '{app.attributes.id}' on tenant '{sdk_client.config.host}' and selected the sheet with ID '{random_sheet_id}' to embed.")
+    logger.info(
+        f"Read the {len(sheet_ids)} sheets of the app '{app.attributes.name}' with ID '{app.attributes.id}' on tenant '{sdk_client.config.host}'.")
+    return sheet_ids
+
+
+def get_random_sheet_id(sdk_client, app_id):
+    # Pick a random sheet of the app and return its ID
+    app = sdk_client.apps.get(app_id)
+    logger.info(f"Retrieved the app with ID '{app_id}' from tenant '{sdk_client.config.host}'.")
+
+    sheet_id_list = get_sheet_ids(sdk_client, app)
+    if len(sheet_id_list) == 0:
+        logger.error(
+            f"There are no public sheets in the app with ID '{app_id}' on tenant '{sdk_client.config.host}'.")
+        exit(1)
 
-        return random_sheet_id
+    random_sheet_id = sheet_id_list[random.randint(0, len(sheet_id_list) - 1)]
+
+    logger.info(
+        f"Selected the sheet with ID '{random_sheet_id}' of the app '{app.attributes.name}' with ID '{app.attributes.id}' on tenant '{sdk_client.config.host}' to embed.")
+
+    return random_sheet_id
 
 
 def create_web_integration(sdk_client):
     # Check for an existing web integration with our origin
-    for existing_web_integration in json.loads(sdk_client.rest(path="/api/v1/web-integrations").text)['data']:
+    for existing_web_integration in pagination.paginate(sdk_client, "/api/v1/web-integrations"):
         if constants.LOCAL_WEB_SERVER_ADDRESS in existing_web_integration['validOrigins']:
             logger.info(
                 f"Using existing web integration '{existing_web_integration['name']}' with ID '{existing_web_integration['id']}' in tenant '{sdk_client.config.host}'.")
@@ -126,7 +422,7 @@ def create_web_integration(sdk_client):
 
 def create_content_security_policy(sdk_client):
     # Check for an existing csp with our origin and access rules
-    for existing_csp in json.loads(sdk_client.rest(path="/api/v1/csp-origins").text)['data']:
+    for existing_csp in pagination.paginate(sdk_client, "/api/v1/csp-origins"):
         if f"https://{existing_csp['origin']}" == constants.LOCAL_WEB_SERVER_ADDRESS and existing_csp['frameAncestors']:
             logger.info(
                 f"Using existing content security '{existing_csp['name']}' with ID '{existing_csp['id']}' in tenant '{sdk_client.config.host}'.")
@@ -160,12 +456,17 @@ def create_content_security_policy(sdk_client):
         f"Created content security policy {csp['name']} with ID '{csp['id']}' in tenant '{sdk_client.config.host}'.")
 
 
-def run(jwt_auth, sdk_client, published_app_id, published_app_sheet_id, exit_on_page_load):
-    web_integration_id = create_web_integration(sdk_client)
-    create_content_security_policy(sdk_client)
-
+def run(jwt_auth, sdk_client, published_app_id, published_app_sheet_id, exit_on_page_load, jwt_token_pool=None,
+        web_server_workers=16, web_server_keep_alive_timeout=15, identity_resolver=None, jwt_claim_template=None):
+    # The web integration, the content security policy and the sheet don't depend on each other
+    steps = [Step("web integration", lambda _: create_web_integration(sdk_client)),
+             Step("content security policy", lambda _: create_content_security_policy(sdk_client))]
     if not published_app_sheet_id:
-        published_app_sheet_id = get_random_sheet_id(sdk_client, published_app_id)
+        steps.append(Step("sheet", lambda _: get_random_sheet_id(sdk_client, published_app_id)))
+    results = run_steps(steps, f"preparing the embedding for tenant '{sdk_client.config.host}'")
+
+    web_integration_id = results["web integration"]
+    published_app_sheet_id = published_app_sheet_id or results["sheet"]
 
     jinja_env = Environment(
         loader=FileSystemLoader("."),
@@ -186,10 +487,10 @@ def run(jwt_auth, sdk_client, published_app_id, published_app_sheet_id, exit_on_
     ctx.check_hostname = False
     ctx.load_cert_chain(certfile=jwt_auth.config.public_key_file_path, keyfile=jwt_auth.config.private_key_file_path)
 
-    handler = CORSHTTPRequestHandler(jwt_auth, index_html_page)
-
-    httpd = http.server.HTTPServer(web_server_address, handler)
-    httpd.socket = ctx.wrap_socket(httpd.socket, server_side=True)
+    httpd = EmbedHTTPServer(web_server_address, ctx, jwt_auth, index_html_page, jwt_token_pool,
+                            web_server_workers, web_server_keep_alive_timeout, identity_resolver, jwt_claim_template)
+    server_thread = threading.Thread(target=httpd.serve_forever, name="embed-web-server")
+    server_thread.start()
 
     browser_thread = threading.Thread(target=launch_browser)
     browser_thread.start()
@@ -197,12 +498,23 @@ def run(jwt_auth, sdk_client, published_app_id, published_app_sheet_id, exit_on_
     logger.info(
         f"Starting web server using embedded sheet with ID '{published_app_sheet_id}' from app with ID '{published_app_id}' from tenant '{jwt_auth.host}'.")
 
-    if exit_on_page_load:
-        logger.info("Once the web page is loaded the webserver will be shutdown.")
-        while not handler.is_jwt_request_handled:
-            httpd.handle_request()
-    else:
-        httpd.serve_forever()
+    if jwt_token_pool:
+        jwt_token_pool.start()
+
+    try:
+        if exit_on_page_load:
+            logger.info("Once the web page is loaded the webserver will be shutdown.")
+            httpd.jwt_request_handled.wait()
+        else:
+            # Wait in short intervals, an indefinite wait can't be interrupted with Ctrl+C on all platforms
+            while server_thread.is_alive():
+                server_thread.join(1)
+    except KeyboardInterrupt:
+        logger.info("Shutting down the webserver.")
+    finally:
+        httpd.shutdown_gracefully()
+        if jwt_token_pool:
+            jwt_token_pool.stop()
 
 
 def launch_browser():
@@ -220,6 +532,10 @@ if __name__ == "__main__":
     parser.add_argument("--client-secret", required=True, help="The OAuth client secret.")
     parser.add_argument("--exit-on-page-load", required=False, action='store_true', default=False,
                         help="Whether the webserver that host the embedded content should be shutdown after loading the embedded content once.")
+    parser.add_argument("--web-server-workers", required=False, type=int, default=16,
+                        help="The number of connections the webserver handles concurrently.")
+    parser.add_argument("--web-server-keep-alive-timeout", required=False, type=float, default=15,
+                        help="The number of seconds an idle connection is kept open by the webserver.")
 
     target_tenant_group = parser.add_argument_group("Target Tenant Information")
     target_tenant_group.add_argument("--target-tenant-hostname", required=True,
@@ -249,9 +565,51 @@ if __name__ == "__main__":
                             help="The 'groups' field to use in the JWT claim (multiple groups can be specified).")
     jwt_claims.add_argument("--jwt-claim-expires_in", required=False, default=60, type=int,
                             help="The 'expires_in' field to use in the JWT.")
+    jwt_claims.add_argument("--jwt-pool-min-remaining", required=False, default=0, type=int,
+                            help="When greater than 0, signed JWTs are reused for requests with the same claims as long as they're valid for at least this many seconds. Must be lower than '--jwt-claim-expires_in'.")
+    jwt_claims.add_argument("--jwt-pool-max-size", required=False, default=10000, type=int,
+                            help="The maximum number of signed JWTs to keep for reuse, the least recently used are dropped first.")
+
+    jwt_identity = parser.add_argument_group("JWT Per User Identity")
+    jwt_identity.add_argument("--jwt-identity-header", required=False, default=None,
+                              help="The request header that holds the subject of the end user to sign the JWT for. When provided the JWT claims are built per request from the claim templates, the '--jwt-claim-groups' are used as template for the groups.")
+    jwt_identity.add_argument("--jwt-identity-groups-header", required=False, default=None,
+                              help="The request header that holds a comma separated list of the end user's groups.")
+    jwt_identity.add_argument("--jwt-identity-proxy-secret", required=False, default=None,
+                              help="A secret the authenticating reverse proxy sends in the 'X-Embed-Proxy-Secret' header, the identity headers of requests without it are ignored.")
+    jwt_identity.add_argument("--jwt-identity-trust-headers", required=False, action="store_true", default=False,
+                              help="Trust the identity headers of every request without a proxy secret. Any client that can reach the webserver can then sign a JWT for any user, only use it when the webserver is only reachable through the proxy.")
+    jwt_identity.add_argument("--jwt-claim-template-name", required=False, default="{subject}",
+                              help="The template for the 'name' field of per user JWTs.")
+    jwt_identity.add_argument("--jwt-claim-template-email", required=False, default="{subject}@jwt.io",
+                              help="The template for the 'email' field of per user JWTs.")
+
+    qlik_sdk_helper.add_sdk_client_arguments(parser)
 
     args = parser.parse_args()
+    if 0 < args.jwt_pool_min_remaining >= args.jwt_claim_expires_in:
+        parser.error("--jwt-pool-min-remaining must be lower than --jwt-claim-expires_in, otherwise every request "
+                     "signs a new JWT.")
+    if args.jwt_identity_header and not (args.jwt_identity_proxy_secret or args.jwt_identity_trust_headers):
+        parser.error("--jwt-identity-header requires --jwt-identity-proxy-secret or --jwt-identity-trust-headers.")
     logging.basicConfig(level=args.log_level)
+    qlik_sdk_helper.configure_sdk_clients(args)
+
+    identity_resolver = None
+    jwt_claim_template = None
+    if args.jwt_identity_header:
+        identity_resolver = header_identity_resolver(args.jwt_identity_header, args.jwt_identity_groups_header,
+                                                     args.jwt_identity_proxy_secret)
+        jwt_claim_template = JwtClaimTemplate(args.jwt_claim_template_name, args.jwt_claim_template_email,
+                                              args.jwt_claim_email_verified, args.jwt_claim_groups,
+                                              args.jwt_claim_expires_in)
+        # The header identity resolver only guarantees the subject
+        unknown_fields = jwt_claim_template.get_fields() - {"subject"}
+        if unknown_fields:
+            parser.error(f"The JWT claim templates can only refer to '{{subject}}', not to {sorted(unknown_fields)}.")
+        if not args.jwt_identity_proxy_secret:
+            logger.warning(f"Trusting the '{args.jwt_identity_header}' header of every request, any client that can "
+                           f"reach the webserver can sign a JWT for any user.")
 
     jwt_idp_config = JwtIdpConfig(args.jwt_issuer, args.jwt_key_id, args.jwt_private_key, args.jwt_public_key)
     if not jwt_idp_config.validate():
@@ -266,5 +624,18 @@ if __name__ == "__main__":
     target_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(args.client_id, args.client_secret,
                                                                  args.target_tenant_hostname)
 
-    run(jwt_auth, target_tenant_sdk_client, args.target_published_app_id, args.target_published_app_sheet_id,
-        args.exit_on_page_load)
+    jwt_token_pool = None
+    jwt_pool_min_remaining = args.jwt_pool_min_remaining
+    if identity_resolver and jwt_pool_min_remaining <= 0:
+        # Reuse per user tokens for at least half their lifetime so page refreshes don't sign a new token
+        jwt_pool_min_remaining = args.jwt_claim_expires_in // 2
+    if jwt_pool_min_remaining > 0:
+        jwt_token_pool = JwtTokenPool(min_remaining=jwt_pool_min_remaining, max_size=args.jwt_pool_max_size)
+
+    try:
+        run(jwt_auth, target_tenant_sdk_client, args.target_published_app_id, args.target_published_app_sheet_id,
+            args.exit_on_page_load, jwt_token_pool, args.web_server_workers, args.web_server_keep_alive_timeout,
+            identity_resolver, jwt_claim_template)
+    finally:
+        # The open engine sessions would keep the process from exiting
+        engine_session_pool.session_pool.close()
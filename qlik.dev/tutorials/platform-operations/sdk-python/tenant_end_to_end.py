@@ -11,19 +11,107 @@ For a detailed overview of the supported arguments execute:
 """
 import argparse
 import logging
+import threading
+import time
 
 from argparse_logging import add_log_level_argument
 
+import app_export_cache
+import batch_runner
+import checkpoint
+import concurrency_controller
 import constants
+import engine_session_pool
 import qlik_sdk_helper
 import tenant_configure
 import tenant_create
 import tenant_deploy_content
 import tenant_embed_content
+import tenant_state
 from jwt_auth import JwtAuth, JwtIdpConfig
+from step_scheduler import Step, run_steps
 
 logger = logging.getLogger(__name__)
 
+# The embed step serves a web page on a fixed local address, so only one run can embed at a time
+embed_lock = threading.Lock()
+
+
+@concurrency_controller.limited
+def run(batch_result, source_tenant_sdk_client, tenant_registration_sdk_client, oauth_client_id, oauth_secret,
+        source_tenant_admin_email, source_app_id, jwt_idp_config, export_cache=None, assignment_plan=None,
+        desired_state=None, checkpoint_store=None, embed=True):
+    """
+    Creates, configures and deploys an app to a tenant and embeds the app in a local web page, unless `embed` is False.
+    Returns the ID of the published app.
+    """
+    run_name = batch_result.name
+
+    def create(_):
+        # Registering the tenant is recorded separately, so a failure while setting it up doesn't register another
+        tenant_id, tenant_hostname = checkpoint.run_stage(
+            checkpoint_store, run_name, "register",
+            lambda: tenant_create.register_tenant(source_tenant_sdk_client, tenant_registration_sdk_client),
+            to_outputs=lambda registered_tenant: {"tenant_id": registered_tenant[0],
+                                                  "hostname": registered_tenant[1]},
+            from_outputs=lambda outputs: (outputs["tenant_id"], outputs["hostname"]))
+
+        target_tenant_sdk_client = checkpoint.run_stage(
+            checkpoint_store, run_name, "create",
+            lambda: tenant_create.run(source_tenant_sdk_client, tenant_registration_sdk_client, oauth_client_id,
+                                      oauth_secret, source_tenant_admin_email, (tenant_id, tenant_hostname)),
+            to_outputs=lambda _: {"tenant_id": tenant_id, "hostname": tenant_hostname},
+            from_outputs=lambda outputs: qlik_sdk_helper.create_sdk_client(oauth_client_id, oauth_secret,
+                                                                           outputs["hostname"]))
+        batch_result.name = f"{batch_result.name} ({target_tenant_sdk_client.config.host})"
+        return target_tenant_sdk_client
+
+    def export(_):
+        # The export doesn't depend on the new tenant, the deploy step imports the cached export
+        tenant_deploy_content.verify_bot_access_to_source_app(source_tenant_sdk_client, source_app_id)
+        tenant_deploy_content.export_app_to_cache(source_tenant_sdk_client, source_app_id, export_cache).close()
+
+    def configure(results):
+        return checkpoint.run_stage(
+            checkpoint_store, run_name, "configure",
+            lambda: tenant_state.run(results["create"], jwt_idp_config, assignment_plan, desired_state),
+            to_outputs=lambda space_ids: {"shared_space_id": space_ids[0], "managed_space_id": space_ids[1]},
+            from_outputs=lambda outputs: (outputs["shared_space_id"], outputs["managed_space_id"]))
+
+    def deploy(results):
+        target_shared_space_id, target_managed_space_id = results["configure"]
+        return checkpoint.run_stage(
+            checkpoint_store, run_name, "deploy",
+            lambda: tenant_deploy_content.run(source_tenant_sdk_client, source_app_id, results["create"],
+                                              target_shared_space_id, target_managed_space_id, jwt_idp_config,
+                                              export_cache=export_cache),
+            to_outputs=lambda published_app_id: {"published_app_id": published_app_id},
+            from_outputs=lambda outputs: outputs["published_app_id"])
+
+    def embed_content(results):
+        jwt_auth = JwtAuth(results["create"].config.host, jwt_idp_config, subject=f"test_user", name=f"test_user",
+                           email=f"test_user@jwt.io", groups=[constants.GROUP_ANALYTICS_CONSUMER])
+        with embed_lock:
+            checkpoint.run_stage(
+                checkpoint_store, run_name, "embed",
+                lambda: tenant_embed_content.run(jwt_auth, results["create"], results["deploy"], None, True),
+                to_outputs=lambda _: {})
+
+    steps = [Step("create", create),
+             Step("configure", configure, depends_on=("create",))]
+    if embed:
+        steps.append(Step("embed", embed_content, depends_on=("create", "deploy")))
+    # The export is only needed when the app hasn't been deployed yet
+    if export_cache and not (checkpoint_store and checkpoint_store.get(run_name, "deploy") is not None):
+        steps += [Step("export", export), Step("deploy", deploy, depends_on=("create", "configure", "export"))]
+    else:
+        steps.append(Step("deploy", deploy, depends_on=("create", "configure")))
+
+    results = run_steps(steps, f"the end to end run '{batch_result.name}'", timings=batch_result.timings)
+
+    logger.info(f"Successfully completed an end to end run for tenant '{results['create'].config.host}'.")
+    return results["deploy"]
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -33,6 +121,15 @@ if __name__ == "__main__":
     parser.add_argument("--tenant-registration-hostname", required=True,
                         help="The Qlik tenant registration hostname, for example: register.<REGION>.qlikcloud.com")
     parser.add_argument("--iterations", required=False, type=int, default=1, help="The number of time to execute the end to end run.")
+    parser.add_argument("--concurrency", required=False, type=int, default=1,
+                        help="The maximum number of end to end runs (tenants) to execute at the same time.")
+    parser.add_argument("--assignment-plan", required=False,
+                        help="A JSON file listing the space assignments to apply when configuring each tenant, see tenant_configure.py.")
+    parser.add_argument("--desired-state", required=False,
+                        help="A JSON file with the desired state to configure each tenant with, see tenant_state.py.")
+    parser.add_argument("--skip-embed", required=False, action="store_true", default=False,
+                        help="Don't embed the published app in a local web page, which opens a browser for every tenant.")
+    checkpoint.add_checkpoint_arguments(parser)
 
     jwt_group = parser.add_argument_group("Target Tenant JWT IdP Configuration")
     jwt_group.add_argument("--jwt-issuer", required=False, help="The 'issuer' field to use in the JWT.")
@@ -47,9 +144,13 @@ if __name__ == "__main__":
                                      help="The email address of a tenant admin in the source tenant. If this is provided the tenant admin from the source tenant will be given access to the new tenant.")
     source_tenant_group.add_argument("--source-app-id", required=True,
                                      help="The ID of the app in the source tenant to deploy to the target tenant.")
+    app_export_cache.add_export_cache_arguments(source_tenant_group)
+
+    qlik_sdk_helper.add_sdk_client_arguments(parser)
 
     args = parser.parse_args()
     logging.basicConfig(level=args.log_level)
+    qlik_sdk_helper.configure_sdk_clients(args)
 
     jwt_idp_config = JwtIdpConfig(args.jwt_issuer, args.jwt_key_id, args.jwt_private_key, args.jwt_public_key)
     if not jwt_idp_config.validate():
@@ -61,20 +162,36 @@ if __name__ == "__main__":
     tenant_registration_sdk_client = qlik_sdk_helper.create_sdk_client(args.client_id, args.client_secret,
                                                                        args.tenant_registration_hostname)
 
-    for i in range(0, args.iterations):
-        if args.iterations > 1:
-            logger.info(f"***** Executing iteration #{i+1}...")
+    export_cache = app_export_cache.create_export_cache(args)
+    checkpoint_store = checkpoint.create_checkpoint_store(parser, args)
 
-        target_tenant_sdk_client = tenant_create.run(source_tenant_sdk_client, tenant_registration_sdk_client,
-                                                     args.client_id, args.client_secret, args.source_tenant_admin_email)
+    assignment_plan = None
+    if args.assignment_plan:
+        assignment_plan = tenant_configure.read_assignment_plan(args.assignment_plan)
 
-        target_shared_space_id, target_managed_space_id = tenant_configure.run(target_tenant_sdk_client, jwt_idp_config)
-        published_app_id = tenant_deploy_content.run(source_tenant_sdk_client, args.source_app_id, target_tenant_sdk_client,
-                                  target_shared_space_id,
-                                  target_managed_space_id, jwt_idp_config)
+    desired_state = None
+    if args.desired_state:
+        desired_state = tenant_state.read_desired_state(args.desired_state)
 
-        jwt_auth = JwtAuth(target_tenant_sdk_client.config.host, jwt_idp_config, subject=f"test_user", name=f"test_user",
-                           email=f"test_user@jwt.io", groups=[constants.GROUP_ANALYTICS_CONSUMER])
-        tenant_embed_content.run(jwt_auth, target_tenant_sdk_client, published_app_id, None, True)
+    def create_task(iteration):
+        def task(batch_result):
+            if args.iterations > 1:
+                logger.info(f"***** Executing iteration #{iteration}...")
+
+            return run(batch_result, source_tenant_sdk_client, tenant_registration_sdk_client, args.client_id,
+                       args.client_secret, args.source_tenant_admin_email, args.source_app_id, jwt_idp_config,
+                       export_cache, assignment_plan, desired_state, checkpoint_store, not args.skip_embed)
+
+        return f"iteration #{iteration}", task
 
-        logger.info("Successfully completed an end to end run.")
+    start_time = time.perf_counter()
+    try:
+        batch_results = batch_runner.run_batch([create_task(i + 1) for i in range(0, args.iterations)],
+                                               args.concurrency)
+    finally:
+        # The open engine sessions would keep the process from exiting
+        engine_session_pool.session_pool.close()
+    batch_runner.log_summary(batch_results, time.perf_counter() - start_time)
+
+    if not all(batch_result.succeeded for batch_result in batch_results):
+        exit(1)
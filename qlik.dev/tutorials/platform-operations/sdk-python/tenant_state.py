@@ -0,0 +1,392 @@
+"""
+Reconciles the configuration of a tenant with a desired state, so configuring a tenant that is already (partially)
+configured only applies the changes that are missing.
+
+A desired state file is a JSON object, every field is optional, for example:
+
+    {
+        "group_settings": {"autoCreateGroups": true},
+        "license_settings": {"autoAssignProfessional": true, "autoAssignAnalyzer": true},
+        "jwt_identity_provider": true,
+        "spaces": [
+            {"name": "platform-ops-example-shared", "type": "shared"},
+            {"name": "platform-ops-example-managed", "type": "managed"}
+        ],
+        "assignments": [
+            {"space": "platform-ops-example-managed", "assignee": "AnalyticConsumers", "roles": ["consumer"]}
+        ]
+    }
+
+The assignments use the format of the assignment plan of tenant_configure.py.
+
+For a detailed overview of the supported arguments execute:
+
+    python tenant_state.py --help
+"""
+import argparse
+import json
+import logging
+from dataclasses import dataclass, field
+
+from argparse_logging import add_log_level_argument
+from qlik_sdk import SpaceCreate
+
+import concurrency_controller
+import constants
+import pagination
+import qlik_sdk_helper
+import tenant_configure
+from jwt_auth import JwtIdpConfig
+from step_scheduler import Step, run_steps
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DesiredSpace:
+    name: str
+    type: str
+
+
+@dataclass
+class DesiredTenantState:
+    group_settings: dict = field(default_factory=dict)
+    license_settings: dict = field(default_factory=dict)
+    jwt_identity_provider: bool = False
+    spaces: list = field(default_factory=list)
+    assignments: list = field(default_factory=list)
+
+
+@dataclass
+class CurrentTenantState:
+    group_settings: dict
+    license_settings: dict
+    jwt_identity_provider: dict
+    # The space (or None if it doesn't exist) and its assignments, by space name
+    spaces: dict
+    assignments: dict
+
+
+@dataclass
+class TenantChanges:
+    group_settings: dict = field(default_factory=dict)
+    license_settings: dict = field(default_factory=dict)
+    create_jwt_identity_provider: bool = False
+    spaces_to_create: list = field(default_factory=list)
+    assignments_to_create: list = field(default_factory=list)
+    # (space name, assignment ID, SpaceAssignment) of existing assignments with other roles
+    assignments_to_update: list = field(default_factory=list)
+
+    def count(self):
+        return (len(self.group_settings) + (1 if self.license_settings else 0)
+                + (1 if self.create_jwt_identity_provider else 0) + len(self.spaces_to_create)
+                + len(self.assignments_to_create) + len(self.assignments_to_update))
+
+
+def get_default_desired_state(assignment_plan=None):
+    """
+    The desired state of the 'Configure a tenant' tutorial.
+    """
+    return DesiredTenantState(
+        group_settings={"autoCreateGroups": True},
+        license_settings={"autoAssignProfessional": True, "autoAssignAnalyzer": True},
+        jwt_identity_provider=True,
+        spaces=[DesiredSpace(constants.SPACE_SHARED_DEV, "shared"), DesiredSpace(constants.SPACE_MANAGED_PROD, "managed")],
+        assignments=assignment_plan or tenant_configure.get_default_assignment_plan())
+
+
+def read_desired_state(file_path):
+    with open(file_path, "r") as file:
+        entries = json.load(file)
+
+    spaces = []
+    for entry in entries.get("spaces", []):
+        if not entry.get("name") or entry.get("type") not in ("shared", "managed"):
+            raise ValueError(f"The space {entry} in the desired state '{file_path}' needs a 'name' and a 'type' of 'shared' or 'managed'.")
+        spaces.append(DesiredSpace(entry["name"], entry["type"]))
+
+    assignments = tenant_configure.parse_assignment_plan(entries.get("assignments", []), file_path)
+
+    logger.info(f"Read the desired state with {len(spaces)} spaces and {len(assignments)} assignments from '{file_path}'.")
+    return DesiredTenantState(entries.get("group_settings", {}), entries.get("license_settings", {}),
+                              entries.get("jwt_identity_provider", False), spaces, assignments)
+
+
+def _get_json(sdk_client, path):
+    return json.loads(sdk_client.rest(path=path, method="GET").text)
+
+
+def _find_jwt_identity_provider(sdk_client, jwt_idp_config):
+    def is_jwt_identity_provider(identity_provider):
+        options = identity_provider.get("options") or {}
+        return (identity_provider.get("protocol") == "jwtAuth"
+                and options.get("issuer") == jwt_idp_config.issuer
+                and any(key.get("kid") == jwt_idp_config.key_id for key in options.get("staticKeys") or []))
+
+    return pagination.find_first(sdk_client, "/api/v1/identity-providers", is_jwt_identity_provider)
+
+
+def _find_space(sdk_client, space_name):
+    return pagination.find_first(sdk_client, "/api/v1/spaces", lambda space: space["name"] == space_name,
+                                 params={"name": space_name, "limit": 100})
+
+
+def _list_assignments(sdk_client, space):
+    if not space:
+        return []
+    return list(pagination.paginate(sdk_client, f"/api/v1/spaces/{space['id']}/assignments"))
+
+
+def fetch_current_state(sdk_client, desired_state, jwt_idp_config, concurrency=8):
+    """
+    Retrieves the parts of the tenant configuration covered by the desired state with concurrent GET requests.
+    """
+    space_names = list(dict.fromkeys(
+        [space.name for space in desired_state.spaces]
+        + [assignment.space for assignment in desired_state.assignments]))
+    group_names = list(dict.fromkeys(
+        assignment.assignee for assignment in desired_state.assignments if assignment.assignee_type == "group"))
+
+    steps = []
+    if desired_state.group_settings:
+        steps.append(Step("get group settings", lambda _: _get_json(sdk_client, "/api/v1/groups/settings")))
+    if desired_state.license_settings:
+        steps.append(Step("get license settings", lambda _: _get_json(sdk_client, "/api/v1/licenses/settings")))
+    if desired_state.jwt_identity_provider:
+        steps.append(Step("find jwt idp", lambda _: _find_jwt_identity_provider(sdk_client, jwt_idp_config)))
+    for space_name in space_names:
+        steps.append(Step(f"find space {space_name}",
+                          lambda _, space_name=space_name: _find_space(sdk_client, space_name)))
+        # The assignments can only be listed once the space ID is known
+        steps.append(Step(f"list assignments {space_name}",
+                          lambda results, space_name=space_name: _list_assignments(
+                              sdk_client, results[f"find space {space_name}"]),
+                          depends_on=(f"find space {space_name}",)))
+    for group_name in group_names:
+        # Resolving the groups fills the group ID cache used to compare and apply the assignments
+        steps.append(Step(f"find group {group_name}",
+                          lambda _, group_name=group_name: tenant_configure.resolve_group_id(sdk_client, group_name)))
+
+    results = run_steps(steps, f"reading the state of tenant '{sdk_client.config.host}'", concurrency)
+
+    return CurrentTenantState(
+        results.get("get group settings", {}),
+        results.get("get license settings", {}),
+        results.get("find jwt idp"),
+        {space_name: results[f"find space {space_name}"] for space_name in space_names},
+        {space_name: results[f"list assignments {space_name}"] for space_name in space_names})
+
+
+def _get_assignee_id(sdk_client, assignment):
+    if assignment.assignee_type == "group":
+        return tenant_configure.resolve_group_id(sdk_client, assignment.assignee)
+    return assignment.assignee
+
+
+def diff(sdk_client, desired_state, current_state):
+    """
+    Returns the TenantChanges needed to bring the tenant from the current state to the desired state. Nothing is
+    removed from the tenant, settings, spaces and assignments that aren't in the desired state are left as they are.
+    """
+    changes = TenantChanges()
+    changes.group_settings = {name: value for name, value in desired_state.group_settings.items()
+                              if current_state.group_settings.get(name) != value}
+    if any(current_state.license_settings.get(name) != value
+           for name, value in desired_state.license_settings.items()):
+        changes.license_settings = dict(desired_state.license_settings)
+    changes.create_jwt_identity_provider = (desired_state.jwt_identity_provider
+                                            and not current_state.jwt_identity_provider)
+
+    for space in desired_state.spaces:
+        current_space = current_state.spaces.get(space.name)
+        if not current_space:
+            changes.spaces_to_create.append(space)
+        elif current_space["type"] != space.type:
+            raise ValueError(f"The space '{space.name}' is a {current_space['type']} space in tenant '{sdk_client.config.host}', the desired state has a {space.type} space.")
+
+    for assignment in desired_state.assignments:
+        assignee_id = _get_assignee_id(sdk_client, assignment)
+        current_assignment = None
+        if assignee_id:
+            current_assignment = next(
+                (current_assignment for current_assignment in current_state.assignments.get(assignment.space, [])
+                 if current_assignment["assigneeId"] == assignee_id
+                 and current_assignment["type"] == assignment.assignee_type), None)
+
+        if not current_assignment:
+            changes.assignments_to_create.append(assignment)
+        elif set(current_assignment["roles"]) != set(assignment.roles):
+            changes.assignments_to_update.append((assignment.space, current_assignment["id"], assignment))
+
+    return changes
+
+
+def _update_group_settings(sdk_client, group_settings):
+    sdk_client.rest(
+        path="/api/v1/groups/settings",
+        method="PATCH",
+        data=[{"op": "replace", "path": f"/{name}", "value": value} for name, value in group_settings.items()])
+
+    logger.info(f"Updated the group settings {group_settings} on tenant '{sdk_client.config.host}'.")
+
+
+def _update_license_settings(sdk_client, license_settings):
+    sdk_client.rest(
+        path="/api/v1/licenses/settings",
+        method="PUT",
+        data=license_settings)
+
+    logger.info(f"Updated the license settings {license_settings} on tenant '{sdk_client.config.host}'.")
+
+
+def _create_space(sdk_client, space):
+    created_space = sdk_client.spaces.create(SpaceCreate(name=space.name, type=space.type))
+
+    logger.info(
+        f"Created the {space.type} space '{created_space.name}' with ID '{created_space.id}' in tenant '{sdk_client.config.host}'.")
+    return {"id": created_space.id, "name": created_space.name, "type": space.type}
+
+
+def _update_assignment_roles(sdk_client, space_id, assignment_id, roles):
+    sdk_client.rest(
+        path=f"/api/v1/spaces/{space_id}/assignments/{assignment_id}",
+        method="PUT",
+        data={"roles": roles})
+
+    logger.info(
+        f"Updated the roles of the assignment with ID '{assignment_id}' in the space with ID '{space_id}' to '{roles}' in tenant '{sdk_client.config.host}'.")
+
+
+def apply(sdk_client, changes, current_state, jwt_idp_config, concurrency=8):
+    """
+    Applies the changes and returns the IDs of all the spaces of the desired state by name. The changes run as a
+    dependency graph: the settings, the identity provider, the spaces and the role updates are changed concurrently,
+    new groups wait for the group settings and the identity provider, new assignments wait for their space and group.
+    """
+    spaces = {space_name: space for space_name, space in current_state.spaces.items() if space}
+
+    steps = []
+    if changes.group_settings:
+        steps.append(Step("update group settings",
+                          lambda _: _update_group_settings(sdk_client, changes.group_settings)))
+    if changes.license_settings:
+        steps.append(Step("update license settings",
+                          lambda _: _update_license_settings(sdk_client, changes.license_settings)))
+    if changes.create_jwt_identity_provider:
+        steps.append(Step("create jwt idp", lambda _: tenant_configure.configure_jwt_idp(sdk_client, jwt_idp_config)))
+    for space in changes.spaces_to_create:
+        steps.append(Step(f"create space {space.name}", lambda _, space=space: _create_space(sdk_client, space)))
+    for space_name, assignment_id, assignment in changes.assignments_to_update:
+        steps.append(Step(f"update assignment {assignment.assignee} in {space_name}",
+                          lambda _, space_name=space_name, assignment_id=assignment_id, assignment=assignment:
+                          _update_assignment_roles(sdk_client, spaces[space_name]["id"], assignment_id,
+                                                   assignment.roles)))
+
+    if changes.assignments_to_create:
+        group_names = list(dict.fromkeys(assignment.assignee for assignment in changes.assignments_to_create
+                                         if assignment.assignee_type == "group"))
+        # New groups are created by signing in a user with the group, which needs the settings and IdP above
+        steps.append(Step("create groups",
+                          lambda _: tenant_configure.create_groups(sdk_client, group_names, jwt_idp_config,
+                                                                   concurrency),
+                          depends_on=tuple(step.name for step in steps
+                                           if step.name in ("update group settings", "create jwt idp"))))
+
+        def create_assignments(results):
+            created_spaces = {space_name: results[f"create space {space_name}"]
+                              for space_name in assignment_space_names if f"create space {space_name}" in results}
+            return tenant_configure.apply_assignment_plan(
+                sdk_client, changes.assignments_to_create, jwt_idp_config,
+                spaces={space_name: sdk_client.spaces.get(space["id"])
+                        for space_name, space in {**spaces, **created_spaces}.items()
+                        if space_name in assignment_space_names},
+                concurrency=concurrency)
+
+        assignment_space_names = {assignment.space for assignment in changes.assignments_to_create}
+        steps.append(Step("create assignments", create_assignments,
+                          depends_on=("create groups",) + tuple(f"create space {space.name}"
+                                                                for space in changes.spaces_to_create
+                                                                if space.name in assignment_space_names)))
+
+    results = run_steps(steps, f"configuring tenant '{sdk_client.config.host}'", concurrency)
+
+    for space in changes.spaces_to_create:
+        spaces[space.name] = results[f"create space {space.name}"]
+
+    return {space_name: space["id"] for space_name, space in spaces.items()}
+
+
+def reconcile(sdk_client, desired_state, jwt_idp_config, concurrency=8):
+    """
+    Brings the tenant to the desired state and returns the IDs of the spaces by name. A tenant that is already in the
+    desired state is only read.
+    """
+    current_state = fetch_current_state(sdk_client, desired_state, jwt_idp_config, concurrency)
+    changes = diff(sdk_client, desired_state, current_state)
+
+    if not changes.count():
+        logger.info(f"The tenant '{sdk_client.config.host}' is already in the desired state.")
+        return {space_name: space["id"] for space_name, space in current_state.spaces.items() if space}
+
+    logger.info(f"Applying {changes.count()} changes to tenant '{sdk_client.config.host}'.")
+    return apply(sdk_client, changes, current_state, jwt_idp_config, concurrency)
+
+
+@concurrency_controller.limited
+def run(target_tenant_sdk_client, jwt_idp_config, assignment_plan=None, desired_state=None):
+    """
+    Brings the tenant to the desired state, by default the state of the 'Configure a tenant' tutorial with the
+    assignment plan. Only the missing configuration is applied, so running it again for a configured tenant doesn't
+    change anything. Returns the IDs of the first shared and the first managed space of the desired state.
+    """
+    desired_state = desired_state or get_default_desired_state(assignment_plan)
+    space_ids = reconcile(target_tenant_sdk_client, desired_state, jwt_idp_config)
+
+    shared_space_id = next((space_ids[space.name] for space in desired_state.spaces if space.type == "shared"), None)
+    managed_space_id = next((space_ids[space.name] for space in desired_state.spaces if space.type == "managed"), None)
+
+    logger.info(f"The tenant '{target_tenant_sdk_client.config.host}' has been configured.")
+    return shared_space_id, managed_space_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_log_level_argument(parser)
+    parser.add_argument("--client-id", required=True, help="The OAuth client ID.")
+    parser.add_argument("--client-secret", required=True, help="The OAuth client secret.")
+    parser.add_argument("--target-tenant-hostname", required=True,
+                        help="The hostname of the target tenant to configure, for example: tenant.region.qlikcloud.com")
+    parser.add_argument("--assignment-plan", required=False,
+                        help="A JSON file listing the 'space', 'assignee', 'roles' and optionally 'assignee_type' of the space assignments to apply, by default the analytics consumer group is assigned to the managed space.")
+    parser.add_argument("--desired-state", required=False,
+                        help="A JSON file with the desired state of the tenant, by default the configuration of the 'Configure a tenant' tutorial. Replaces the --assignment-plan.")
+
+    jwt_group = parser.add_argument_group("Target JWT IdP Configuration")
+    jwt_group.add_argument("--jwt-issuer", required=False, help="The 'issuer' field to use in the JWT.")
+    jwt_group.add_argument("--jwt-key-id", required=False, help="The 'kid' field to use in the JWT.")
+    jwt_group.add_argument("--jwt-private-key", required=False, help="The path to the local private key file.")
+    jwt_group.add_argument("--jwt-public-key", required=False, help="The path to the local public key file.")
+
+    qlik_sdk_helper.add_sdk_client_arguments(parser)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    qlik_sdk_helper.configure_sdk_clients(args)
+
+    jwt_idp_config = JwtIdpConfig(args.jwt_issuer, args.jwt_key_id, args.jwt_private_key, args.jwt_public_key)
+    if not jwt_idp_config.validate():
+        parser.print_help()
+        exit(1)
+
+    assignment_plan = None
+    if args.assignment_plan:
+        assignment_plan = tenant_configure.read_assignment_plan(args.assignment_plan)
+
+    desired_state = None
+    if args.desired_state:
+        desired_state = read_desired_state(args.desired_state)
+
+    target_tenant_sdk_client = qlik_sdk_helper.create_sdk_client(args.client_id, args.client_secret,
+                                                                 args.target_tenant_hostname)
+
+    run(target_tenant_sdk_client, jwt_idp_config, assignment_plan, desired_state)